@@ -0,0 +1,174 @@
+import math
+import numpy as np
+
+UNLIMITED = 0
+NO_EXPIRY = math.inf
+
+COUNTER_COLUMNS = ('last_rx', 'last_tx', 'total_rx', 'total_tx', 'limit')
+
+class AccountingResult:
+    __slots__ = ('changed', 'delta', 'breached', 'expired')
+
+    def __init__(self, changed, delta, breached, expired):
+        self.changed = changed
+        self.delta = delta
+        self.breached = breached
+        self.expired = expired
+
+# Per-peer counters live in parallel NumPy columns indexed by slot, so a
+# whole `wg show dump` snapshot is applied with a handful of array
+# operations instead of a Python loop per peer. Names map to slots through
+# a dict; released slots are reused.
+class AccountingEngine:
+    def __init__(self, capacity=1024):
+        self.capacity = 0
+        self.slots = {}
+        self.names = []
+        self.pending = {}
+        self._free = []
+        self.last_rx = np.zeros(0, dtype=np.uint64)
+        self.last_tx = np.zeros(0, dtype=np.uint64)
+        self.total_rx = np.zeros(0, dtype=np.uint64)
+        self.total_tx = np.zeros(0, dtype=np.uint64)
+        self.limit = np.zeros(0, dtype=np.uint64)
+        self.expires_at = np.zeros(0, dtype=np.float64)
+        self.used = np.zeros(0, dtype=bool)
+        self._grow(capacity)
+
+    def __len__(self):
+        return len(self.slots)
+
+    def __contains__(self, name):
+        return name in self.slots
+
+    def _grow(self, capacity):
+        old = self.capacity
+        for column in COUNTER_COLUMNS:
+            values = np.zeros(capacity, dtype=np.uint64)
+            values[:old] = getattr(self, column)
+            setattr(self, column, values)
+        expires_at = np.full(capacity, NO_EXPIRY, dtype=np.float64)
+        expires_at[:old] = self.expires_at
+        self.expires_at = expires_at
+        used = np.zeros(capacity, dtype=bool)
+        used[:old] = self.used
+        self.used = used
+        self.names.extend([None] * (capacity - old))
+        self._free.extend(range(capacity - 1, old - 1, -1))
+        self.capacity = capacity
+
+    def add(self, name, total_rx=0, total_tx=0, last_rx=0, last_tx=0):
+        slot = self.slots.get(name)
+        if slot is None:
+            if not self._free:
+                self._grow(max(self.capacity * 2, 1024))
+            slot = self._free.pop()
+            self.slots[name] = slot
+            self.names[slot] = name
+            self.used[slot] = True
+        self.total_rx[slot] = total_rx
+        self.total_tx[slot] = total_tx
+        self.last_rx[slot] = last_rx
+        self.last_tx[slot] = last_tx
+        limit, expires_at = self.pending.pop(name, (UNLIMITED, NO_EXPIRY))
+        self.limit[slot] = limit
+        self.expires_at[slot] = expires_at
+        return slot
+
+    def release(self, name):
+        self.pending.pop(name, None)
+        slot = self.slots.pop(name, None)
+        if slot is None:
+            return False
+        for column in COUNTER_COLUMNS:
+            getattr(self, column)[slot] = 0
+        self.expires_at[slot] = NO_EXPIRY
+        self.used[slot] = False
+        self.names[slot] = None
+        self._free.append(slot)
+        return True
+
+    def set_subscription(self, name, limit=None, expires_at=None):
+        slot = self.slots.get(name)
+        if slot is None:
+            current = self.pending.get(name, (UNLIMITED, NO_EXPIRY))
+            self.pending[name] = (
+                current[0] if limit is None else limit,
+                current[1] if expires_at is None else expires_at
+            )
+            return
+        if limit is not None:
+            self.limit[slot] = limit
+        if expires_at is not None:
+            self.expires_at[slot] = expires_at
+
+    def traffic(self, name):
+        slot = self.slots[name]
+        return {
+            'total_incoming': int(self.total_rx[slot]),
+            'total_outgoing': int(self.total_tx[slot]),
+            'last_incoming': int(self.last_rx[slot]),
+            'last_outgoing': int(self.last_tx[slot])
+        }
+
+    def slots_of(self, names):
+        return np.fromiter((self.slots[name] for name in names), dtype=np.intp, count=len(names))
+
+    def update(self, name, rx, tx):
+        slot = self.slots[name]
+        last_rx = int(self.last_rx[slot])
+        last_tx = int(self.last_tx[slot])
+        delta_rx = rx - last_rx if rx >= last_rx else rx
+        delta_tx = tx - last_tx if tx >= last_tx else tx
+        self.total_rx[slot] += delta_rx
+        self.total_tx[slot] += delta_tx
+        self.last_rx[slot] = rx
+        self.last_tx[slot] = tx
+        return delta_rx + delta_tx
+
+    def rebaseline(self, names):
+        # Counters of a recreated interface start from zero; resetting the
+        # baseline counts them in full even if they have already grown past
+        # the last sample by the next tick.
+        slots = np.fromiter((self.slots[name] for name in names if name in self.slots), dtype=np.intp)
+        self.last_rx[slots] = 0
+        self.last_tx[slots] = 0
+        return len(slots)
+
+    def apply(self, slots, rx, tx, now=None):
+        slots = np.asarray(slots, dtype=np.intp)
+        rx = np.asarray(rx, dtype=np.uint64)
+        tx = np.asarray(tx, dtype=np.uint64)
+        if len(slots):
+            # A peer reported by several nodes counts once: keep its first row.
+            slots, first = np.unique(slots, return_index=True)
+            rx = rx[first]
+            tx = tx[first]
+        previous_rx = self.last_rx[slots]
+        previous_tx = self.last_tx[slots]
+        # A counter below the previous sample means the interface was
+        # restarted; everything it shows now was transferred after the reset.
+        delta_rx = np.where(rx >= previous_rx, rx - previous_rx, rx)
+        delta_tx = np.where(tx >= previous_tx, tx - previous_tx, tx)
+        self.total_rx[slots] += delta_rx
+        self.total_tx[slots] += delta_tx
+        self.last_rx[slots] = rx
+        self.last_tx[slots] = tx
+        delta = delta_rx + delta_tx
+        moved = delta > 0
+        return AccountingResult(
+            slots[moved],
+            delta[moved],
+            self.breached(),
+            self.expired(now) if now is not None else np.zeros(0, dtype=np.intp)
+        )
+
+    def breached(self):
+        total = self.total_rx + self.total_tx
+        return np.flatnonzero(self.used & (self.limit > 0) & (total >= self.limit))
+
+    def expired(self, now):
+        return np.flatnonzero(self.used & (self.expires_at <= now))
+
+    def names_of(self, slots):
+        return [self.names[slot] for slot in slots]
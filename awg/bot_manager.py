@@ -1,4 +1,20 @@
+import time
+process_started = time.perf_counter()
+
 import db
+import nodes
+import peers
+import metrics
+import profiling
+import timeseries
+import reports
+import reclaim
+from container_events import ContainerWatcher
+from expiry import ExpiryEngine
+from limits import LimitPlanner
+from accounting import AccountingEngine, UNLIMITED, NO_EXPIRY
+from payments import YooKassaClient, PaymentError
+from payment_queue import PaymentQueue, RetryLater
 import aiohttp
 import logging
 import asyncio
@@ -7,28 +23,29 @@ import os
 import re
 import tempfile
 import json
-import subprocess
 import sys
 import pytz
-import zipfile
 import ipaddress
-import humanize
 import shutil
+import signal
 from aiogram import Bot, types
+from aiogram.bot.api import TelegramAPIServer, TELEGRAM_PRODUCTION
 from aiogram.dispatcher import Dispatcher
 from aiogram.dispatcher.middlewares import BaseMiddleware
 from aiogram.utils import executor
+from contextlib import asynccontextmanager
+from aiogram.dispatcher.webhook import WebhookRequestHandler
 from aiogram.types import InlineKeyboardMarkup, InlineKeyboardButton
 from datetime import datetime, timedelta
 from apscheduler.schedulers.asyncio import AsyncIOScheduler
-from apscheduler.triggers.date import DateTrigger
 from apscheduler.triggers.interval import IntervalTrigger
-from yookassa import Configuration, Payment
 from aiohttp import web
 
 logging.basicConfig(level=logging.INFO)
 logger = logging.getLogger(__name__)
 
+startup_timings = {'imports': time.perf_counter() - process_started}
+
 setting = db.get_config()
 bot_token = setting.get('bot_token')
 admin_id = setting.get('admin_id')
@@ -40,14 +57,51 @@ if not all([bot_token, admin_id, wg_config_file, docker_container, endpoint]):
     logger.error("Некоторые обязательные настройки отсутствуют в конфигурационном файле.")
     sys.exit(1)
 
-bot = Bot(bot_token)
+TELEGRAM_API_SERVER = setting.get('telegram_api_server', '').rstrip('/')
+
+bot = Bot(bot_token, server=TelegramAPIServer.from_base(TELEGRAM_API_SERVER) if TELEGRAM_API_SERVER else TELEGRAM_PRODUCTION)
 admin = int(admin_id)
 WG_CONFIG_FILE = wg_config_file
 DOCKER_CONTAINER = docker_container
 ENDPOINT = endpoint
 
-Configuration.account_id = '993270'
-Configuration.secret_key = 'test_cE-RElZLKakvb585wjrh9XAoqGSyS_rcmta2v1MdURE'
+UPDATE_MODE = setting.get('update_mode', 'polling').strip().lower()
+WEBAPP_HOST = setting.get('webapp_host', 'localhost')
+WEBAPP_PORT = int(setting.get('webapp_port', 8080))
+WEBHOOK_PATH = setting.get('webhook_path', '/telegram-webhook')
+WEBHOOK_URL = setting.get('webhook_url', '').rstrip('/')
+WEBHOOK_SECRET = setting.get('webhook_secret', '')
+
+STARTUP_BUDGET = float(setting.get('startup_budget', 5))
+PEER_NAMES_PROBE_INTERVAL = int(setting.get('peer_names_probe_interval', 15))
+NODE_BALANCE = setting.get('node_balance', 'peers').strip().lower()
+SLOW_HANDLER_THRESHOLD = float(setting.get('slow_handler_threshold', 1.0))
+LOOP_LAG_THRESHOLD = float(setting.get('loop_lag_threshold', 0.25))
+TRAFFIC_CHECK_PEAK_MBPS = float(setting.get('traffic_check_peak_mbps', 100))
+TRAFFIC_CHECK_MIN_INTERVAL = float(setting.get('traffic_check_min_interval', 5))
+TRAFFIC_CHECK_MAX_INTERVAL = float(setting.get('traffic_check_max_interval', 3600))
+TRAFFIC_HISTORY_SAVE_INTERVAL = int(setting.get('traffic_history_save_interval', 5))
+SLOT_POOL_SIZE = int(setting.get('slot_pool_size', 0))
+SLOT_POOL_REFILL_INTERVAL = int(setting.get('slot_pool_refill_interval', 5))
+REPORT_TOP_K = int(setting.get('report_top_k', 20))
+IDLE_REPORT_DAYS = int(setting.get('idle_report_days', 30))
+IDLE_RECLAIM_DAYS = int(setting.get('idle_reclaim_days', 90))
+
+if UPDATE_MODE not in ('polling', 'webhook'):
+    logger.error(f"Некорректное значение update_mode: {UPDATE_MODE}. Допустимо: polling, webhook.")
+    sys.exit(1)
+
+YOOKASSA_ACCOUNT_ID = setting.get('yookassa_account_id', '')
+YOOKASSA_SECRET_KEY = setting.get('yookassa_secret_key', '')
+YOOKASSA_API_URL = setting.get('yookassa_api_url', 'https://api.yookassa.ru/v3')
+YOOKASSA_TIMEOUT = float(setting.get('yookassa_timeout', 10))
+YOOKASSA_RETRIES = int(setting.get('yookassa_retries', 3))
+PAYMENT_WORKERS = int(setting.get('payment_workers', 4))
+PAYMENT_MAX_ATTEMPTS = int(setting.get('payment_max_attempts', 6))
+
+payment_api = None
+if YOOKASSA_ACCOUNT_ID and YOOKASSA_SECRET_KEY:
+    payment_api = YooKassaClient(YOOKASSA_ACCOUNT_ID, YOOKASSA_SECRET_KEY, YOOKASSA_API_URL, YOOKASSA_TIMEOUT, YOOKASSA_RETRIES)
 
 VPN_PRICES = {
     '1': {'days': 30, 'price': 299},
@@ -61,10 +115,69 @@ class AdminMessageDeletionMiddleware(BaseMiddleware):
         if message.from_user.id == admin:
             asyncio.create_task(delete_message_after_delay(message.chat.id, message.message_id, delay=2))
 
+class StartupTimingMiddleware(BaseMiddleware):
+    def __init__(self):
+        super().__init__()
+        self.first_update_seen = False
+
+    async def on_pre_process_update(self, update: types.Update, data: dict):
+        if not self.first_update_seen:
+            self.first_update_seen = True
+            logger.info(f"Время до первого обновления: {time.perf_counter() - process_started:.3f} с")
+
+CALLBACK_PREFIXES = (
+    'add_user', 'duration_', 'traffic_limit_', 'client_', 'list_users', 'connections_', 'ip_info_',
+    'delete_user_', 'home', 'get_config', 'send_config_', 'create_backup', 'payments_page_', 'buy_',
+    'show_payment_options', 'reclaim_', 'resume_user_'
+)
+
+def callback_label(data):
+    for prefix in CALLBACK_PREFIXES:
+        if data and data.startswith(prefix):
+            return prefix.rstrip('_')
+    return 'other'
+
+def message_label(message):
+    command = message.get_command(pure=True) if message.is_command() else None
+    return command or message.content_type
+
+slow_handlers = profiling.SlowHandlers(SLOW_HANDLER_THRESHOLD)
+loop_lag_monitor = profiling.LoopLagMonitor(LOOP_LAG_THRESHOLD)
+profiling.instrument_module(db)
+
+class InstrumentationMiddleware(BaseMiddleware):
+    def begin(self, kind, label, data):
+        span = profiling.HandlerSpan(f"{kind}:{label}")
+        data['handler_span'] = span
+        data['handler_span_token'] = profiling.current_span.set(span)
+        loop_lag_monitor.track(span)
+
+    def end(self, kind, label, data):
+        span = data.pop('handler_span', None)
+        if span is None:
+            return
+        profiling.current_span.reset(data.pop('handler_span_token'))
+        loop_lag_monitor.untrack()
+        metrics.handler_latency.observe(span.finish(), kind=kind, handler=label)
+        slow_handlers.record(span)
+
+    async def on_pre_process_message(self, message: types.Message, data: dict):
+        self.begin('message', message_label(message), data)
+
+    async def on_post_process_message(self, message: types.Message, results, data: dict):
+        self.end('message', message_label(message), data)
+
+    async def on_pre_process_callback_query(self, callback_query: types.CallbackQuery, data: dict):
+        self.begin('callback', callback_label(callback_query.data), data)
+
+    async def on_post_process_callback_query(self, callback_query: types.CallbackQuery, results, data: dict):
+        self.end('callback', callback_label(callback_query.data), data)
+
 dp = Dispatcher(bot)
 scheduler = AsyncIOScheduler(timezone=pytz.UTC)
-scheduler.start()
 
+dp.middleware.setup(StartupTimingMiddleware())
+dp.middleware.setup(InstrumentationMiddleware())
 dp.middleware.setup(AdminMessageDeletionMiddleware())
 
 main_menu_markup = InlineKeyboardMarkup(row_width=1).add(
@@ -78,12 +191,87 @@ user_main_messages = {}
 isp_cache = {}
 ISP_CACHE_FILE = 'files/isp_cache.json'
 CACHE_TTL = timedelta(hours=24)
+TRAFFIC_HISTORY_FILE = 'files/traffic_history.bin'
+traffic_history = timeseries.TrafficSeriesStore(TRAFFIC_HISTORY_FILE)
+usage_reports = reports.UsageReports(REPORT_TOP_K)
+HANDSHAKE_LOG_FILE = 'files/handshakes.json'
+handshake_log = reclaim.HandshakeLog(HANDSHAKE_LOG_FILE)
+accounting_engine = AccountingEngine()
+EXPIRY_GRACE = 60
+SUSPEND_RETRY_MIN = 60
+SUSPEND_RETRY_MAX = 3600
+SUSPEND_SUMMARY_NAMES = 30
 
 TRAFFIC_LIMITS = ["5 GB", "10 GB", "30 GB", "100 GB", "Неограниченно"]
 
 def get_interface_name():
     return os.path.basename(WG_CONFIG_FILE).split('.')[0]
 
+async def get_all_clients():
+    results = await nodes.fan_out(db.get_client_list)
+    return peers.PeerRegistry.merged(results[node.name] for node in nodes.get_nodes() if node.name in results)
+
+def stale_note(node_names=None):
+    stale = [name for name in db.stale_nodes() if node_names is None or name in node_names]
+    if not stale:
+        return ""
+    return f"⚠️ Контейнер узла {', '.join(stale)} недоступен, показаны последние известные данные.\n\n"
+
+async def get_all_active_clients(node_list=None):
+    node_list = node_list if node_list is not None else nodes.get_nodes()
+    results = await nodes.fan_out(db.get_active_list, nodes=node_list)
+    active_clients = {}
+    for node in node_list:
+        for status in results.get(node.name, []):
+            active_clients.setdefault(status.name, status)
+    return active_clients
+
+async def pick_node_for_new_client():
+    node_list = nodes.get_nodes()
+    if len(node_list) == 1:
+        return node_list[0]
+    if NODE_BALANCE == 'traffic':
+        results = await nodes.fan_out(db.get_active_list, nodes=node_list)
+        load = {name: sum(sum(parse_transfer(client.transfer)) for client in clients) for name, clients in results.items()}
+    else:
+        results = await nodes.fan_out(db.get_client_list, nodes=node_list)
+        load = {name: len(clients) for name, clients in results.items()}
+    if not load:
+        logger.error("Ни один узел не ответил, клиент будет добавлен на основной узел.")
+        return node_list[0]
+    node_name = min(load, key=load.get)
+    logger.info(f"Выбран узел {node_name} для нового клиента (нагрузка по {NODE_BALANCE}: {load}).")
+    return nodes.get_node(node_name)
+
+slot_pool_lock = asyncio.Lock()
+payment_locks = {}
+slot_pool_available = {}
+
+async def provision_client(client_name, node):
+    if SLOT_POOL_SIZE:
+        if await profiling.run_in_executor(db.claim_slot, client_name, node):
+            metrics.cache_hit('slot_pool')
+            available = slot_pool_available[node.name] = max(slot_pool_available.get(node.name, 0) - 1, 0)
+            metrics.slot_pool.set(available, node=node.name)
+            # Refilling takes the same lock as claims, so it waits until the
+            # pool is half empty and then tops it up in one config write.
+            if available <= SLOT_POOL_SIZE // 2:
+                asyncio.create_task(refill_slot_pool())
+            return True
+        metrics.cache_miss('slot_pool')
+    return await profiling.run_in_executor(db.root_add, client_name, False, node)
+
+async def refill_slot_pool():
+    if not SLOT_POOL_SIZE or slot_pool_lock.locked():
+        return
+    async with slot_pool_lock:
+        for node in nodes.get_nodes():
+            available = await profiling.run_in_executor(db.count_slots, node)
+            if available < SLOT_POOL_SIZE:
+                available += await profiling.run_in_executor(db.provision_slots, SLOT_POOL_SIZE - available, node)
+            slot_pool_available[node.name] = available
+            metrics.slot_pool.set(available, node=node.name)
+
 async def load_isp_cache():
     global isp_cache
     if os.path.exists(ISP_CACHE_FILE):
@@ -104,7 +292,9 @@ async def get_isp_info(ip: str) -> str:
     now = datetime.now(pytz.UTC)
     if ip in isp_cache:
         if now - isp_cache[ip]['timestamp'] < CACHE_TTL:
+            metrics.cache_hit('isp')
             return isp_cache[ip]['isp']
+    metrics.cache_miss('isp')
     try:
         ip_obj = ipaddress.ip_address(ip)
         if ip_obj.is_private:
@@ -146,11 +336,8 @@ async def cleanup_connection_data(username: str):
         async with aiofiles.open(file_path, 'w') as f:
             await f.write(json.dumps(limited_ips))
 
-async def load_isp_cache_task():
-    await load_isp_cache()
-    scheduler.add_job(cleanup_isp_cache, 'interval', hours=1)
-
 def create_zip(backup_filepath):
+    import zipfile
     with zipfile.ZipFile(backup_filepath, 'w') as zipf:
         for main_file in ['awg-decode.py', 'newclient.sh', 'removeclient.sh']:
             if os.path.exists(main_file):
@@ -211,7 +398,6 @@ async def help_command_handler(message: types.Message):
     else:
         await message.answer("У вас нет доступа к этому боту.")
 
-@dp.message_handler()
 async def handle_messages(message: types.Message):
     if message.chat.id != admin:
         await message.answer("У вас нет доступа к этому боту.")
@@ -281,6 +467,14 @@ def parse_traffic_limit(traffic_limit: str) -> int:
     else:
         return None
 
+DURATIONS = {
+    '1h': timedelta(hours=1),
+    '1d': timedelta(days=1),
+    '1w': timedelta(weeks=1),
+    '1m': timedelta(days=30),
+    'unlimited': None
+}
+
 @dp.callback_query_handler(lambda c: c.data.startswith('duration_'))
 async def set_config_duration(callback: types.CallbackQuery):
     if callback.from_user.id != admin:
@@ -335,27 +529,12 @@ async def set_traffic_limit(callback_query: types.CallbackQuery):
     user_main_messages[admin]['traffic_limit'] = traffic_limit
     user_main_messages[admin]['state'] = None
     duration_choice = user_main_messages.get(admin, {}).get('duration_choice')
-    if duration_choice == '1h':
-        duration = timedelta(hours=1)
-    elif duration_choice == '1d':
-        duration = timedelta(days=1)
-    elif duration_choice == '1w':
-        duration = timedelta(weeks=1)
-    elif duration_choice == '1m':
-        duration = timedelta(days=30)
-    elif duration_choice == 'unlimited':
-        duration = None
-    else:
-        duration = None
+    duration = DURATIONS.get(duration_choice)
     if duration:
         expiration_time = datetime.now(pytz.UTC) + duration
         db.set_user_expiration(client_name, expiration_time, traffic_limit)
-        scheduler.add_job(
-            deactivate_user,
-            trigger=DateTrigger(run_date=expiration_time),
-            args=[client_name],
-            id=client_name
-        )
+        expiry_engine.schedule(client_name, expiration_time)
+        accounting_engine.set_subscription(client_name, expires_at=expiration_time.timestamp())
         confirmation_text = f"Пользователь **{client_name}** добавлен. \nКонфигурация истечет через **{duration_choice}**."
     else:
         db.set_user_expiration(client_name, None, traffic_limit)
@@ -364,8 +543,11 @@ async def set_traffic_limit(callback_query: types.CallbackQuery):
         confirmation_text += f"\nЛимит трафика: **{traffic_limit}**."
     else:
         confirmation_text += f"\nЛимит трафика: **♾️ Неограниченно**."
-    success = db.root_add(client_name, ipv6=False)
+    node = await pick_node_for_new_client()
+    success = await provision_client(client_name, node)
     if success:
+        reschedule_limit_check(client_name, traffic_limit)
+        usage_reports.idle.touch(client_name, time.time())
         try:
             conf_path = os.path.join('users', client_name, f'{client_name}.conf')
             vpn_key = ""
@@ -437,11 +619,12 @@ async def set_traffic_limit(callback_query: types.CallbackQuery):
 async def client_selected_callback(callback_query: types.CallbackQuery):
     _, username = callback_query.data.split('client_', 1)
     username = username.strip()
-    clients = db.get_client_list()
-    client_info = next((c for c in clients if c[0] == username), None)
+    clients = await get_all_clients()
+    client_info = clients.get(username)
     if not client_info:
         await callback_query.answer("Ошибка: пользователь не найден.", show_alert=True)
         return
+    client_node = nodes.get_node(client_info.node)
     expiration_time = db.get_user_expiration(username)
     traffic_limit = db.get_user_traffic_limit(username)
     status = "🔴 Офлайн"
@@ -450,10 +633,10 @@ async def client_selected_callback(callback_query: types.CallbackQuery):
     ipv4_address = "—"
     total_bytes = 0
     formatted_total = "0.00B"
-    active_clients = db.get_active_list()
-    active_info = next((ac for ac in active_clients if ac[0] == username), None)
+    active_clients = await get_all_active_clients([client_node])
+    active_info = active_clients.get(username)
     if active_info:
-        last_handshake_str = active_info[1]
+        last_handshake_str = active_info.latest_handshake
         if last_handshake_str.lower() not in ['never', 'нет данных', '-']:
             try:
                 last_handshake_dt = parse_relative_time(last_handshake_str)
@@ -463,18 +646,17 @@ async def client_selected_callback(callback_query: types.CallbackQuery):
                         status = "🟢 Онлайн"
                     else:
                         status = "❌ Офлайн"
-                    transfer = active_info[2]
+                    transfer = active_info.transfer
                     incoming_bytes, outgoing_bytes = parse_transfer(transfer)
                     incoming_traffic = f"↓{humanize_bytes(incoming_bytes)}"
                     outgoing_traffic = f"↑{humanize_bytes(outgoing_bytes)}"
-                    traffic_data = await update_traffic(username, incoming_bytes, outgoing_bytes)
+                    traffic_data = await read_traffic(username)
                     total_bytes = traffic_data.get('total_incoming', 0) + traffic_data.get('total_outgoing', 0)
                     formatted_total = humanize_bytes(total_bytes)
-                    if traffic_limit != "Неограниченно":
+                    if traffic_limit != "Неограниченно" and db.container_available(client_node):
                         limit_bytes = parse_traffic_limit(traffic_limit)
-                        if total_bytes >= limit_bytes:
-                            await deactivate_user(username)
-                            await callback_query.answer(f"Пользователь **{username}** превысил лимит трафика и был удален.", show_alert=True)
+                        if total_bytes >= limit_bytes and await suspend_user(username):
+                            await callback_query.answer(f"Пользователь **{username}** превысил лимит трафика и был приостановлен.", show_alert=True)
                             return
             except ValueError:
                 logger.error(f"Некорректный формат даты для пользователя {username}: {last_handshake_str}")
@@ -483,7 +665,9 @@ async def client_selected_callback(callback_query: types.CallbackQuery):
         traffic_data = await read_traffic(username)
         total_bytes = traffic_data.get('total_incoming', 0) + traffic_data.get('total_outgoing', 0)
         formatted_total = humanize_bytes(total_bytes)
-    allowed_ips = client_info[2]
+    if client_info.suspended:
+        status = "⏸ Приостановлен"
+    allowed_ips = client_info.allowed_ips
     ipv4_match = re.search(r'(\d{1,3}\.){3}\d{1,3}/\d+', allowed_ips)
     if ipv4_match:
         ipv4_address = ipv4_match.group(0)
@@ -520,12 +704,21 @@ async def client_selected_callback(callback_query: types.CallbackQuery):
         f"🔼 *Исходящий трафик:* {incoming_traffic}\n"
         f"🔽 *Входящий трафик:* {outgoing_traffic}\n"
         f"📊 *Всего:* ↑↓{formatted_total} из **{traffic_limit_display}**\n"
+        f"{format_usage_history(username)}"
     )
+    text = stale_note([client_info.node]) + text
     keyboard = InlineKeyboardMarkup(row_width=2)
     keyboard.add(
         InlineKeyboardButton("IP info", callback_data=f"ip_info_{username}"),
         InlineKeyboardButton("Подключения", callback_data=f"connections_{username}")
     )
+    if client_info.suspended:
+        keyboard.add(
+            InlineKeyboardButton("▶️ 1 день", callback_data=f"resume_user_1d_{username}"),
+            InlineKeyboardButton("▶️ 1 неделя", callback_data=f"resume_user_1w_{username}"),
+            InlineKeyboardButton("▶️ 1 месяц", callback_data=f"resume_user_1m_{username}"),
+            InlineKeyboardButton("▶️ Без ограничений", callback_data=f"resume_user_unlimited_{username}")
+        )
     keyboard.add(
         InlineKeyboardButton("Удалить", callback_data=f"delete_user_{username}")
     )
@@ -557,21 +750,18 @@ async def list_users_callback(callback_query: types.CallbackQuery):
     if callback_query.from_user.id != admin:
         await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
-    clients = db.get_client_list()
+    clients, active_clients = await asyncio.gather(get_all_clients(), get_all_active_clients())
     if not clients:
         await callback_query.answer("Список пользователей пуст.", show_alert=True)
         return
-    active_clients = db.get_active_list()
-    active_clients_dict = {}
-    for client in active_clients:
-        username = client[0]
-        last_handshake = client[1]
-        active_clients_dict[username] = last_handshake
     keyboard = InlineKeyboardMarkup(row_width=2)
     now = datetime.now(pytz.UTC)
     for client in clients:
-        username = client[0]
-        last_handshake_str = active_clients_dict.get(username)
+        username = client.name
+        if peers.is_slot_name(username):
+            continue
+        active_info = active_clients.get(username)
+        last_handshake_str = active_info.latest_handshake if active_info else None
         if last_handshake_str and last_handshake_str.lower() not in ['never', 'нет данных', '-']:
             try:
                 last_handshake_dt = parse_relative_time(last_handshake_str)
@@ -589,6 +779,8 @@ async def list_users_callback(callback_query: types.CallbackQuery):
                 status_display = f"❌(?d) {username}"
         else:
             status_display = f"❌(?d) {username}"
+        if client.suspended:
+            status_display = f"⏸ {username}"
         keyboard.insert(InlineKeyboardButton(status_display, callback_data=f"client_{username}"))
     keyboard.add(InlineKeyboardButton("Домой", callback_data="home"))
     main_chat_id = user_main_messages.get(admin, {}).get('chat_id')
@@ -598,14 +790,14 @@ async def list_users_callback(callback_query: types.CallbackQuery):
             await bot.edit_message_text(
                 chat_id=main_chat_id,
                 message_id=main_message_id,
-                text="Выберите пользователя:",
+                text=stale_note() + "Выберите пользователя:",
                 reply_markup=keyboard
             )
         except Exception as e:
             logger.error(f"Ошибка при редактировании сообщения: {e}")
             await callback_query.answer("Ошибка при обновлении сообщения.", show_alert=True)
     else:
-        sent_message = await callback_query.message.reply("Выберите пользователя:", reply_markup=keyboard)
+        sent_message = await callback_query.message.reply(stale_note() + "Выберите пользователя:", reply_markup=keyboard)
         user_main_messages[admin] = {'chat_id': sent_message.chat.id, 'message_id': sent_message.message_id}
         try:
             await bot.pin_chat_message(chat_id=sent_message.chat.id, message_id=sent_message.message_id, disable_notification=True)
@@ -654,10 +846,11 @@ async def client_connections_callback(callback_query: types.CallbackQuery):
 async def ip_info_callback(callback_query: types.CallbackQuery):
     _, username = callback_query.data.split('ip_info_', 1)
     username = username.strip()
-    active_clients = db.get_active_list()
-    active_info = next((ac for ac in active_clients if ac[0] == username), None)
+    client_node = await profiling.run_in_executor(db.find_client_node, username)
+    active_clients = await get_all_active_clients([client_node] if client_node else None)
+    active_info = active_clients.get(username)
     if active_info:
-        endpoint = active_info[3]
+        endpoint = active_info.endpoint
         ip_address = endpoint.split(':')[0]
     else:
         await callback_query.answer("Нет информации о подключении пользователя.", show_alert=True)
@@ -709,13 +902,17 @@ async def ip_info_callback(callback_query: types.CallbackQuery):
 @dp.callback_query_handler(lambda c: c.data.startswith('delete_user_'))
 async def client_delete_callback(callback_query: types.CallbackQuery):
     username = callback_query.data.split('delete_user_')[1]
-    success = db.deactive_user_db(username)
+    success = await profiling.run_in_executor(db.deactive_user_db, username)
     if success:
         db.remove_user_expiration(username)
-        try:
-            scheduler.remove_job(job_id=username)
-        except:
-            pass
+        expiry_engine.cancel(username)
+        forget_suspend_retry(username)
+        limit_checks.cancel(username)
+        limit_planner.forget(username)
+        traffic_history.forget(username)
+        usage_reports.forget(username)
+        accounting_engine.release(username)
+        metrics.forget_client(username)
         user_dir = os.path.join('users', username)
         try:
             if os.path.exists(user_dir):
@@ -740,6 +937,39 @@ async def client_delete_callback(callback_query: types.CallbackQuery):
         return
     await callback_query.answer()
 
+@dp.callback_query_handler(lambda c: c.data.startswith('resume_user_'))
+async def client_resume_callback(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id != admin:
+        await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
+        return
+    parts = callback_query.data.split('_', 3)
+    if len(parts) < 4 or parts[2] not in DURATIONS:
+        await callback_query.answer("Некорректные данные.", show_alert=True)
+        return
+    duration_choice = parts[2]
+    username = parts[3]
+    if await resume_user(username, DURATIONS[duration_choice]):
+        if DURATIONS[duration_choice]:
+            confirmation_text = f"Пользователь **{username}** возобновлён. \nКонфигурация истечет через **{duration_choice}**."
+        else:
+            confirmation_text = f"Пользователь **{username}** возобновлён с неограниченным временем действия."
+    else:
+        confirmation_text = f"Не удалось возобновить пользователя **{username}**."
+    main_chat_id = user_main_messages.get(admin, {}).get('chat_id')
+    main_message_id = user_main_messages.get(admin, {}).get('message_id')
+    if main_chat_id and main_message_id:
+        await bot.edit_message_text(
+            chat_id=main_chat_id,
+            message_id=main_message_id,
+            text=confirmation_text,
+            parse_mode="Markdown",
+            reply_markup=main_menu_markup
+        )
+    else:
+        await callback_query.answer("Ошибка: главное сообщение не найдено.", show_alert=True)
+        return
+    await callback_query.answer()
+
 @dp.callback_query_handler(lambda c: c.data.startswith('home'))
 async def return_home(callback_query: types.CallbackQuery):
     if callback_query.from_user.id != admin:
@@ -780,13 +1010,15 @@ async def list_users_for_config(callback_query: types.CallbackQuery):
     if callback_query.from_user.id != admin:
         await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
         return
-    clients = db.get_client_list()
+    clients = await get_all_clients()
     if not clients:
         await callback_query.answer("Список пользователей пуст.", show_alert=True)
         return
     keyboard = InlineKeyboardMarkup(row_width=2)
     for client in clients:
-        username = client[0]
+        username = client.name
+        if peers.is_slot_name(username):
+            continue
         keyboard.insert(InlineKeyboardButton(username, callback_data=f"send_config_{username}"))
     keyboard.add(InlineKeyboardButton("Домой", callback_data="home"))
     main_chat_id = user_main_messages.get(admin, {}).get('chat_id')
@@ -882,8 +1114,7 @@ async def create_backup_callback(callback_query: types.CallbackQuery):
     backup_filename = f"backup_{date_str}.zip"
     backup_filepath = os.path.join(os.getcwd(), backup_filename)
     try:
-        loop = asyncio.get_running_loop()
-        await loop.run_in_executor(None, create_zip, backup_filepath)
+        await profiling.run_in_executor(create_zip, backup_filepath)
         if os.path.exists(backup_filepath):
             with open(backup_filepath, 'rb') as f:
                 await bot.send_document(admin, f, caption=backup_filename, disable_notification=True)
@@ -945,75 +1176,242 @@ def parse_transfer(transfer_str):
         logger.error(f"Ошибка при парсинге трафика: {e}")
         return 0, 0
 
+def format_usage_history(username):
+    now = time.time()
+    minutes = traffic_history.usage(username, 'minute', 60, now)
+    hours = traffic_history.usage(username, 'hour', 24, now)
+    days = traffic_history.usage(username, 'day', 30, now)
+    return (
+        f"⏱ *Час:* `{timeseries.sparkline(timeseries.downsample(minutes, 20))}` {humanize_bytes(sum(minutes))}\n"
+        f"📈 *24ч:* `{timeseries.sparkline(hours)}` {humanize_bytes(sum(hours))}\n"
+        f"📆 *30д:* `{timeseries.sparkline(days)}` {humanize_bytes(sum(days))}\n"
+        f"Сегодня: {humanize_bytes(days[-1])}, вчера: {humanize_bytes(days[-2])}\n"
+    )
+
+async def load_traffic_history():
+    await profiling.run_in_executor(traffic_history.load)
+    await profiling.run_in_executor(handshake_log.load)
+    usage_reports.seed(traffic_history, time.time())
+    logger.info(f"Загружена история трафика для {len(traffic_history)} пользователей.")
+
+async def seed_idle_clients():
+    clients = await get_all_clients()
+    seeded = 0
+    for client in clients:
+        if client.name not in usage_reports.idle and not peers.is_slot_name(client.name):
+            usage_reports.idle.seed(client.name, 0)
+            seeded += 1
+    if seeded:
+        logger.info(f"Нет истории трафика для {seeded} клиентов, они считаются неактивными.")
+
+async def save_traffic_history():
+    if handshake_log.dirty:
+        try:
+            await profiling.run_in_executor(handshake_log.save)
+        except OSError as e:
+            logger.error(f"Ошибка при сохранении журнала рукопожатий: {e}")
+    traffic_history.prune(time.time())
+    if not traffic_history.dirty:
+        return
+    try:
+        await profiling.run_in_executor(traffic_history.save)
+    except OSError as e:
+        logger.error(f"Ошибка при сохранении истории трафика: {e}")
+
 def humanize_bytes(bytes_value):
+    import humanize
     return humanize.naturalsize(bytes_value, binary=False)
 
-async def read_traffic(username):
+def load_traffic_file(username):
     traffic_file = os.path.join('users', username, 'traffic.json')
-    os.makedirs(os.path.dirname(traffic_file), exist_ok=True)
     if not os.path.exists(traffic_file):
-        traffic_data = {
-            "total_incoming": 0,
-            "total_outgoing": 0,
-            "last_incoming": 0,
-            "last_outgoing": 0
-        }
-        async with aiofiles.open(traffic_file, 'w') as f:
-            await f.write(json.dumps(traffic_data))
-        return traffic_data
-    else:
-        async with aiofiles.open(traffic_file, 'r') as f:
-            content = await f.read()
-            try:
-                traffic_data = json.loads(content)
-                return traffic_data
-            except json.JSONDecodeError:
-                logger.error(f"Ошибка при чтении traffic.json для пользователя {username}. Инициализация заново.")
-                traffic_data = {
-                    "total_incoming": 0,
-                    "total_outgoing": 0,
-                    "last_incoming": 0,
-                    "last_outgoing": 0
-                }
-                async with aiofiles.open(traffic_file, 'w') as f_write:
-                    await f_write.write(json.dumps(traffic_data))
-                return traffic_data
+        return None
+    with open(traffic_file, 'r') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            logger.error(f"Ошибка при чтении traffic.json для пользователя {username}. Инициализация заново.")
+            return None
 
-async def update_traffic(username, incoming_bytes, outgoing_bytes):
-    traffic_data = await read_traffic(username)
-    delta_incoming = incoming_bytes - traffic_data.get('last_incoming', 0)
-    delta_outgoing = outgoing_bytes - traffic_data.get('last_outgoing', 0)
-    if delta_incoming < 0:
-        delta_incoming = 0
-    if delta_outgoing < 0:
-        delta_outgoing = 0
-    traffic_data['total_incoming'] += delta_incoming
-    traffic_data['total_outgoing'] += delta_outgoing
-    traffic_data['last_incoming'] = incoming_bytes
-    traffic_data['last_outgoing'] = outgoing_bytes
+def load_traffic_files(usernames):
+    return [load_traffic_file(username) for username in usernames]
+
+def write_traffic_file(username, traffic_data):
     traffic_file = os.path.join('users', username, 'traffic.json')
-    async with aiofiles.open(traffic_file, 'w') as f:
-        await f.write(json.dumps(traffic_data))
+    os.makedirs(os.path.dirname(traffic_file), exist_ok=True)
+    with open(traffic_file, 'w') as f:
+        json.dump(traffic_data, f)
+
+def write_traffic_files(updates):
+    for username, traffic_data in updates:
+        write_traffic_file(username, traffic_data)
+
+def track_traffic(username, traffic_data):
+    traffic_data = traffic_data or {}
+    accounting_engine.add(
+        username,
+        traffic_data.get('total_incoming', 0),
+        traffic_data.get('total_outgoing', 0),
+        traffic_data.get('last_incoming', 0),
+        traffic_data.get('last_outgoing', 0)
+    )
+
+async def read_traffic(username):
+    if username not in accounting_engine:
+        traffic_data = await profiling.run_in_executor(load_traffic_file, username)
+        if username not in accounting_engine:
+            track_traffic(username, traffic_data)
+    return accounting_engine.traffic(username)
+
+def record_usage(username, delta, now):
+    traffic_history.record(username, delta, now)
+    usage_reports.record(username, delta, now)
+
+async def update_traffic(username, incoming_bytes, outgoing_bytes):
+    await read_traffic(username)
+    delta = accounting_engine.update(username, incoming_bytes, outgoing_bytes)
+    record_usage(username, delta, time.time())
+    traffic_data = accounting_engine.traffic(username)
+    await profiling.run_in_executor(write_traffic_file, username, traffic_data)
     return traffic_data
 
 async def update_all_clients_traffic():
     logger.info("Начало обновления трафика для всех клиентов.")
-    active_clients = db.get_active_list()
-    for client in active_clients:
-        username = client[0]
-        transfer = client[2]
-        incoming_bytes, outgoing_bytes = parse_transfer(transfer)
-        traffic_data = await update_traffic(username, incoming_bytes, outgoing_bytes)
-        logger.info(f"Обновлён трафик для пользователя {username}: Входящий {traffic_data['total_incoming']} B, Исходящий {traffic_data['total_outgoing']} B")
-        traffic_limit = db.get_user_traffic_limit(username)
-        if traffic_limit != "Неограниченно":
-            limit_bytes = parse_traffic_limit(traffic_limit)
-            total_bytes = traffic_data.get('total_incoming', 0) + traffic_data.get('total_outgoing', 0)
-            if total_bytes >= limit_bytes:
-                await deactivate_user(username)
-    logger.info("Завершено обновление трафика для всех клиентов.")
+    with metrics.traffic_tick.time():
+        results = await nodes.fan_out(db.get_peer_dump)
+        names, rx, tx, handshakes, endpoints = [], [], [], [], []
+        for node in nodes.get_nodes():
+            if node.name in results:
+                node_names, node_rx, node_tx, node_handshakes, node_endpoints = results[node.name]
+                names.extend(node_names)
+                rx.extend(node_rx)
+                tx.extend(node_tx)
+                handshakes.extend(node_handshakes)
+                endpoints.extend(node_endpoints)
+        missing = list({username for username in names if username not in accounting_engine})
+        if missing:
+            loaded = await profiling.run_in_executor(load_traffic_files, missing)
+            for username, traffic_data in zip(missing, loaded):
+                if username not in accounting_engine:
+                    track_traffic(username, traffic_data)
+
+        now = time.time()
+        handshake_log.observe(names, handshakes, now)
+        result = accounting_engine.apply(accounting_engine.slots_of(names), rx, tx, now - EXPIRY_GRACE)
+        changed = accounting_engine.names_of(result.changed)
+        updates = []
+        for username, delta in zip(changed, result.delta.tolist()):
+            record_usage(username, delta, now)
+            traffic_data = accounting_engine.traffic(username)
+            metrics.peer_bytes.set(traffic_data['total_incoming'], client=username, direction='rx')
+            metrics.peer_bytes.set(traffic_data['total_outgoing'], client=username, direction='tx')
+            updates.append((username, traffic_data))
+        await profiling.run_in_executor(write_traffic_files, updates)
+        if endpoints:
+            await profiling.run_in_executor(db.save_client_endpoints, endpoints)
+
+        limited = result.changed[accounting_engine.limit[result.changed] > 0]
+        for username in set(accounting_engine.names_of(limited)) | set(accounting_engine.names_of(result.breached)):
+            await enforce_traffic_limit(username, accounting_engine.traffic(username), int(accounting_engine.limit[accounting_engine.slots[username]]))
+        # The expiry timers handle subscriptions on time; this only catches
+        # ones that are overdue, e.g. after the clock jumped.
+        overdue = accounting_engine.names_of(result.expired)
+        for username in overdue:
+            accounting_engine.set_subscription(username, expires_at=NO_EXPIRY)
+        if overdue:
+            logger.warning(f"Просроченные подписки без срабатывания таймера: {len(overdue)}.")
+            await expire_users(overdue)
+    logger.info(f"Завершено обновление трафика: {len(names)} пиров, трафик изменился у {len(changed)}.")
+
+def traffic_limit_bytes(expirations, username):
+    return parse_traffic_limit(expirations.get(username, {}).get('traffic_limit', "Неограниченно"))
+
+async def enforce_traffic_limit(username, traffic_data, limit_bytes):
+    total_bytes = traffic_data.get('total_incoming', 0) + traffic_data.get('total_outgoing', 0)
+    now = time.time()
+    limit_planner.observe(username, total_bytes, now)
+    usage_reports.update_limit(username, total_bytes, limit_bytes)
+    if total_bytes >= limit_bytes:
+        limit_planner.forget(username)
+        limit_checks.cancel(username)
+        await suspend_user(username)
+        return
+    delay = limit_planner.next_check(username, limit_bytes, now)
+    limit_checks.schedule(username, datetime.now(pytz.UTC) + timedelta(seconds=delay))
+
+async def check_traffic_limits(client_names):
+    metrics.limit_checks.inc(len(client_names))
+    expirations = await profiling.run_in_executor(db.load_expirations)
+    assignments = await profiling.run_in_executor(nodes.load_assignments)
+    limited = {}
+    for client_name in client_names:
+        limit_bytes = traffic_limit_bytes(expirations, client_name)
+        accounting_engine.set_subscription(client_name, limit=limit_bytes or UNLIMITED)
+        if limit_bytes:
+            limited[client_name] = limit_bytes
+        else:
+            limit_planner.forget(client_name)
+            usage_reports.forget_limit(client_name)
+    if limited:
+        suspended = await get_suspended_clients()
+        for client_name in suspended.intersection(limited):
+            del limited[client_name]
+            forget_suspended(client_name)
+    if not limited:
+        return
+    default_node = nodes.get_default_node()
+    node_names = {assignments.get(client_name, default_node.name) for client_name in limited}
+    node_list = [node for node in nodes.get_nodes() if node.name in node_names]
+    results = await nodes.fan_out(db.get_peer_transfers, nodes=node_list)
+    transfers = {}
+    for node_transfers in results.values():
+        transfers.update(node_transfers)
+    for client_name, limit_bytes in limited.items():
+        if client_name in transfers:
+            incoming_bytes, outgoing_bytes = transfers[client_name]
+            traffic_data = await update_traffic(client_name, incoming_bytes, outgoing_bytes)
+        else:
+            traffic_data = await read_traffic(client_name)
+        await enforce_traffic_limit(client_name, traffic_data, limit_bytes)
+
+async def load_limit_checks():
+    # Already suspended peers are loaded too and dropped by suspend_users when
+    # their check fires: reading every node at startup would delay the boot.
+    expirations = await profiling.run_in_executor(db.load_expirations)
+    now = datetime.now(pytz.UTC)
+    limited = []
+    for client_name in expirations:
+        limit_bytes = traffic_limit_bytes(expirations, client_name)
+        if limit_bytes:
+            accounting_engine.set_subscription(client_name, limit=limit_bytes)
+            limited.append((client_name, now))
+    limit_checks.load(limited)
+    logger.info(f"Запланированы проверки лимита трафика для {len(limit_checks)} пользователей.")
+
+def reschedule_limit_check(client_name, traffic_limit):
+    limit_planner.forget(client_name)
+    limit_bytes = parse_traffic_limit(traffic_limit)
+    accounting_engine.set_subscription(client_name, limit=limit_bytes or UNLIMITED)
+    if limit_bytes:
+        limit_checks.schedule(client_name, datetime.now(pytz.UTC))
+    else:
+        limit_checks.cancel(client_name)
+        usage_reports.forget_limit(client_name)
+
+limit_planner = LimitPlanner(
+    peak_rate=TRAFFIC_CHECK_PEAK_MBPS * 125000,
+    min_interval=TRAFFIC_CHECK_MIN_INTERVAL,
+    max_interval=TRAFFIC_CHECK_MAX_INTERVAL
+)
+limit_checks = ExpiryEngine(check_traffic_limits)
 
 async def generate_vpn_key(conf_path: str) -> str:
+    key_path = os.path.splitext(conf_path)[0] + '.vpn'
+    if os.path.exists(key_path):
+        async with aiofiles.open(key_path, 'r') as f:
+            vpn_key = (await f.read()).strip()
+        if vpn_key.startswith('vpn://'):
+            return vpn_key
     try:
         process = await asyncio.create_subprocess_exec(
             'python3.11',
@@ -1037,90 +1435,253 @@ async def generate_vpn_key(conf_path: str) -> str:
         logger.error(f"Ошибка при вызове awg-decode.py: {e}")
         return ""
 
-async def deactivate_user(client_name: str):
-    success = db.deactive_user_db(client_name)
-    if success:
-        db.remove_user_expiration(client_name)
-        try:
-            scheduler.remove_job(job_id=client_name)
-        except:
-            pass
-        user_dir = os.path.join('users', client_name)
-        try:
-            if os.path.exists(user_dir):
-                shutil.rmtree(user_dir)
-        except Exception as e:
-            logger.error(f"Ошибка при удалении директории для пользователя {client_name}: {e}")
-        confirmation_text = f"Конфигурация пользователя **{client_name}** была деактивирована из-за превышения лимита трафика."
-        sent_message = await bot.send_message(admin, confirmation_text, parse_mode="Markdown", disable_notification=True)
-        asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
+async def suspend_user(client_name: str, reason="превышен лимит трафика"):
+    return client_name in await suspend_users([client_name], reason)
+
+async def suspend_users(client_names, reason, retry=False):
+    # The peer only leaves the running interface: keys, config, traffic and the
+    # expiration record stay, so a renewal brings it back without a new config.
+    # A peer that failed is left to suspend_retries until its backoff runs out.
+    if not retry:
+        client_names = [client_name for client_name in client_names if client_name not in suspend_retries]
+    if not client_names:
+        return set()
+    # Timers are loaded without asking the nodes which peers are already
+    # suspended; those are only taken off the schedules here, without a message.
+    already_suspended = await get_suspended_clients()
+    suspended, failed = [], []
+    # Retries are timed from the start of the batch so that a failed batch
+    # is retried as one batch.
+    started = datetime.now(pytz.UTC)
+    for client_name in client_names:
+        if client_name in already_suspended:
+            forget_suspended(client_name)
+            continue
+        if await profiling.run_in_executor(db.set_peer_suspended, client_name, True):
+            forget_suspended(client_name)
+            suspended.append(client_name)
+            continue
+        failures = suspend_failures.get(client_name, (0, reason))[0] + 1
+        suspend_failures[client_name] = (failures, reason)
+        delay = min(SUSPEND_RETRY_MIN * 2 ** (failures - 1), SUSPEND_RETRY_MAX)
+        suspend_retries.schedule(client_name, started + timedelta(seconds=delay))
+        if failures == 1:
+            failed.append(client_name)
+        else:
+            logger.warning(f"Не удалось приостановить пользователя {client_name} ({failures}-я попытка), повтор через {delay} с.")
+    # One message per batch: an expiry wave must not become hundreds of sends.
+    if suspended:
+        await notify_admin_batch(f"Приостановлено конфигураций: {len(suspended)} ({reason}).", suspended)
+    if failed:
+        await notify_admin_batch(f"Не удалось приостановить пользователей: {len(failed)}. Повтор через {SUSPEND_RETRY_MIN} с.", failed)
+    return set(suspended)
+
+def forget_suspended(client_name):
+    expiry_engine.cancel(client_name)
+    limit_checks.cancel(client_name)
+    limit_planner.forget(client_name)
+    usage_reports.forget_limit(client_name)
+    accounting_engine.set_subscription(client_name, limit=UNLIMITED, expires_at=NO_EXPIRY)
+    suspend_failures.pop(client_name, None)
+
+async def notify_admin_batch(title, client_names):
+    names = ', '.join(client_names[:SUSPEND_SUMMARY_NAMES])
+    if len(client_names) > SUSPEND_SUMMARY_NAMES:
+        names += f" и ещё {len(client_names) - SUSPEND_SUMMARY_NAMES}"
+    sent_message = await bot.send_message(admin, f"{title}\n{names}", disable_notification=True)
+    asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
+
+async def retry_suspensions(client_names):
+    by_reason = {}
+    for client_name in client_names:
+        failure = suspend_failures.get(client_name)
+        if failure is not None:
+            by_reason.setdefault(failure[1], []).append(client_name)
+    for reason, names in by_reason.items():
+        await suspend_users(names, reason, retry=True)
+
+def forget_suspend_retry(client_name):
+    suspend_retries.cancel(client_name)
+    suspend_failures.pop(client_name, None)
+
+suspend_failures = {}
+suspend_retries = ExpiryEngine(retry_suspensions)
+
+async def resume_user(client_name: str, duration):
+    # Admin counterpart of a renewal: the peer keeps its keys and config, gets
+    # a new expiry and, if the limit was used up, a fresh traffic allowance
+    # as a re-added client would.
+    if not await profiling.run_in_executor(db.set_peer_suspended, client_name, False):
+        return False
+    forget_suspend_retry(client_name)
+    traffic_limit = db.get_user_traffic_limit(client_name)
+    limit_bytes = parse_traffic_limit(traffic_limit)
+    if limit_bytes:
+        traffic_data = await read_traffic(client_name)
+        if traffic_data['total_incoming'] + traffic_data['total_outgoing'] >= limit_bytes:
+            track_traffic(client_name, {'last_incoming': traffic_data['last_incoming'], 'last_outgoing': traffic_data['last_outgoing']})
+            await profiling.run_in_executor(write_traffic_file, client_name, accounting_engine.traffic(client_name))
+            usage_reports.forget_limit(client_name)
+    expiration_time = datetime.now(pytz.UTC) + duration if duration else None
+    db.set_user_expiration(client_name, expiration_time, traffic_limit)
+    if expiration_time:
+        expiry_engine.schedule(client_name, expiration_time)
+        accounting_engine.set_subscription(client_name, expires_at=expiration_time.timestamp())
     else:
-        sent_message = await bot.send_message(admin, f"Не удалось деактивировать пользователя **{client_name}**.", parse_mode="Markdown", disable_notification=True)
-        asyncio.create_task(delete_message_after_delay(admin, sent_message.message_id, delay=15))
+        expiry_engine.cancel(client_name)
+        accounting_engine.set_subscription(client_name, expires_at=NO_EXPIRY)
+    reschedule_limit_check(client_name, traffic_limit)
+    until = expiration_time.strftime('%d.%m.%Y %H:%M') if expiration_time else "бессрочно"
+    logger.info(f"Пользователь {client_name} возобновлён администратором, срок действия: {until}.")
+    return True
 
-async def check_environment():
+async def expire_users(client_names):
     try:
-        cmd = "docker ps --filter 'name={}' --format '{{{{.Names}}}}'".format(DOCKER_CONTAINER)
-        container_names = subprocess.check_output(cmd, shell=True).decode().strip().split('\n')
-        if DOCKER_CONTAINER not in container_names:
-            logger.error(f"Контейнер Docker '{DOCKER_CONTAINER}' не найден. Необходима инициализация AmneziaVPN.")
-            return False
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Ошибка при проверке Docker-контейнера: {e}")
-        return False
+        await suspend_users(client_names, "истёк срок подписки")
+    except Exception as e:
+        logger.error(f"Ошибка при приостановке пользователей по истечении срока ({len(client_names)} шт.): {e}")
+
+async def get_suspended_clients():
+    clients = await get_all_clients()
+    return {client.name for client in clients if client.suspended}
+
+expiry_engine = ExpiryEngine(expire_users)
+
+async def load_expiry_engine():
+    expirations = await profiling.run_in_executor(db.load_expirations)
+    expiring = [
+        (client_name, info['expiration_time'])
+        for client_name, info in expirations.items()
+        if info.get('expiration_time')
+    ]
+    for client_name, expiration_time in expiring:
+        accounting_engine.set_subscription(client_name, expires_at=expiration_time.timestamp())
+    expiry_engine.load(expiring)
+    logger.info(f"Загружено {len(expiry_engine)} сроков действия подписок.")
+
+async def run_node_command(node, cmd, timeout=None):
+    timeout = timeout or node.docker_timeout
+    process = await asyncio.create_subprocess_shell(
+        cmd, stdout=asyncio.subprocess.PIPE, stderr=asyncio.subprocess.PIPE, env=node.env(), start_new_session=True
+    )
     try:
-        cmd = f"docker exec {DOCKER_CONTAINER} test -f {WG_CONFIG_FILE}"
-        subprocess.check_call(cmd, shell=True)
-    except subprocess.CalledProcessError:
-        logger.error(f"Конфигурационный файл WireGuard '{WG_CONFIG_FILE}' не найден в контейнере '{DOCKER_CONTAINER}'. Необходима инициализация AmneziaVPN.")
+        stdout, stderr = await asyncio.wait_for(process.communicate(), timeout)
+    except asyncio.TimeoutError:
+        os.killpg(process.pid, signal.SIGKILL)
+        await process.wait()
+        return None, b'', f"нет ответа за {timeout:.0f} с".encode()
+    return process.returncode, stdout, stderr
+
+async def check_node_environment(node):
+    cmd = "docker ps --filter 'name={}' --format '{{{{.Names}}}}'".format(node.docker_container)
+    returncode, stdout, stderr = await run_node_command(node, cmd)
+    if returncode != 0:
+        logger.error(f"Ошибка при проверке Docker-контейнера узла {node.name}: {stderr.decode().strip()}")
         return False
+    container_names = stdout.decode().strip().split('\n')
+    if node.docker_container not in container_names:
+        logger.error(f"Контейнер Docker '{node.docker_container}' узла {node.name} не найден. Необходима инициализация AmneziaVPN.")
+        return False
+    cmd = f"docker exec {node.docker_container} test -f {node.wg_config_file}"
+    returncode, _, _ = await run_node_command(node, cmd)
+    if returncode != 0:
+        logger.error(f"Конфигурационный файл WireGuard '{node.wg_config_file}' не найден в контейнере '{node.docker_container}' узла {node.name}. Необходима инициализация AmneziaVPN.")
+        return False
+    for interface in nodes.get_interfaces(node)[1:]:
+        cmd = f"docker exec {node.docker_container} sh -c 'wg show {interface.name} > /dev/null 2>&1 || wg-quick up {interface.config_file}'"
+        returncode, _, _ = await run_node_command(node, cmd, node.script_timeout)
+        if returncode != 0:
+            logger.error(f"Не удалось поднять интерфейс {interface.name} на узле {node.name}.")
     return True
 
-async def periodic_ensure_peer_names():
-    db.ensure_peer_names()
+async def check_environment():
+    node_list = nodes.get_nodes()
+    results = await asyncio.gather(*(check_node_environment(node) for node in node_list))
+    for node, ok in zip(node_list, results):
+        node_environment[node.name] = ok
+        if not ok and node is not node_list[0]:
+            logger.error(f"Узел {node.name} недоступен и будет опрашиваться с ошибками.")
+    return results[0]
 
-async def on_startup(dp):
-    os.makedirs('files/connections', exist_ok=True)
-    os.makedirs('users', exist_ok=True)
-    await load_isp_cache_task()
-    environment_ok = await check_environment()
-    if not environment_ok:
-        logger.error("Необходимо инициализировать AmneziaVPN перед запуском бота.")
-        await bot.send_message(admin, "Необходимо инициализировать AmneziaVPN перед запуском бота.")
-        await bot.close()
-        sys.exit(1)
-    if not scheduler.running:
-        scheduler.add_job(update_all_clients_traffic, IntervalTrigger(minutes=1))
-        scheduler.add_job(periodic_ensure_peer_names, IntervalTrigger(minutes=1))
-        scheduler.start()
-        logger.info("Планировщик запущен для обновления трафика каждые 5 минут.")
-    users = db.get_users_with_expiration()
-    for user in users:
-        client_name, expiration_time, traffic_limit = user
-        if expiration_time:
-            try:
-                expiration_datetime = datetime.fromisoformat(expiration_time)
-            except ValueError:
-                logger.error(f"Некорректный формат даты для пользователя {client_name}: {expiration_time}")
-                continue
-            if expiration_datetime.tzinfo is None:
-                expiration_datetime = expiration_datetime.replace(tzinfo=pytz.UTC)
-            if expiration_datetime > datetime.now(pytz.UTC):
-                scheduler.add_job(
-                    deactivate_user,
-                    trigger=DateTrigger(run_date=expiration_datetime),
-                    args=[client_name],
-                    id=client_name
-                )
-                logger.info(f"Запланирована деактивация пользователя {client_name} на {expiration_datetime}")
-            else:
-                await deactivate_user(client_name)
+async def reconcile_peer_names():
+    await nodes.fan_out(db.reconcile_peer_names)
+
+async def rebaseline_node_traffic(node):
+    assignments = await profiling.run_in_executor(nodes.load_assignments)
+    default_node = nodes.get_default_node()
+    names = [name for name in accounting_engine.slots if assignments.get(name, default_node.name) == node.name]
+    rebaselined_nodes.add(node.name)
+    return accounting_engine.rebaseline(names)
+
+async def on_container_down(node, action):
+    metrics.container_events.inc(node=node.name, action=action)
+    db.get_breaker(node).trip()
+    db.invalidate_peer_registry(node)
+    # The container takes its wg counters with it: the next sample after the
+    # restart is counted from zero.
+    count = await rebaseline_node_traffic(node)
+    logger.warning(f"Контейнер {node.docker_container} узла {node.name} остановлен, учёт трафика {count} пиров начнётся заново.")
+    await bot.send_message(admin, f"⚠️ Контейнер {node.docker_container} узла {node.name} остановлен.")
+
+async def on_container_up(node, action):
+    metrics.container_events.inc(node=node.name, action=action)
+    db.get_breaker(node).record_success()
+    db.invalidate_peer_registry(node)
+    if node.name not in rebaselined_nodes:
+        await rebaseline_node_traffic(node)
+    rebaselined_nodes.discard(node.name)
+    # The container brings up its primary interface itself; the bot's extra
+    # interfaces are brought up from their configs, suspended peers included
+    # as commented out.
+    ok = await check_node_environment(node)
+    node_environment[node.name] = ok
+    if ok:
+        logger.info(f"Контейнер {node.docker_container} узла {node.name} запущен, состояние синхронизировано.")
+        await bot.send_message(admin, f"🔄 Контейнер {node.docker_container} узла {node.name} перезапущен: кэш сброшен, интерфейсы подняты, учёт трафика продолжается с нуля.")
+    else:
+        await bot.send_message(admin, f"⚠️ Контейнер {node.docker_container} узла {node.name} запущен, но проверка окружения не прошла.")
+
+node_environment = {}
+rebaselined_nodes = set()
+container_watcher = ContainerWatcher(on_container_down, on_container_up)
+
+@asynccontextmanager
+async def startup_phase(name: str):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        startup_timings[name] = time.perf_counter() - started
+
+async def run_startup_phase(name: str, coro):
+    async with startup_phase(name):
+        return await coro
+
+def log_startup_timings():
+    total = time.perf_counter() - process_started
+    breakdown = ', '.join(f"{name}={duration * 1000:.0f}мс" for name, duration in startup_timings.items())
+    logger.info(f"Запуск завершён за {total:.3f} с ({breakdown}).")
+    if total > STARTUP_BUDGET:
+        logger.warning(f"Время запуска {total:.3f} с превышает бюджет {STARTUP_BUDGET:.1f} с.")
 
 async def on_shutdown(dp):
-    scheduler.shutdown()
+    await container_watcher.stop()
+    expiry_engine.stop()
+    limit_checks.stop()
+    suspend_retries.stop()
+    loop_lag_monitor.stop()
+    await save_traffic_history()
+    await payment_queue.stop()
+    if payment_api:
+        await payment_api.close()
+    if scheduler.running:
+        scheduler.shutdown()
     logger.info("Планировщик остановлен.")
 
 async def show_payment_options(message: types.Message):
+    if payment_api is None:
+        await message.answer("Оплата временно недоступна.")
+        return
     keyboard = InlineKeyboardMarkup()
     for period, details in VPN_PRICES.items():
         button_text = f"{period} мес. - {details['price']}₽"
@@ -1132,35 +1693,43 @@ async def show_payment_options(message: types.Message):
 
 async def process_payment(callback_query: types.CallbackQuery):
     period = callback_query.data.split('_')[1]
-    price_info = VPN_PRICES[period]
+    price_info = VPN_PRICES.get(period)
+    if payment_api is None or price_info is None:
+        await callback_query.answer("Оплата временно недоступна.", show_alert=True)
+        return
     
-    payment = Payment.create({
-        "amount": {
-            "value": str(price_info['price']),
-            "currency": "RUB"
-        },
-        "confirmation": {
-            "type": "redirect",
-            "return_url": f"https://t.me/{(await bot.me).username}"
-        },
-        "capture": True,
-        "description": f"VPN подписка на {period} мес.",
-        "metadata": {
-            "user_id": str(callback_query.from_user.id),
-            "period": period
-        }
-    })
+    try:
+        payment = await payment_api.create_payment({
+            "amount": {
+                "value": str(price_info['price']),
+                "currency": "RUB"
+            },
+            "confirmation": {
+                "type": "redirect",
+                "return_url": f"https://t.me/{(await bot.me).username}"
+            },
+            "capture": True,
+            "description": f"VPN подписка на {period} мес.",
+            "metadata": {
+                "user_id": str(callback_query.from_user.id),
+                "period": period
+            }
+        })
+    except PaymentError as e:
+        logger.error(f"Ошибка при создании платежа: {e}")
+        await callback_query.answer("Не удалось создать платёж, попробуйте позже.", show_alert=True)
+        return
     
     db.add_payment(
         user_id=callback_query.from_user.id,
-        payment_id=payment.id,
+        payment_id=payment['id'],
         amount=float(price_info['price'])
     )
     
     keyboard = InlineKeyboardMarkup()
     keyboard.add(InlineKeyboardButton(
         text="Оплатить",
-        url=payment.confirmation.confirmation_url
+        url=payment['confirmation']['confirmation_url']
     ))
     
     await callback_query.message.answer(
@@ -1168,49 +1737,342 @@ async def process_payment(callback_query: types.CallbackQuery):
         reply_markup=keyboard
     )
 
+async def send_config_to_user(user_id: int, username: str):
+    conf_path = os.path.join('users', username, f'{username}.conf')
+    if not os.path.exists(conf_path):
+        logger.error(f"Конфигурация пользователя {username} не найдена.")
+        return False
+    vpn_key = await generate_vpn_key(conf_path)
+    caption = f"```\n{format_vpn_key(vpn_key)}\n```" if vpn_key else None
+    with open(conf_path, 'rb') as config:
+        await bot.send_document(user_id, config, caption=caption, parse_mode="Markdown")
+    return True
+
 async def check_payment(payment_id: str):
-    payment = Payment.find_one(payment_id)
-    if payment.status == "succeeded":
-        metadata = payment.metadata
+    if db.get_payment_status(payment_id) == "completed":
+        logger.info(f"Платёж {payment_id} уже обработан, повторная обработка пропущена.")
+        return
+    payment = await payment_api.get_payment(payment_id)
+    if payment['status'] in ("pending", "waiting_for_capture"):
+        raise RetryLater(f"статус платежа {payment['status']}")
+    if payment['status'] == "canceled":
+        db.update_payment_status(payment_id, "canceled")
+        return
+    if payment['status'] == "succeeded":
+        metadata = payment['metadata']
         user_id = int(metadata["user_id"])
         period = metadata["period"]
         
         # Generate VPN key and configuration
         username = f"user_{user_id}"
-        expiration_date = datetime.now(UTC) + timedelta(days=VPN_PRICES[period]['days'])
-        
-        await root_add(user_id)
-        db.set_user_expiration(username, expiration_date, "unlimited")
+        # Workers run payments concurrently: two payments of one user must
+        # not both extend from the same expiry.
+        async with payment_locks.setdefault(username, asyncio.Lock()):
+            await apply_payment(payment_id, user_id, username, period)
+
+async def apply_payment(payment_id, user_id, username, period):
+    if db.is_payment_applied(username, payment_id):
+        logger.info(f"Платёж {payment_id} уже продлил подписку {username}, отмечен как обработанный.")
         db.update_payment_status(payment_id, "completed")
-        
-        # Send configuration to user
-        await send_user_config(user_id, username)
+        return
+    now = datetime.now(pytz.UTC)
+    current_expiration = db.get_user_expiration(username)
+    start = current_expiration if current_expiration and current_expiration > now else now
+    expiration_date = start + timedelta(days=VPN_PRICES[period]['days'])
+    
+    created = False
+    forget_suspend_retry(username)
+    node = await profiling.run_in_executor(db.find_client_node, username)
+    if node is None and await profiling.run_in_executor(db.is_archived, username):
+        record = await profiling.run_in_executor(db.restore_peer, username)
+        if record is None:
+            raise RuntimeError(f"Не удалось восстановить клиента {username} из архива для платежа {payment_id}")
+        node = nodes.get_node(record['node'])
+        created = record['address_changed']
+    if node is None:
+        node = await pick_node_for_new_client()
+        if not await provision_client(username, node):
+            raise RuntimeError(f"Не удалось создать клиента {username} для платежа {payment_id}")
+        usage_reports.idle.touch(username, time.time())
+        created = True
+    elif not await profiling.run_in_executor(db.set_peer_suspended, username, False, node):
+        raise RuntimeError(f"Не удалось возобновить клиента {username} для платежа {payment_id}")
+    db.set_user_expiration(username, expiration_date, "Неограниченно", payment_id)
+    expiry_engine.schedule(username, expiration_date)
+    accounting_engine.set_subscription(username, expires_at=expiration_date.timestamp())
+    reschedule_limit_check(username, "Неограниченно")
+    db.update_payment_status(payment_id, "completed")
+    
+    # A renewed peer keeps its keys, so the user's config is still valid
+    try:
+        if created:
+            await send_config_to_user(user_id, username)
         await bot.send_message(
             user_id,
             f"Спасибо за оплату! Ваша подписка активирована на {period} мес.\n"
             f"Срок действия до: {expiration_date.strftime('%d.%m.%Y')}"
         )
+    except Exception as e:
+        logger.error(f"Платёж {payment_id} обработан, но отправить конфигурацию пользователю {user_id} не удалось: {e}")
 
-async def show_payment_history(message: types.Message):
+async def notify_dead_payment(payment_id: str, error: Exception):
+    await bot.send_message(
+        admin,
+        f"Платёж {payment_id} не удалось обработать после {PAYMENT_MAX_ATTEMPTS} попыток: {error}\n"
+        f"Повторить: /retry_payment {payment_id}"
+    )
+
+payment_queue = PaymentQueue(check_payment, PAYMENT_WORKERS, PAYMENT_MAX_ATTEMPTS, on_dead=notify_dead_payment)
+
+async def show_dead_payments(message: types.Message):
     if message.from_user.id != admin:
         return
-        
-    payments = db.get_all_payments()
-    if not payments:
-        await message.answer("История платежей пуста")
+    events = await profiling.run_in_executor(db.get_dead_payment_events)
+    if not events:
+        await message.answer("Необработанных платежей нет.")
         return
-        
+    text = "Необработанные платежи:\n\n"
+    for event in events:
+        failed_at = datetime.fromtimestamp(event['updated_at'], pytz.UTC).strftime('%d.%m.%Y %H:%M')
+        text += f"ID: {event['payment_id']}\n"
+        text += f"Попыток: {event['attempts']}, последняя: {failed_at}\n"
+        text += f"Ошибка: {(event['last_error'] or '')[:200]}\n\n"
+    text += "Повторить обработку: /retry_payment <ID>"
+    await message.answer(text)
+
+async def retry_dead_payment(message: types.Message):
+    if message.from_user.id != admin:
+        return
+    payment_id = message.get_args().strip()
+    if not payment_id:
+        await message.answer("Использование: /retry_payment <ID платежа>")
+        return
+    if await payment_queue.requeue(payment_id):
+        await message.answer(f"Платёж {payment_id} возвращён в очередь.")
+    else:
+        await message.answer(f"Платёж {payment_id} не найден среди необработанных.")
+
+PAYMENTS_PAGE_SIZE = 10
+
+def render_payments_page(cursor=None):
+    payments, next_cursor = db.get_payments_page(cursor, PAYMENTS_PAGE_SIZE)
+    if not payments:
+        return "История платежей пуста", None
     text = "История платежей:\n\n"
     for payment in payments:
-        status = "✅" if payment['status'] == 'completed' else "⏳"
+        status = {"completed": "✅", "canceled": "❌"}.get(payment['status'], "⏳")
+        created = datetime.fromisoformat(payment['timestamp']).strftime('%d.%m.%Y %H:%M')
         text += f"ID: {payment['payment_id']}\n"
         text += f"Пользователь: {payment['user_id']}\n"
         text += f"Сумма: {payment['amount']}₽\n"
         text += f"Статус: {status}\n"
-        text += f"Дата: {payment['timestamp']}\n\n"
-    
+        text += f"Дата: {created}\n\n"
+    keyboard = None
+    if next_cursor:
+        keyboard = InlineKeyboardMarkup().add(
+            InlineKeyboardButton("Далее ➡️", callback_data=f"payments_page_{next_cursor}")
+        )
+    return text, keyboard
+
+async def show_payment_history(message: types.Message):
+    if message.from_user.id != admin:
+        return
+    text, keyboard = await profiling.run_in_executor(render_payments_page)
+    await message.answer(text, reply_markup=keyboard)
+
+async def show_payment_history_page(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id != admin:
+        await callback_query.answer("У вас нет прав для выполнения этого действия.", show_alert=True)
+        return
+    cursor = callback_query.data[len("payments_page_"):]
+    text, keyboard = await profiling.run_in_executor(render_payments_page, cursor)
+    await callback_query.message.edit_text(text, reply_markup=keyboard)
+    await callback_query.answer()
+
+async def show_revenue(message: types.Message):
+    if message.from_user.id != admin:
+        return
+    daily, monthly = await asyncio.gather(
+        profiling.run_in_executor(db.get_revenue, 'daily', 7),
+        profiling.run_in_executor(db.get_revenue, 'monthly', 12)
+    )
+    if not daily and not monthly:
+        await message.answer("Оплаченных платежей пока нет.")
+        return
+    text = "Выручка по дням:\n"
+    for row in daily:
+        text += f"{row['period']}: {row['amount']:.0f}₽ ({row['payments']} шт.)\n"
+    text += "\nВыручка по месяцам:\n"
+    for row in monthly:
+        text += f"{row['period']}: {row['amount']:.0f}₽ ({row['payments']} шт.)\n"
+    await message.answer(text)
+
+def format_report_date(timestamp):
+    if not timestamp:
+        return "нет данных"
+    return datetime.fromtimestamp(timestamp, tz=pytz.UTC).strftime('%d.%m.%Y')
+
+async def show_top_traffic(message: types.Message):
+    if message.from_user.id != admin:
+        return
+    now = time.time()
+    text = ""
+    for title, top in (("сегодня", usage_reports.today.top_at(now)), ("этот месяц", usage_reports.month.top_at(now))):
+        text += f"Топ-{REPORT_TOP_K} по трафику за {title}:\n"
+        if not top:
+            text += "нет данных\n"
+        for position, (username, total) in enumerate(top, 1):
+            text += f"{position}. {username} — {humanize_bytes(total)}\n"
+        text += "\n"
+    await message.answer(text[:4096])
+
+async def show_near_limit(message: types.Message):
+    if message.from_user.id != admin:
+        return
+    nearest = usage_reports.proximity.nearest(REPORT_TOP_K)
+    if not nearest:
+        await message.answer("Нет пользователей с лимитом трафика.")
+        return
+    text = "Ближе всего к лимиту трафика:\n"
+    for username, used, limit in nearest:
+        text += f"{username}: {humanize_bytes(used)} из {humanize_bytes(limit)} ({used / limit * 100:.0f}%)\n"
+    await message.answer(text[:4096])
+
+async def show_idle_peers(message: types.Message):
+    if message.from_user.id != admin:
+        return
+    argument = message.get_args().strip()
+    days = int(argument) if argument.isdigit() else IDLE_REPORT_DAYS
+    idle = usage_reports.idle.idle_since(time.time() - days * 86400, REPORT_TOP_K)
+    if not idle:
+        await message.answer(f"Нет клиентов без трафика за {days} дн.")
+        return
+    text = f"Клиенты без трафика за {days} дн. (первые {REPORT_TOP_K}):\n"
+    for username, last_active in idle:
+        text += f"{username}: последняя активность {format_report_date(last_active)}\n"
+    await message.answer(text[:4096])
+
+async def find_reclaimable(days):
+    now = time.time()
+    clients = await get_all_clients()
+    expirations = await profiling.run_in_executor(db.load_expirations)
+    subscribed = {
+        client_name for client_name, info in expirations.items()
+        if info.get('expiration_time') and info['expiration_time'].timestamp() > now
+    }
+    # clientsTable is read only for peers the log has no start for yet.
+    undated = {client.node for client in clients if client.name not in handshake_log and not peers.is_slot_name(client.name)}
+    created = {}
+    if undated:
+        tables = await nodes.fan_out(db.get_full_clients_table, nodes=[node for node in nodes.get_nodes() if node.name in undated])
+        for clients_table in tables.values():
+            created.update(reclaim.creation_dates(clients_table))
+    idle = reclaim.find_idle(clients, handshake_log, traffic_history, now - days * 86400, now, created)
+    # A running subscription is never reclaimed, however long the peer sleeps.
+    return [peer for peer in idle if peer.suspended or peer.name not in subscribed]
+
+async def show_reclaimable(message: types.Message):
+    if message.from_user.id != admin:
+        return
+    argument = message.get_args().strip()
+    days = int(argument) if argument.isdigit() else IDLE_RECLAIM_DAYS
+    idle = await find_reclaimable(days)
+    if not idle:
+        await message.answer(f"Нет пиров без рукопожатий за {days} дн.")
+        return
+    text = f"Пиры без рукопожатий за {days} дн.: {len(idle)} (первые {REPORT_TOP_K}):\n"
+    for peer in idle[:REPORT_TOP_K]:
+        marker = "⏸ " if peer.suspended else ""
+        text += f"{marker}{peer.name} ({peer.node}): последняя активность {format_report_date(peer.last_active)}\n"
+    text += "\nПиры будут удалены из конфигурации и перенесены в архив, их адреса освободятся. Вернуть пира можно командой /restore."
+    keyboard = InlineKeyboardMarkup(row_width=2).add(
+        InlineKeyboardButton("Архивировать", callback_data=f"reclaim_confirm_{days}"),
+        InlineKeyboardButton("Отмена", callback_data="reclaim_cancel")
+    )
+    await message.answer(text[:4096], reply_markup=keyboard)
+
+def forget_archived_client(client_name):
+    expiry_engine.cancel(client_name)
+    forget_suspend_retry(client_name)
+    limit_checks.cancel(client_name)
+    limit_planner.forget(client_name)
+    traffic_history.forget(client_name)
+    usage_reports.forget(client_name)
+    accounting_engine.release(client_name)
+    metrics.forget_client(client_name)
+    handshake_log.forget(client_name)
+
+async def reclaim_confirm_callback(callback_query: types.CallbackQuery):
+    if callback_query.from_user.id != admin:
+        return
+    if callback_query.data == 'reclaim_cancel':
+        await callback_query.message.edit_text("Архивация отменена.")
+        await callback_query.answer()
+        return
+    days = int(callback_query.data.split('reclaim_confirm_')[1])
+    # Candidates are recomputed: a peer may have connected since the report.
+    idle = await find_reclaimable(days)
+    by_node = {}
+    for peer in idle:
+        by_node.setdefault(peer.node, []).append(peer.name)
+    archived = []
+    for node in nodes.get_nodes():
+        if node.name in by_node:
+            archived.extend(await profiling.run_in_executor(db.archive_peers, by_node[node.name], node))
+    for client_name in archived:
+        forget_archived_client(client_name)
+    await callback_query.message.edit_text(f"В архив перенесено пиров: {len(archived)} из {len(idle)}.")
+    await callback_query.answer()
+
+async def restore_archived(message: types.Message):
+    if message.from_user.id != admin:
+        return
+    client_name = message.get_args().strip()
+    if not client_name:
+        records = await profiling.run_in_executor(db.list_archived)
+        if not records:
+            await message.answer("Архив пуст.")
+            return
+        text = f"В архиве {len(records)} пиров (первые {REPORT_TOP_K}):\n"
+        for record in records[:REPORT_TOP_K]:
+            text += f"{record['name']} ({record['node']}): в архиве с {record['archived_at'][:10]}\n"
+        text += "\nВосстановить: /restore <имя>"
+        await message.answer(text[:4096])
+        return
+    record = await profiling.run_in_executor(db.restore_peer, client_name)
+    if record is None:
+        await message.answer(f"Не удалось восстановить {client_name} из архива.")
+        return
+    handshake_log.seen(client_name, time.time())
+    usage_reports.idle.touch(client_name, time.time())
+    if not record.get('suspended'):
+        if record.get('expiration_time'):
+            expiration_time = datetime.fromisoformat(record['expiration_time'])
+            expiry_engine.schedule(client_name, expiration_time)
+            accounting_engine.set_subscription(client_name, expires_at=expiration_time.timestamp())
+        reschedule_limit_check(client_name, record.get('traffic_limit', "Неограниченно"))
+    text = f"Пир {client_name} восстановлен на узле {record['node']}, адрес {record['allowed_ips']}."
+    if record['address_changed']:
+        text += "\nСтарый адрес занят, клиенту нужна обновлённая конфигурация."
     await message.answer(text)
 
+async def show_slow_handlers(message: types.Message):
+    if message.from_user.id != admin:
+        return
+    top = slow_handlers.top()
+    if not top:
+        await message.answer("Статистика обработчиков пока пуста.")
+        return
+    text = f"Самые медленные обработчики (порог {SLOW_HANDLER_THRESHOLD:.1f} с):\n\n"
+    for name, stats in top:
+        text += f"{name}: макс. {stats.max * 1000:.0f}мс, сред. {stats.total / stats.count * 1000:.0f}мс, вызовов {stats.count}, медленных {stats.slow}\n"
+        if stats.blocked:
+            text += f"  блокировка цикла: {stats.blocked * 1000:.0f}мс\n"
+        if stats.last_slow:
+            text += f"  {stats.last_slow}\n"
+    text += f"\nМаксимальная задержка цикла событий: {loop_lag_monitor.max_lag * 1000:.0f}мс"
+    await message.answer(text[:4096])
+
 async def show_license_info(message: types.Message):
     username = f"user_{message.from_user.id}"
     expiration = db.get_user_expiration(username)
@@ -1221,8 +2083,8 @@ async def show_license_info(message: types.Message):
         )
         return
     
-    expiration_date = datetime.fromtimestamp(expiration['expiration'], UTC)
-    days_left = (expiration_date - datetime.now(UTC)).days
+    expiration_date = expiration
+    days_left = (expiration_date - datetime.now(pytz.UTC)).days
     
     text = "Информация о вашей подписке:\n\n"
     text += f"Статус: {'Активна' if days_left > 0 else 'Истекла'}\n"
@@ -1239,53 +2101,146 @@ async def show_license_info(message: types.Message):
 
 dp.register_message_handler(show_payment_options, commands=['buy'])
 dp.register_message_handler(show_payment_history, commands=['payments'])
+dp.register_message_handler(show_revenue, commands=['revenue'])
+dp.register_message_handler(show_slow_handlers, commands=['slow'])
+dp.register_message_handler(show_top_traffic, commands=['top'])
+dp.register_message_handler(show_near_limit, commands=['nearlimit'])
+dp.register_message_handler(show_idle_peers, commands=['idle'])
+dp.register_message_handler(show_reclaimable, commands=['reclaim'])
+dp.register_message_handler(restore_archived, commands=['restore'])
+dp.register_callback_query_handler(reclaim_confirm_callback, lambda c: c.data.startswith('reclaim_'))
+dp.register_callback_query_handler(show_payment_history_page, lambda c: c.data.startswith('payments_page_'))
 dp.register_message_handler(show_license_info, commands=['license'])
+dp.register_message_handler(show_dead_payments, commands=['deadletters'])
+dp.register_message_handler(retry_dead_payment, commands=['retry_payment'])
+# The catch-all goes last: aiogram stops at the first matching handler.
+dp.register_message_handler(handle_messages)
 dp.register_callback_query_handler(process_payment, lambda c: c.data.startswith('buy_'))
 
 async def handle_yookassa_notification(request):
     try:
         data = await request.json()
-        if data['event'] == 'payment.succeeded':
-            payment_id = data['object']['id']
-            await check_payment(payment_id)
+        event = data['event']
+        payment_id = data['object']['id']
+    except (ValueError, KeyError, TypeError) as e:
+        logger.error(f"Некорректное уведомление YooKassa: {e}")
+        return web.Response(status=400)
+    if event != 'payment.succeeded':
         return web.Response(status=200)
+    try:
+        if not await payment_queue.enqueue(payment_id, event, data):
+            logger.info(f"Повторное уведомление о платеже {payment_id} пропущено.")
     except Exception as e:
-        logger.error(f"Error processing YooKassa notification: {e}")
+        logger.error(f"Не удалось сохранить уведомление YooKassa о платеже {payment_id}: {e}")
         return web.Response(status=500)
+    return web.Response(status=200)
 
-async def on_startup(dp):
+def collect_scheduler_metrics():
+    metrics.scheduler_jobs.set(len(scheduler.get_jobs()), scheduler='apscheduler')
+    metrics.scheduler_jobs.set(len(expiry_engine), scheduler='expiry')
+    metrics.scheduler_jobs.set(len(limit_checks), scheduler='limits')
+
+metrics.REGISTRY.add_collector(collect_scheduler_metrics)
+
+async def handle_metrics(request):
+    return web.Response(body=metrics.REGISTRY.render().encode('utf-8'), headers={'Content-Type': metrics.CONTENT_TYPE})
+
+class TelegramWebhookHandler(WebhookRequestHandler):
+    async def post(self):
+        if WEBHOOK_SECRET and self.request.headers.get('X-Telegram-Bot-Api-Secret-Token') != WEBHOOK_SECRET:
+            logger.warning("Отклонён запрос к вебхуку Telegram с неверным секретным токеном.")
+            raise web.HTTPUnauthorized()
+        return await super().post()
+
+def create_web_app():
     app = web.Application()
     app.router.add_post('/yookassa-webhook', handle_yookassa_notification)
-    runner = web.AppRunner(app)
+    app.router.add_get('/metrics', handle_metrics)
+    if UPDATE_MODE == 'webhook':
+        app['BOT_DISPATCHER'] = dp
+        app.router.add_route('*', WEBHOOK_PATH, TelegramWebhookHandler, name='webhook_handler')
+        app.on_startup.append(lambda _: on_startup(dp))
+        app.on_shutdown.append(lambda _: on_webhook_shutdown(dp))
+    return app
+
+async def start_web_app():
+    runner = web.AppRunner(create_web_app())
     await runner.setup()
-    site = web.TCPSite(runner, 'localhost', 8080)
+    site = web.TCPSite(runner, WEBAPP_HOST, WEBAPP_PORT)
     await site.start()
-    
-    # Schedule tasks
-    scheduler.add_job(load_isp_cache_task, trigger=IntervalTrigger(hours=24))
-    scheduler.add_job(update_all_clients_traffic, trigger=IntervalTrigger(minutes=1))
-    scheduler.start()
-    logger.info("Планировщик запущен для обновления трафика каждые 5 минут.")
-    users = db.get_users_with_expiration()
-    for user in users:
-        client_name, expiration_time, traffic_limit = user
-        if expiration_time:
-            try:
-                expiration_datetime = datetime.fromisoformat(expiration_time)
-            except ValueError:
-                logger.error(f"Некорректный формат даты для пользователя {client_name}: {expiration_time}")
-                continue
-            if expiration_datetime.tzinfo is None:
-                expiration_datetime = expiration_datetime.replace(tzinfo=pytz.UTC)
-            if expiration_datetime > datetime.now(pytz.UTC):
-                scheduler.add_job(
-                    deactivate_user,
-                    trigger=DateTrigger(run_date=expiration_datetime),
-                    args=[client_name],
-                    id=client_name
-                )
-                logger.info(f"Запланирована деактивация пользователя {client_name} на {expiration_datetime}")
-            else:
-                await deactivate_user(client_name)
 
-executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
\ No newline at end of file
+async def setup_telegram_webhook():
+    if not WEBHOOK_URL:
+        logger.info(f"webhook_url не задан, вебхук Telegram не регистрируется. Обновления принимаются на {WEBAPP_HOST}:{WEBAPP_PORT}{WEBHOOK_PATH}.")
+        return
+    webhook_url = f"{WEBHOOK_URL}{WEBHOOK_PATH}"
+    await bot.set_webhook(webhook_url, secret_token=WEBHOOK_SECRET or None)
+    logger.info(f"Вебхук Telegram установлен: {webhook_url}")
+
+async def on_webhook_shutdown(dp):
+    await on_shutdown(dp)
+    await dp.storage.close()
+    await dp.storage.wait_closed()
+    session = await bot.get_session()
+    await session.close()
+
+async def on_startup(dp):
+    async with startup_phase('directories'):
+        os.makedirs('files/connections', exist_ok=True)
+        os.makedirs('users', exist_ok=True)
+    environment_ok, _, _, _, _ = await asyncio.gather(
+        run_startup_phase('environment', check_environment()),
+        run_startup_phase('isp_cache', load_isp_cache()),
+        run_startup_phase('expirations', load_expiry_engine()),
+        run_startup_phase('limit_checks', load_limit_checks()),
+        run_startup_phase('traffic_history', load_traffic_history())
+    )
+    if not environment_ok:
+        logger.error("Необходимо инициализировать AmneziaVPN перед запуском бота.")
+        await bot.send_message(admin, "Необходимо инициализировать AmneziaVPN перед запуском бота.")
+        await bot.close()
+        sys.exit(1)
+    async with startup_phase('web'):
+        if UPDATE_MODE == 'webhook':
+            await setup_telegram_webhook()
+        else:
+            await start_web_app()
+    async with startup_phase('scheduler'):
+        expiry_engine.start()
+        limit_checks.start()
+        suspend_retries.start()
+        loop_lag_monitor.start()
+        if payment_api:
+            await payment_queue.start()
+        scheduler.add_job(cleanup_isp_cache, IntervalTrigger(hours=1))
+        scheduler.add_job(update_all_clients_traffic, IntervalTrigger(minutes=1))
+        scheduler.add_job(save_traffic_history, IntervalTrigger(minutes=TRAFFIC_HISTORY_SAVE_INTERVAL))
+        scheduler.add_job(seed_idle_clients)
+        if SLOT_POOL_SIZE:
+            scheduler.add_job(
+                refill_slot_pool,
+                IntervalTrigger(minutes=SLOT_POOL_REFILL_INTERVAL),
+                next_run_time=datetime.now(pytz.UTC),
+                max_instances=1,
+                coalesce=True
+            )
+        scheduler.add_job(
+            reconcile_peer_names,
+            IntervalTrigger(seconds=PEER_NAMES_PROBE_INTERVAL),
+            next_run_time=datetime.now(pytz.UTC),
+            max_instances=1,
+            coalesce=True
+        )
+        scheduler.start()
+        container_watcher.start(nodes.get_nodes(), node_environment)
+        logger.info("Планировщик запущен для обновления трафика каждую минуту.")
+    log_startup_timings()
+
+def main():
+    if UPDATE_MODE == 'webhook':
+        web.run_app(create_web_app(), host=WEBAPP_HOST, port=WEBAPP_PORT)
+    else:
+        executor.start_polling(dp, on_startup=on_startup, on_shutdown=on_shutdown)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+import time
+import logging
+import threading
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+HALF_OPEN = 'half_open'
+OPEN = 'open'
+
+STATE_VALUES = {CLOSED: 0, HALF_OPEN: 1, OPEN: 2}
+
+# Consecutive failures open the circuit and further calls are rejected at
+# once instead of piling up behind a hung container. After reset_timeout a
+# single probe is let through: success closes the circuit, failure reopens it.
+class CircuitBreaker:
+    def __init__(self, name, failure_threshold=5, reset_timeout=30.0, clock=time.monotonic):
+        self.name = name
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self.clock = clock
+        self.state = CLOSED
+        self.failures = 0
+        self.opened_at = None
+        self._probing = False
+        self._lock = threading.Lock()
+
+    @property
+    def available(self):
+        return self.state == CLOSED
+
+    def allow(self):
+        with self._lock:
+            if self.state == CLOSED:
+                return True
+            if self.state == OPEN and self.clock() - self.opened_at >= self.reset_timeout:
+                self.state = HALF_OPEN
+                self._probing = False
+            if self.state == HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def record_success(self):
+        with self._lock:
+            if self.state != CLOSED:
+                logger.info(f"Контейнер {self.name} снова отвечает, вызовы возобновлены.")
+            self.state = CLOSED
+            self.failures = 0
+            self.opened_at = None
+            self._probing = False
+
+    def record_failure(self):
+        with self._lock:
+            self.failures += 1
+            if self.state == CLOSED and self.failures >= self.failure_threshold:
+                logger.warning(f"Контейнер {self.name} не отвечает ({self.failures} ошибок подряд), вызовы приостановлены на {self.reset_timeout:.0f} с.")
+                self._open()
+            elif self.state == HALF_OPEN:
+                self._open()
+            self._probing = False
+
+    def trip(self):
+        # The container is known to be down: no need to wait for failures.
+        with self._lock:
+            self._open()
+
+    def _open(self):
+        self.state = OPEN
+        self.opened_at = self.clock()
+
+    def retry_in(self):
+        if self.state != OPEN:
+            return 0.0
+        return max(self.reset_timeout - (self.clock() - self.opened_at), 0.0)
@@ -0,0 +1,117 @@
+import json
+import time
+import asyncio
+import logging
+
+logger = logging.getLogger(__name__)
+
+EVENTS = ('start', 'die', 'restart')
+
+def parse_event(line):
+    try:
+        event = json.loads(line)
+    except ValueError:
+        return None
+    if not isinstance(event, dict):
+        return None
+    action = event.get('Action') or event.get('status')
+    if action not in EVENTS:
+        return None
+    time_nano = event.get('timeNano') or int(event.get('time', 0)) * 10 ** 9
+    return action, int(time_nano)
+
+# One long-lived `docker events` per node instead of polling `docker ps`.
+# A broken stream is reopened with --since, so events emitted while it was
+# down are replayed rather than lost.
+class ContainerWatcher:
+    def __init__(self, on_down, on_up, reconnect_delay=1.0, max_reconnect_delay=60.0):
+        self.on_down = on_down
+        self.on_up = on_up
+        self.reconnect_delay = reconnect_delay
+        self.max_reconnect_delay = max_reconnect_delay
+        self.running = {}
+        self._since = {}
+        self._tasks = {}
+        self._processes = {}
+
+    def start(self, node_list, running=None):
+        loop = asyncio.get_running_loop()
+        now = time.time_ns()
+        for node in node_list:
+            self.running[node.name] = running.get(node.name, True) if running is not None else True
+            self._since[node.name] = now
+            self._tasks[node.name] = loop.create_task(self._watch(node))
+
+    async def stop(self):
+        tasks = list(self._tasks.values())
+        processes = list(self._processes.values())
+        for task in tasks:
+            task.cancel()
+        for process in processes:
+            if process.returncode is None:
+                process.terminate()
+        await asyncio.gather(*tasks, *(process.wait() for process in processes), return_exceptions=True)
+        self._tasks = {}
+        self._processes = {}
+
+    def command(self, node):
+        since = self._since[node.name]
+        cmd = [
+            'docker', 'events',
+            '--since', f"{since // 10 ** 9}.{since % 10 ** 9:09d}",
+            '--format', '{{json .}}',
+            '--filter', 'type=container',
+            '--filter', f"container={node.docker_container}"
+        ]
+        for event in EVENTS:
+            cmd += ['--filter', f"event={event}"]
+        return cmd
+
+    async def _watch(self, node):
+        delay = self.reconnect_delay
+        while True:
+            try:
+                process = await asyncio.create_subprocess_exec(
+                    *self.command(node),
+                    stdout=asyncio.subprocess.PIPE,
+                    stderr=asyncio.subprocess.PIPE,
+                    env=node.env()
+                )
+                self._processes[node.name] = process
+                async for line in process.stdout:
+                    delay = self.reconnect_delay
+                    event = parse_event(line)
+                    if event is None or event[1] <= self._since[node.name]:
+                        continue
+                    self._since[node.name] = event[1]
+                    await self._dispatch(node, event[0])
+                stderr = await process.stderr.read()
+                await process.wait()
+                logger.warning(
+                    f"Подписка на события контейнера узла {node.name} прервалась "
+                    f"(код {process.returncode}): {stderr.decode(errors='replace').strip()}"
+                )
+            except OSError as e:
+                logger.error(f"Не удалось подписаться на события контейнера узла {node.name}: {e}")
+            finally:
+                self._processes.pop(node.name, None)
+            await asyncio.sleep(delay)
+            delay = min(delay * 2, self.max_reconnect_delay)
+
+    async def _dispatch(self, node, action):
+        # `docker restart` emits die, start and restart: the container is
+        # handled once per transition, not once per event.
+        if action == 'die':
+            if not self.running.get(node.name, True):
+                return
+            self.running[node.name] = False
+            callback = self.on_down
+        else:
+            if self.running.get(node.name, True) and action == 'restart':
+                return
+            self.running[node.name] = True
+            callback = self.on_up
+        try:
+            await callback(node, action)
+        except Exception as e:
+            logger.error(f"Ошибка при обработке события {action} контейнера узла {node.name}: {e}")
@@ -1,15 +1,29 @@
 import os
+import re
 import subprocess
 import configparser
 import json
 import pytz
+import signal
+import sys
 import socket
 import logging
 import tempfile
+import nodes
+import wgconf
+import peers
+import metrics
+import circuit
+import hashlib
+import sqlite3
+import threading
 from datetime import datetime
 
 EXPIRATIONS_FILE = 'files/expirations.json'
 PAYMENTS_FILE = 'files/payments.json'
+PAYMENTS_DB_FILE = 'files/payments.sqlite'
+SLOTS_DIR = 'files/slots'
+ARCHIVE_DIR = 'files/archive'
 UTC = pytz.UTC
 
 logging.basicConfig(level=logging.INFO)
@@ -66,80 +80,286 @@ def create_config(path='files/setting.ini'):
         config.write(config_file)
     logger.info(f"Конфигурация сохранена в {path}")
 
-def ensure_peer_names():
-    setting = get_config()
-    wg_config_file = setting['wg_config_file']
-    docker_container = setting['docker_container']
+CLIENTS_TABLE_PATH = '/opt/amnezia/awg/clientsTable'
+MAX_PEERS_PER_SUBNET = 253
 
-    clientsTable = get_full_clients_table()
-    clients_dict = {client['clientId']: client['userData'] for client in clientsTable}
+peer_names_state = {}
+# Peer changes are serialized per node, so a slow node does not hold up the
+# others; names are reserved separately because they are unique across nodes.
+peer_scripts_locks = {}
+peer_scripts_locks_lock = threading.Lock()
+pending_client_names = set()
+peer_registry_cache = {}
+active_list_cache = {}
+circuit_breakers = {}
+circuit_breakers_lock = threading.Lock()
 
+# Failures of docker itself rather than of the command it ran: only these and
+# timeouts count against the circuit breaker.
+DOCKER_EXIT_CODES = (125, 126, 127)
+DOCKER_ERRORS = (
+    'Cannot connect to the Docker daemon',
+    'error during connect',
+    'No such container',
+    'is not running',
+    'is paused',
+    'is restarting'
+)
+
+class ContainerUnavailable(subprocess.CalledProcessError):
+    def __init__(self, cmd, reason):
+        super().__init__(-1, cmd)
+        self.reason = reason
+
+    def __str__(self):
+        return self.reason
+
+def peer_scripts_lock(node):
+    with peer_scripts_locks_lock:
+        lock = peer_scripts_locks.get(node.name)
+        if lock is None:
+            lock = peer_scripts_locks[node.name] = threading.Lock()
+        return lock
+
+def reserve_client_name(client_name):
+    with peer_scripts_locks_lock:
+        if client_name in pending_client_names:
+            return False
+        pending_client_names.add(client_name)
+        return True
+
+def release_client_name(client_name):
+    with peer_scripts_locks_lock:
+        pending_client_names.discard(client_name)
+
+def get_breaker(node):
+    with circuit_breakers_lock:
+        breaker = circuit_breakers.get(node.name)
+        if breaker is None:
+            breaker = circuit.CircuitBreaker(f"{node.docker_container} узла {node.name}")
+            circuit_breakers[node.name] = breaker
+        breaker.failure_threshold = node.circuit_threshold
+        breaker.reset_timeout = node.circuit_reset
+        return breaker
+
+def container_available(node):
+    return get_breaker(node).available
+
+def stale_nodes():
+    return [name for name, breaker in list(circuit_breakers.items()) if not breaker.available]
+
+def run_process_group(cmd, timeout, input=None, capture=False, **kwargs):
+    # On timeout the whole group is killed: killing only the shell or the
+    # script would leave its `docker exec` running.
+    with subprocess.Popen(
+        cmd, stdin=subprocess.PIPE if input is not None else None,
+        stdout=subprocess.PIPE if capture else None, stderr=subprocess.PIPE, start_new_session=True, **kwargs
+    ) as process:
+        try:
+            stdout, stderr = process.communicate(input, timeout=timeout)
+        except subprocess.TimeoutExpired:
+            os.killpg(process.pid, signal.SIGKILL)
+            process.communicate()
+            raise
+    # stderr is read to tell docker failures apart, but still ends up where
+    # it went before.
+    if stderr:
+        sys.stderr.write(stderr.decode('utf-8', errors='replace'))
+    return process.returncode, stdout, stderr
+
+def is_docker_failure(returncode, stderr):
+    if returncode in DOCKER_EXIT_CODES:
+        return True
+    text = stderr.decode('utf-8', errors='replace') if stderr else ''
+    return any(error in text for error in DOCKER_ERRORS)
+
+def run_measured(func, cmd, node, timeout=None, **kwargs):
+    # func picks the convention of subprocess.call, check_call or
+    # check_output. Every container command has a deadline and goes through
+    # the node's circuit breaker; rejected and timed-out commands fail the
+    # way the caller already handles: CalledProcessError or a non-zero code.
+    # A command that fails on its own still shows the container answers.
+    command = metrics.command_label(cmd)
+    timeout = timeout or node.docker_timeout
+    breaker = get_breaker(node)
+    if not breaker.allow():
+        metrics.docker_commands.inc(node=node.name, command=command, result='rejected')
+        if func is subprocess.call:
+            return -1
+        raise ContainerUnavailable(cmd, f"Контейнер {node.docker_container} узла {node.name} недоступен, повтор через {breaker.retry_in():.0f} с")
+    result = None
+    try:
+        with metrics.docker_duration.time(node=node.name, command=command):
+            returncode, output, stderr = run_process_group(cmd, timeout, capture=func is subprocess.check_output, env=node.env(), **kwargs)
+        if returncode == 0:
+            result = 'ok'
+        else:
+            result = 'unavailable' if is_docker_failure(returncode, stderr) else 'error'
+        if func is subprocess.call:
+            return returncode
+        if returncode != 0:
+            raise subprocess.CalledProcessError(returncode, cmd, output, stderr)
+        return output if func is subprocess.check_output else 0
+    except subprocess.TimeoutExpired:
+        result = 'timeout'
+        if func is subprocess.call:
+            return -1
+        raise ContainerUnavailable(cmd, f"Команда {command} узла {node.name} не завершилась за {timeout:.0f} с")
+    finally:
+        # Any other exception (OSError from the spawn, a broken env) leaves
+        # result unset; it counts as a failure so a half-open probe is settled.
+        result = result or 'unavailable'
+        if result in ('ok', 'error'):
+            breaker.record_success()
+        else:
+            breaker.record_failure()
+        metrics.docker_commands.inc(node=node.name, command=command, result=result)
+        metrics.container_circuit.set(circuit.STATE_VALUES[breaker.state], node=node.name)
+
+def docker_output(cmd, node=None):
+    node = node or nodes.get_default_node()
+    return run_measured(subprocess.check_output, cmd, node, shell=True)
+
+def docker_call(cmd, node=None):
+    node = node or nodes.get_default_node()
+    return run_measured(subprocess.check_call, cmd, node, shell=True)
+
+def get_full_clients_table(node=None):
+    node = node or nodes.get_default_node()
     try:
-        cmd = f"docker exec -i {docker_container} cat {wg_config_file}"
-        config_content = subprocess.check_output(cmd, shell=True).decode('utf-8')
+        cmd = f"docker exec -i {node.docker_container} cat {CLIENTS_TABLE_PATH}"
+        return json.loads(docker_output(cmd, node).decode('utf-8'))
+    except (subprocess.CalledProcessError, json.JSONDecodeError) as e:
+        logger.error(f"Ошибка при получении clientsTable: {e}")
+        return []
 
-        lines = config_content.splitlines()
-        new_config_lines = []
-        i = 0
-        modified = False
+def write_clients_table(clients_table, node=None):
+    node = node or nodes.get_default_node()
+    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_clientsTable:
+        json.dump(clients_table, temp_clientsTable)
+        temp_clientsTable_path = temp_clientsTable.name
+    try:
+        docker_call(f"docker cp {temp_clientsTable_path} {node.docker_container}:{CLIENTS_TABLE_PATH}", node)
+    finally:
+        os.remove(temp_clientsTable_path)
+    invalidate_peer_registry(node)
+
+def read_wg_config(node=None, interface=None):
+    node = node or nodes.get_default_node()
+    interface = interface or nodes.get_interfaces(node)[0]
+    host_path = interface.host_path
+    if host_path and os.path.exists(host_path):
+        with open(host_path, 'r') as f:
+            return f.read()
+    cmd = f"docker exec -i {node.docker_container} cat {interface.config_file}"
+    return docker_output(cmd, node).decode('utf-8')
+
+def write_wg_config(content, node=None, interface=None):
+    node = node or nodes.get_default_node()
+    interface = interface or nodes.get_interfaces(node)[0]
+    host_path = interface.host_path
+    invalidate_peer_registry(node)
+    if host_path and os.path.exists(host_path):
+        wgconf.write_file(host_path, content)
+        return
+    with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_config:
+        temp_config.write(content)
+        temp_config_path = temp_config.name
+    try:
+        docker_cmd = f"docker cp {temp_config_path} {node.docker_container}:{interface.config_file}"
+        docker_call(docker_cmd, node)
+    finally:
+        os.remove(temp_config_path)
+
+def probe_wg_config(node=None, interface=None):
+    node = node or nodes.get_default_node()
+    interface = interface or nodes.get_interfaces(node)[0]
+    host_path = interface.host_path
+    try:
+        if host_path and os.path.exists(host_path):
+            stat = os.stat(host_path)
+            return f"{stat.st_mtime_ns}:{stat.st_size}:{stat.st_ino}"
+        cmd = f"docker exec -i {node.docker_container} stat -c '%Y:%s:%i' {interface.config_file}"
+        return docker_output(cmd, node).decode().strip()
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error(f"Ошибка при проверке файла конфигурации WireGuard: {e}")
+        return None
+
+def ensure_peer_names(config_content=None, node=None, interface=None):
+    node = node or nodes.get_default_node()
+    interface = interface or nodes.get_interfaces(node)[0]
+
+    try:
+        if config_content is None:
+            config_content = read_wg_config(node, interface)
+        config = wgconf.parse(config_content)
+        unnamed = config.unnamed_peers()
+        if not unnamed:
+            return config_content
+
+        clientsTable = get_full_clients_table(node)
+        clients_dict = {client['clientId']: client['userData'] for client in clientsTable}
         updated_clientsTable = False
 
-        while i < len(lines):
-            line = lines[i]
-            if line.strip().startswith('[Peer]'):
-                peer_block = [line]
-                i += 1
-                has_name_comment = False
-                client_public_key = ''
-                while i < len(lines) and lines[i].strip() != '':
-                    peer_line = lines[i]
-                    if peer_line.strip().startswith('#'):
-                        has_name_comment = True
-                    elif peer_line.strip().startswith('PublicKey ='):
-                        client_public_key = peer_line.strip().split('=', 1)[1].strip()
-                    peer_block.append(peer_line)
-                    i += 1
-                if not has_name_comment:
-                    if client_public_key in clients_dict:
-                        client_name = clients_dict[client_public_key].get('clientName', f"client_{client_public_key[:6]}")
-                    else:
-                        client_name = f"client_{client_public_key[:6]}"
-                        clients_dict[client_public_key] = {
-                            'clientName': client_name,
-                            'creationDate': datetime.now().isoformat()
-                        }
-                        updated_clientsTable = True
-                    peer_block.insert(1, f'# {client_name}')
-                    modified = True
-                new_config_lines.extend(peer_block)
-                if i < len(lines):
-                    new_config_lines.append(lines[i])
-                    i += 1
+        patch = wgconf.ConfigPatch(config)
+        for peer in unnamed:
+            client_public_key = peer.public_key
+            if client_public_key in clients_dict:
+                client_name = clients_dict[client_public_key].get('clientName', f"client_{client_public_key[:6]}")
             else:
-                new_config_lines.append(line)
-                i += 1
-
-        if modified:
-            new_config_content = '\n'.join(new_config_lines)
-            with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_config:
-                temp_config.write(new_config_content)
-                temp_config_path = temp_config.name
-            docker_cmd = f"docker cp {temp_config_path} {docker_container}:{wg_config_file}"
-            subprocess.check_call(docker_cmd, shell=True)
-            os.remove(temp_config_path)
-            logger.info("Конфигурационный файл WireGuard обновлён с добавлением комментариев # name_client.")
+                client_name = f"client_{client_public_key[:6]}"
+                clients_dict[client_public_key] = {
+                    'clientName': client_name,
+                    'creationDate': datetime.now().isoformat()
+                }
+                updated_clientsTable = True
+            patch.rename(peer, client_name)
+        new_config_content = patch.apply()
+
+        write_wg_config(new_config_content, node, interface)
+        logger.info(f"Конфигурационный файл WireGuard {interface.name} узла {node.name} обновлён: добавлены комментарии # name_client для {len(unnamed)} пиров.")
 
         if updated_clientsTable:
             clientsTable_list = [{'clientId': key, 'userData': value} for key, value in clients_dict.items()]
-            with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_clientsTable:
-                json.dump(clientsTable_list, temp_clientsTable)
-                temp_clientsTable_path = temp_clientsTable.name
-            docker_cmd = f"docker cp {temp_clientsTable_path} {docker_container}:/opt/amnezia/awg/clientsTable"
-            subprocess.check_call(docker_cmd, shell=True)
-            os.remove(temp_clientsTable_path)
+            write_clients_table(clientsTable_list, node)
             logger.info("clientsTable обновлён с новыми клиентами.")
+        return new_config_content
     except Exception as e:
         logger.error(f"Ошибка при обновлении комментариев в конфигурации WireGuard: {e}")
+        return None
+
+def reconcile_peer_names(force=False, node=None):
+    node = node or nodes.get_default_node()
+    changed = False
+    for interface in nodes.get_interfaces(node):
+        changed = reconcile_interface_peer_names(node, interface, force) or changed
+    return changed
+
+def reconcile_interface_peer_names(node, interface, force=False):
+    state = peer_names_state.setdefault(f"{node.name}:{interface.name}", {'signature': None, 'hash': None})
+    signature = probe_wg_config(node, interface)
+    if signature is None:
+        return False
+    if not force and signature == state['signature']:
+        return False
+    try:
+        config_content = read_wg_config(node, interface)
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error(f"Ошибка при чтении конфигурации WireGuard {interface.name} узла {node.name}: {e}")
+        return False
+    content_hash = hashlib.sha256(config_content.encode('utf-8')).hexdigest()
+    if not force and content_hash == state['hash']:
+        state['signature'] = signature
+        return False
+    new_config_content = ensure_peer_names(config_content, node, interface)
+    if new_config_content is None:
+        return False
+    if new_config_content != config_content:
+        content_hash = hashlib.sha256(new_config_content.encode('utf-8')).hexdigest()
+        signature = probe_wg_config(node, interface)
+    state['signature'] = signature
+    state['hash'] = content_hash
+    return True
 
 def get_config(path='files/setting.ini'):
     if not os.path.exists(path):
@@ -173,30 +393,113 @@ def save_client_endpoint(username, endpoint):
     with open(file_path, 'w') as f:
         json.dump(data, f)
 
-def root_add(id_user, ipv6=False):
-    setting = get_config()
-    endpoint = setting['endpoint']
-    wg_config_file = setting['wg_config_file']
-    docker_container = setting['docker_container']
+def root_add(id_user, ipv6=False, node=None):
+    node = node or nodes.get_default_node()
 
-    clients = get_client_list()
-    client_entry = next((c for c in clients if c[0] == id_user), None)
-    if client_entry:
-        logger.info(f"Пользователь {id_user} уже существует. Генерация конфигурации невозможна без приватного ключа.")
-        return False
-    else:
-        cmd = ["./newclient.sh", id_user, endpoint, wg_config_file, docker_container]
-        if subprocess.call(cmd) == 0:
-            return True
+    if not reserve_client_name(id_user):
+        logger.info(f"Пользователь {id_user} уже создаётся.")
         return False
+    try:
+        # Names are unique across all nodes: users/<name> and the node
+        # assignment are shared, so a second peer would orphan the first.
+        existing = find_client_node(id_user)
+        if existing is not None:
+            logger.info(f"Пользователь {id_user} уже существует на узле {existing.name}. Генерация конфигурации невозможна без приватного ключа.")
+            return False
+        with peer_scripts_lock(node):
+            clients = get_client_list(node)
+            interface = pick_interface(node, clients)
+            if interface is None:
+                return False
+            cmd = ["./newclient.sh", id_user, node.endpoint, interface.config_file, node.docker_container, interface.subnet_prefix]
+            returncode = run_measured(subprocess.call, cmd, node, timeout=node.script_timeout)
+            invalidate_peer_registry(node)
+            if returncode == 0:
+                nodes.assign_client(id_user, node)
+                return True
+            return False
+    finally:
+        release_client_name(id_user)
+
+def pick_interface(node, clients):
+    interfaces = nodes.get_interfaces(node)
+    load = {interface.name: 0 for interface in interfaces}
+    for client in clients:
+        if client.interface in load:
+            load[client.interface] += 1
+    limit = node.max_peers_per_interface or MAX_PEERS_PER_SUBNET
+    candidates = [interface for interface in interfaces if load[interface.name] < limit]
+    if candidates:
+        return min(candidates, key=lambda interface: load[interface.name])
+    interface = create_interface(node, interfaces)
+    if interface is None:
+        logger.error(f"Все интерфейсы узла {node.name} заполнены, а новый интерфейс создать не удалось.")
+    return interface
+
+def create_interface(node, interfaces=None):
+    interfaces = interfaces or nodes.get_interfaces(node)
+    used_ports = {interface.listen_port for interface in interfaces}
+    free_ports = [port for port in node.shard_ports if port not in used_ports]
+    if not free_ports:
+        logger.error(f"Для узла {node.name} нет свободных портов в shard_ports для нового интерфейса.")
+        return None
+
+    primary = interfaces[0]
+    used_names = {interface.name for interface in interfaces}
+    used_subnets = {interface.subnet_prefix for interface in interfaces}
+    index = 1
+    while f"wg{index}" in used_names:
+        index += 1
+    base = primary.subnet_prefix.split('.')
+    third_octet = int(base[2]) + 1
+    while '.'.join(base[:2] + [str(third_octet)]) in used_subnets:
+        third_octet += 1
+    if third_octet > 255:
+        logger.error(f"Не осталось свободных подсетей для нового интерфейса узла {node.name}.")
+        return None
+    prefix = '.'.join(base[:2] + [str(third_octet)])
+    name = f"wg{index}"
+    interface = nodes.Interface(
+        name,
+        os.path.join(os.path.dirname(primary.config_file), f"{name}.conf"),
+        f"{prefix}.0/24",
+        free_ports[0]
+    )
+
+    try:
+        primary_config = wgconf.parse(read_wg_config(node, primary))
+        private_key = docker_output(f"docker exec -i {node.docker_container} wg genkey", node).decode().strip()
+        lines = ["[Interface]", f"PrivateKey = {private_key}", f"Address = {prefix}.1/24", f"ListenPort = {interface.listen_port}"]
+        primary_fields = primary_config.interface.fields if primary_config.interface else {}
+        for key in wgconf.OBFUSCATION_PARAMS:
+            if key in primary_fields:
+                lines.append(f"{key} = {primary_fields[key]}")
+        lines.append(f"PostUp = iptables -A FORWARD -i {name} -j ACCEPT; iptables -t nat -A POSTROUTING -s {interface.subnet} -o eth0 -j MASQUERADE")
+        lines.append(f"PostDown = iptables -D FORWARD -i {name} -j ACCEPT; iptables -t nat -D POSTROUTING -s {interface.subnet} -o eth0 -j MASQUERADE")
+        content = '\n'.join(lines) + '\n\n'
+
+        with tempfile.NamedTemporaryFile(mode='w', delete=False) as temp_config:
+            temp_config.write(content)
+            temp_config_path = temp_config.name
+        try:
+            docker_call(f"docker cp {temp_config_path} {node.docker_container}:{interface.config_file}", node)
+        finally:
+            os.remove(temp_config_path)
+        docker_call(f"docker exec -i {node.docker_container} wg-quick up {interface.config_file}", node)
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error(f"Ошибка при создании интерфейса {name} на узле {node.name}: {e}")
+        return None
+
+    nodes.add_interface(node, interface)
+    invalidate_peer_registry(node)
+    logger.info(f"На узле {node.name} создан интерфейс {name} ({interface.subnet}, порт {interface.listen_port}).")
+    return interface
 
-def get_clients_from_clients_table():
-    setting = get_config()
-    docker_container = setting['docker_container']
-    clients_table_path = '/opt/amnezia/awg/clientsTable'
+def get_clients_from_clients_table(node=None):
+    node = node or nodes.get_default_node()
     try:
-        cmd = f"docker exec -i {docker_container} cat {clients_table_path}"
-        call = subprocess.check_output(cmd, shell=True)
+        cmd = f"docker exec -i {node.docker_container} cat {CLIENTS_TABLE_PATH}"
+        call = docker_output(cmd, node)
         clients_table = json.loads(call.decode('utf-8'))
         client_map = {client['clientId']: client['userData']['clientName'] for client in clients_table}
         return client_map
@@ -207,64 +510,88 @@ def get_clients_from_clients_table():
         logger.error("Ошибка при разборе clientsTable JSON.")
         return {}
 
-def parse_client_name(full_name):
-    return full_name.split('[')[0].strip()
-
-def get_client_list():
-    setting = get_config()
-    wg_config_file = setting['wg_config_file']
-    docker_container = setting['docker_container']
-
-    client_map = get_clients_from_clients_table()
-
-    try:
-        cmd = f"docker exec -i {docker_container} cat {wg_config_file}"
-        call = subprocess.check_output(cmd, shell=True)
-        config_content = call.decode('utf-8')
-
-        clients = []
-        lines = config_content.splitlines()
-        i = 0
-        while i < len(lines):
-            line = lines[i].strip()
-            if line.startswith('[Peer]'):
-                client_public_key = ''
-                allowed_ips = ''
-                client_name = 'Unknown'
-                i += 1
-                while i < len(lines):
-                    peer_line = lines[i].strip()
-                    if peer_line == '':
-                        break
-                    if peer_line.startswith('#'):
-                        full_client_name = peer_line[1:].strip()
-                        client_name = parse_client_name(full_client_name)
-                    elif peer_line.startswith('PublicKey ='):
-                        client_public_key = peer_line.split('=', 1)[1].strip()
-                    elif peer_line.startswith('AllowedIPs ='):
-                        allowed_ips = peer_line.split('=', 1)[1].strip()
-                    i += 1
-                client_name = client_map.get(client_public_key, client_name if 'client_name' in locals() else 'Unknown')
-                clients.append([client_name, client_public_key, allowed_ips])
+def probe_peer_sources(node, interfaces):
+    signature = []
+    container_paths = []
+    try:
+        for interface in interfaces:
+            host_path = interface.host_path
+            if host_path and os.path.exists(host_path):
+                stat = os.stat(host_path)
+                signature.append(f"{stat.st_mtime_ns}:{stat.st_size}:{stat.st_ino}")
             else:
-                i += 1
-        return clients
-    except subprocess.CalledProcessError as e:
-        logger.error(f"Ошибка при получении списка клиентов: {e}")
-        return []
+                container_paths.append(interface.config_file)
+        container_paths.append(CLIENTS_TABLE_PATH)
+        cmd = f"docker exec -i {node.docker_container} stat -c '%Y:%s:%i' {' '.join(container_paths)}"
+        signature.extend(docker_output(cmd, node).decode().split())
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error(f"Ошибка при проверке файлов клиентов узла {node.name}: {e}")
+        return None
+    return tuple(signature)
+
+def invalidate_peer_registry(node=None):
+    node = node or nodes.get_default_node()
+    # The registry stays as the last known state for when the container
+    # is unavailable; it just never matches a signature again.
+    cached = peer_registry_cache.get(node.name)
+    if cached is not None:
+        peer_registry_cache[node.name] = (None, cached[1])
+
+def get_client_list(node=None):
+    node = node or nodes.get_default_node()
+    interfaces = nodes.get_interfaces(node)
+
+    # One stat of every interface config and clientsTable is much cheaper than
+    # re-reading and re-parsing them, so the registry is rebuilt only when one
+    # of these files changed or the bot itself modified them.
+    signature = probe_peer_sources(node, interfaces)
+    cached = peer_registry_cache.get(node.name)
+    if signature is not None and cached is not None and cached[0] == signature:
+        metrics.cache_hit('registry')
+        return cached[1]
+    if signature is None and cached is not None and not container_available(node):
+        metrics.cache_stale('registry')
+        return cached[1]
+    metrics.cache_miss('registry')
+
+    client_map = get_clients_from_clients_table(node)
 
-def get_active_list():
-    setting = get_config()
-    docker_container = setting['docker_container']
+    registry = peers.PeerRegistry()
+    complete = True
+    for interface in interfaces:
+        interface_clients = get_interface_client_list(node, interface, client_map)
+        if interface_clients is None:
+            complete = False
+            continue
+        metrics.peers.set(len(interface_clients), node=node.name, interface=interface.name)
+        for client in interface_clients:
+            registry.add(client)
+    if signature is not None and complete:
+        peer_registry_cache[node.name] = (signature, registry)
+    elif not complete and cached is not None and not container_available(node):
+        metrics.cache_stale('registry')
+        return cached[1]
+    return registry
 
-    client_map = get_clients_from_clients_table()
+def get_interface_client_list(node, interface, client_map):
+    try:
+        config = wgconf.parse(read_wg_config(node, interface))
+        return [
+            peers.Peer(client_map.get(peer.public_key, peer.name or 'Unknown'), peer.public_key, peer.allowed_ips, node.name, interface.name, peer.suspended)
+            for peer in config.peers
+        ]
+    except (subprocess.CalledProcessError, OSError) as e:
+        logger.error(f"Ошибка при получении списка клиентов {interface.name} узла {node.name}: {e}")
+        return None
+
+def get_active_list(node=None):
+    node = node or nodes.get_default_node()
 
     try:
-        clients = get_client_list()
-        client_key_map = {client[1]: client[0] for client in clients}
+        clients = get_client_list(node)
 
-        cmd = f"docker exec -i {docker_container} wg show"
-        call = subprocess.check_output(cmd, shell=True)
+        cmd = f"docker exec -i {node.docker_container} wg show"
+        call = docker_output(cmd, node)
         wg_output = call.decode('utf-8')
 
         active_clients = []
@@ -283,48 +610,523 @@ def get_active_list():
             elif line == '' and 'public_key' in current_peer:
                 last_handshake = current_peer.get('latest_handshake', '').lower()
                 if last_handshake not in ['never', 'нет данных', '-']:
-                    peer_public_key = current_peer.get('public_key')
-                    if peer_public_key in client_key_map:
-                        username = client_key_map[peer_public_key]
+                    client = clients.find_by_key(current_peer.get('public_key'))
+                    if client:
+                        username = client.name
                         last_time = current_peer.get('latest_handshake', 'Нет данных')
                         transfer = current_peer.get('transfer', 'Нет данных')
                         endpoint = current_peer.get('endpoint', 'Нет данных')
                         save_client_endpoint(username, endpoint)
-                        active_clients.append([username, last_time, transfer, endpoint])
+                        active_clients.append(peers.PeerStatus(username, last_time, transfer, endpoint))
                 current_peer = {}
 
         if 'public_key' in current_peer:
             last_handshake = current_peer.get('latest_handshake', '').lower()
             if last_handshake not in ['never', 'нет данных', '-']:
-                peer_public_key = current_peer.get('public_key')
-                if peer_public_key in client_key_map:
-                    username = client_key_map[peer_public_key]
+                client = clients.find_by_key(current_peer.get('public_key'))
+                if client:
+                    username = client.name
                     last_time = current_peer.get('latest_handshake', 'Нет данных')
                     transfer = current_peer.get('transfer', 'Нет данных')
                     endpoint = current_peer.get('endpoint', 'Нет данных')
                     save_client_endpoint(username, endpoint)
-                    active_clients.append([username, last_time, transfer, endpoint])
+                    active_clients.append(peers.PeerStatus(username, last_time, transfer, endpoint))
 
+        metrics.active_peers.set(len(active_clients), node=node.name)
+        active_list_cache[node.name] = active_clients
         return active_clients
 
     except subprocess.CalledProcessError as e:
         print(f"Ошибка при получении активных клиентов: {e}")
-        return []
+        return active_list_cache.get(node.name, [])
+
+def get_peer_transfers(node=None):
+    node = node or nodes.get_default_node()
+
+    try:
+        clients = get_client_list(node)
+        cmd = f"docker exec -i {node.docker_container} wg show all transfer"
+        transfers = {}
+        for line in docker_output(cmd, node).decode('utf-8').splitlines():
+            fields = line.split('\t')
+            if len(fields) != 4:
+                continue
+            client = clients.find_by_key(fields[1])
+            if client:
+                transfers[client.name] = (int(fields[2]), int(fields[3]))
+        return transfers
+    except (subprocess.CalledProcessError, ValueError) as e:
+        logger.error(f"Ошибка при получении счётчиков трафика узла {node.name}: {e}")
+        return {}
+
+def get_peer_dump(node=None):
+    node = node or nodes.get_default_node()
+
+    clients = get_client_list(node)
+    cmd = f"docker exec -i {node.docker_container} wg show all dump"
+    names, rx, tx, handshakes, endpoints = [], [], [], [], []
+    for line in docker_output(cmd, node).decode('utf-8').splitlines():
+        fields = line.split('\t')
+        if len(fields) != 9:
+            continue
+        client = clients.find_by_key(fields[1])
+        if client is None:
+            continue
+        names.append(client.name)
+        rx.append(int(fields[6]))
+        tx.append(int(fields[7]))
+        handshakes.append(int(fields[5]))
+        if fields[5] != '0' and fields[3] != '(none)':
+            endpoints.append((client.name, fields[3]))
+    metrics.active_peers.set(len(endpoints), node=node.name)
+    return names, rx, tx, handshakes, endpoints
+
+def save_client_endpoints(endpoints):
+    for username, endpoint in endpoints:
+        save_client_endpoint(username, endpoint)
+
+def find_client_node(client_name):
+    node = nodes.get_client_node(client_name)
+    if node:
+        return node
+    for node in nodes.get_nodes():
+        if client_name in get_client_list(node):
+            nodes.assign_client(client_name, node)
+            return node
+    return None
+
+def deactive_user_db(client_name, node=None):
+    node = node or find_client_node(client_name)
+    if node is None:
+        logger.error(f"Пользователь {client_name} не найден ни на одном узле.")
+        return False
+
+    with peer_scripts_lock(node):
+        client_entry = get_client_list(node).get(client_name)
+        if client_entry:
+            interface = nodes.get_interface(node, client_entry.interface) or nodes.get_interfaces(node)[0]
+            returncode = run_measured(subprocess.call, ["./removeclient.sh", client_name, client_entry.public_key, interface.config_file, node.docker_container], node, timeout=node.script_timeout)
+            invalidate_peer_registry(node)
+            if returncode == 0:
+                nodes.unassign_client(client_name)
+                return True
+        else:
+            logger.error(f"Пользователь {client_name} не найден в списке клиентов узла {node.name}.")
+        return False
+
+LIVE_REMOVE_BATCH = 200
+
+def add_live_peer(node, interface, public_key, preshared_key, allowed_ips):
+    cmd = f"docker exec -i {node.docker_container} wg set {interface.name} peer {public_key}"
+    if preshared_key:
+        cmd += " preshared-key /dev/stdin"
+    cmd += f" allowed-ips {allowed_ips.replace(' ', '')}"
+    run_measured(subprocess.check_output, cmd, node, shell=True, input=(preshared_key or '').encode())
+
+def remove_live_peers(node, interface, public_keys):
+    # One `wg set` takes any number of peer clauses.
+    for start in range(0, len(public_keys), LIVE_REMOVE_BATCH):
+        clauses = ' '.join(f"peer {public_key} remove" for public_key in public_keys[start:start + LIVE_REMOVE_BATCH])
+        run_measured(subprocess.check_output, f"docker exec -i {node.docker_container} wg set {interface.name} {clauses}", node, shell=True)
 
-def deactive_user_db(client_name):
-    setting = get_config()
-    wg_config_file = setting['wg_config_file']
-    docker_container = setting['docker_container']
+def add_live_section(node, interface, peer):
+    add_live_peer(node, interface, peer.public_key, peer.fields.get('PresharedKey', ''), peer.allowed_ips)
 
-    clients = get_client_list()
-    client_entry = next((c for c in clients if c[0] == client_name), None)
-    if client_entry:
-        client_public_key = client_entry[1]
-        if subprocess.call(["./removeclient.sh", client_name, client_public_key, wg_config_file, docker_container]) == 0:
+def set_peer_suspended(client_name, suspended, node=None):
+    node = node or find_client_node(client_name)
+    if node is None:
+        logger.error(f"Пользователь {client_name} не найден ни на одном узле.")
+        return False
+
+    with peer_scripts_lock(node):
+        client_entry = get_client_list(node).get(client_name)
+        if client_entry is None:
+            logger.error(f"Пользователь {client_name} не найден в списке клиентов узла {node.name}.")
+            return False
+        if client_entry.suspended == suspended:
             return True
-    else:
-        logger.error(f"Пользователь {client_name} не найден в списке клиентов.")
-    return False
+        interface = nodes.get_interface(node, client_entry.interface) or nodes.get_interfaces(node)[0]
+        try:
+            config = wgconf.parse(read_wg_config(node, interface))
+            peer = config.find_peer(client_entry.public_key)
+            if peer is None:
+                logger.error(f"Пир {client_name} не найден в конфигурации {interface.name} узла {node.name}.")
+                return False
+            patch = wgconf.ConfigPatch(config)
+            # Only the running interface and the peer's own lines change:
+            # no wg-quick restart, and the client keeps its keys and config.
+            if suspended:
+                patch.suspend(peer)
+            else:
+                patch.resume(peer)
+            write_wg_config(patch.apply(), node, interface)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error(f"Ошибка при изменении состояния пира {client_name} на узле {node.name}: {e}")
+            return False
+        # The file is written first: a failed write leaves nothing to undo,
+        # and a failed live change is undone by restoring the old text.
+        try:
+            if suspended:
+                remove_live_peers(node, interface, [peer.public_key])
+            else:
+                add_live_section(node, interface, peer)
+        except subprocess.CalledProcessError as e:
+            logger.error(f"Ошибка при изменении состояния пира {client_name} на интерфейсе {interface.name} узла {node.name}: {e}")
+            try:
+                write_wg_config(config.text, node, interface)
+            except (subprocess.CalledProcessError, OSError) as e:
+                logger.error(f"Не удалось вернуть конфигурацию {interface.name} узла {node.name}: {e}")
+            return False
+    action = "приостановлен" if suspended else "возобновлён"
+    logger.info(f"Пир {client_name} {action} на интерфейсе {interface.name} узла {node.name}.")
+    return True
+
+def slot_paths(slot_name):
+    return os.path.join(SLOTS_DIR, f"{slot_name}.conf"), os.path.join(SLOTS_DIR, f"{slot_name}.vpn")
+
+def available_slots(clients):
+    return [
+        client for client in clients
+        if client.suspended and peers.is_slot_name(client.name) and os.path.exists(slot_paths(client.name)[0])
+    ]
+
+def count_slots(node=None):
+    node = node or nodes.get_default_node()
+    return len(available_slots(get_client_list(node)))
+
+def generate_key_pair(node):
+    container = node.docker_container
+    private_key = docker_output(f"docker exec -i {container} wg genkey", node).decode().strip()
+    preshared_key = docker_output(f"docker exec -i {container} wg genpsk", node).decode().strip()
+    public_key = run_measured(subprocess.check_output, f"docker exec -i {container} wg pubkey", node, shell=True, input=private_key.encode()).decode().strip()
+    return private_key, public_key, preshared_key
+
+def encode_vpn_key(conf_path):
+    output = subprocess.check_output(['python3.11', 'awg-decode.py', '--encode', conf_path]).decode().strip()
+    if not output.startswith('vpn://'):
+        raise ValueError(f"awg-decode.py вернул некорректный формат: {output}")
+    return output
+
+def provision_slots(count, node=None):
+    node = node or nodes.get_default_node()
+    # Key generation does not depend on the config, so it runs before the
+    # lock; only address allocation and the single config write hold it.
+    try:
+        key_pairs = [generate_key_pair(node) for _ in range(count)]
+    except subprocess.CalledProcessError as e:
+        logger.error(f"Ошибка при генерации ключей для резерва узла {node.name}: {e}")
+        return 0
+    os.makedirs(SLOTS_DIR, exist_ok=True)
+    created = []
+    with peer_scripts_lock(node):
+        clients = get_client_list(node)
+        interface = pick_interface(node, clients)
+        if interface is None:
+            return 0
+        try:
+            config = wgconf.parse(read_wg_config(node, interface))
+            server_fields = config.interface.fields if config.interface else {}
+            server_public_key = run_measured(
+                subprocess.check_output, f"docker exec -i {node.docker_container} wg pubkey", node,
+                shell=True, input=server_fields.get('PrivateKey', '').encode()
+            ).decode().strip()
+            params = [(key, server_fields[key]) for key in wgconf.OBFUSCATION_PARAMS if key in server_fields]
+            endpoint = f"{node.endpoint}:{server_fields.get('ListenPort', '')}"
+            used = config.used_addresses()
+            patch = wgconf.ConfigPatch(config)
+            for private_key, public_key, preshared_key in key_pairs:
+                address = config.next_address(interface.subnet_prefix, used)
+                if address is None:
+                    break
+                used.add(address)
+                slot_name = f"{peers.SLOT_PREFIX}{hashlib.sha256(public_key.encode('utf-8')).hexdigest()[:12]}"
+                conf_path, _ = slot_paths(slot_name)
+                with open(conf_path, 'w') as f:
+                    f.write(wgconf.format_client_config(address, private_key, params, server_public_key, preshared_key, endpoint))
+                patch.add(slot_name, public_key, preshared_key, address, suspended=True)
+                created.append((slot_name, public_key))
+            if not created:
+                return 0
+            write_wg_config(patch.apply(), node, interface)
+            clients_table = get_full_clients_table(node)
+            creation_date = datetime.now().isoformat()
+            clients_table.extend(
+                {'clientId': public_key, 'userData': {'clientName': slot_name, 'creationDate': creation_date}}
+                for slot_name, public_key in created
+            )
+            write_clients_table(clients_table, node)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error(f"Ошибка при пополнении резерва пиров узла {node.name}: {e}")
+            for slot_name, _ in created:
+                for path in slot_paths(slot_name):
+                    if os.path.exists(path):
+                        os.remove(path)
+            return 0
+    # The vpn:// keys are only a shortcut for delivery: a slot claimed before
+    # its key is encoded falls back to encoding at send time.
+    for slot_name, _ in created:
+        conf_path, key_path = slot_paths(slot_name)
+        try:
+            with open(key_path, 'w') as f:
+                f.write(encode_vpn_key(conf_path))
+        except (subprocess.CalledProcessError, ValueError, OSError) as e:
+            logger.error(f"Не удалось подготовить vpn:// ключ для {slot_name}: {e}")
+    logger.info(f"Резерв узла {node.name} пополнен на {len(created)} пиров в {interface.name}.")
+    return len(created)
+
+def claim_slot(client_name, node=None):
+    node = node or nodes.get_default_node()
+    if not reserve_client_name(client_name):
+        return False
+    try:
+        if find_client_node(client_name) is not None:
+            return False
+        return claim_free_slot(client_name, node)
+    finally:
+        release_client_name(client_name)
+
+def claim_free_slot(client_name, node):
+    with peer_scripts_lock(node):
+        clients = get_client_list(node)
+        slots = available_slots(clients)
+        if not slots:
+            return False
+        slot = slots[0]
+        interface = nodes.get_interface(node, slot.interface) or nodes.get_interfaces(node)[0]
+        try:
+            config = wgconf.parse(read_wg_config(node, interface))
+            peer = config.find_peer(slot.public_key)
+            if peer is None:
+                return False
+            add_live_section(node, interface, peer)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error(f"Ошибка при активации резервного пира {slot.name} на узле {node.name}: {e}")
+            return False
+        try:
+            patch = wgconf.ConfigPatch(config)
+            patch.resume(peer, client_name)
+            write_wg_config(patch.apply(), node, interface)
+            clients_table = get_full_clients_table(node)
+            for entry in clients_table:
+                if entry.get('clientId') == slot.public_key:
+                    entry.setdefault('userData', {})['clientName'] = client_name
+            write_clients_table(clients_table, node)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error(f"Ошибка при записи резервного пира {slot.name} как {client_name}: {e}")
+            try:
+                remove_live_peers(node, interface, [peer.public_key])
+            except subprocess.CalledProcessError:
+                pass
+            return False
+        user_dir = os.path.join('users', client_name)
+        os.makedirs(user_dir, exist_ok=True)
+        conf_path, key_path = slot_paths(slot.name)
+        os.replace(conf_path, os.path.join(user_dir, f"{client_name}.conf"))
+        if os.path.exists(key_path):
+            os.replace(key_path, os.path.join(user_dir, f"{client_name}.vpn"))
+        with open(os.path.join(user_dir, 'traffic.json'), 'w') as f:
+            json.dump({'total_incoming': 0, 'total_outgoing': 0, 'last_incoming': 0, 'last_outgoing': 0}, f)
+        nodes.assign_client(client_name, node)
+    logger.info(f"Клиент {client_name} получил резервный пир {slot.name} на узле {node.name}.")
+    return True
+
+def archive_record_path(client_name):
+    return os.path.join(ARCHIVE_DIR, f"{client_name}.json")
+
+def remove_archive_records(records):
+    for record in records:
+        if os.path.exists(archive_record_path(record['name'])):
+            os.remove(archive_record_path(record['name']))
+
+def archive_user_dir(client_name, archived_at):
+    user_dir = os.path.join('users', client_name)
+    if not os.path.isdir(user_dir):
+        return
+    archived_dir = os.path.join(ARCHIVE_DIR, client_name)
+    # A directory left by an earlier archive of the same name (restored while
+    # users/<name> already existed) is moved aside, not merged or dropped.
+    if os.path.exists(archived_dir):
+        os.replace(archived_dir, f"{archived_dir}.{archived_at[:19].replace(':', '')}")
+    os.replace(user_dir, archived_dir)
+
+def archive_peers(client_names, node=None):
+    node = node or nodes.get_default_node()
+    archived = []
+    with peer_scripts_lock(node):
+        clients = get_client_list(node)
+        by_interface = {}
+        for client_name in client_names:
+            client_entry = clients.get(client_name)
+            if client_entry is None:
+                logger.error(f"Пользователь {client_name} не найден в списке клиентов узла {node.name}.")
+                continue
+            by_interface.setdefault(client_entry.interface, []).append(client_entry)
+        if not by_interface:
+            return archived
+        expirations = load_expirations()
+        try:
+            clients_table = get_full_clients_table(node)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error(f"Ошибка при чтении clientsTable узла {node.name}: {e}")
+            return archived
+        table_entries = {entry.get('clientId'): entry for entry in clients_table}
+        os.makedirs(ARCHIVE_DIR, exist_ok=True)
+        archived_at = datetime.now(UTC).isoformat()
+        for interface_name, entries in by_interface.items():
+            interface = nodes.get_interface(node, interface_name) or nodes.get_interfaces(node)[0]
+            records = []
+            try:
+                config = wgconf.parse(read_wg_config(node, interface))
+                patch = wgconf.ConfigPatch(config)
+                for client_entry in entries:
+                    peer = config.find_peer(client_entry.public_key)
+                    if peer is None:
+                        continue
+                    patch.remove(peer)
+                    expiration = expirations.get(client_entry.name, {})
+                    records.append({
+                        'name': client_entry.name,
+                        'node': node.name,
+                        'interface': interface.name,
+                        'public_key': peer.public_key,
+                        'preshared_key': peer.fields.get('PresharedKey', ''),
+                        'allowed_ips': peer.allowed_ips,
+                        'suspended': peer.suspended,
+                        'archived_at': archived_at,
+                        'expiration_time': expiration['expiration_time'].isoformat() if expiration.get('expiration_time') else None,
+                        'traffic_limit': expiration.get('traffic_limit', "Неограниченно"),
+                        'clients_table_entry': table_entries.get(peer.public_key)
+                    })
+                if not records:
+                    continue
+                # Records go first: a peer is never gone from the config
+                # without something to restore it from.
+                for record in records:
+                    with open(archive_record_path(record['name']), 'w') as f:
+                        json.dump(record, f)
+                write_wg_config(patch.apply(), node, interface)
+            except (subprocess.CalledProcessError, OSError) as e:
+                logger.error(f"Ошибка при архивации пиров {interface.name} узла {node.name}: {e}")
+                remove_archive_records(records)
+                continue
+            # As in set_peer_suspended, a failed live change is undone by
+            # restoring the old text.
+            try:
+                remove_live_peers(node, interface, [record['public_key'] for record in records if not record['suspended']])
+            except subprocess.CalledProcessError as e:
+                logger.error(f"Ошибка при удалении пиров с интерфейса {interface.name} узла {node.name}: {e}")
+                try:
+                    write_wg_config(config.text, node, interface)
+                except (subprocess.CalledProcessError, OSError) as e:
+                    # The records stay: they are all that is left to restore the peers from.
+                    logger.error(f"Не удалось вернуть конфигурацию {interface.name} узла {node.name}: {e}")
+                    continue
+                remove_archive_records(records)
+                continue
+            archived.extend(record['name'] for record in records)
+        if not archived:
+            return archived
+        archived_keys = {clients.get(name).public_key for name in archived}
+        try:
+            write_clients_table([entry for entry in clients_table if entry.get('clientId') not in archived_keys], node)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error(f"Ошибка при обновлении clientsTable после архивации на узле {node.name}: {e}")
+        for client_name in archived:
+            try:
+                archive_user_dir(client_name, archived_at)
+            except OSError as e:
+                logger.error(f"Ошибка при переносе каталога пользователя {client_name} в архив: {e}")
+            expirations.pop(client_name, None)
+            nodes.unassign_client(client_name)
+        save_expirations(expirations)
+    logger.info(f"В архив перенесено {len(archived)} пиров узла {node.name}.")
+    return archived
+
+def is_archived(client_name):
+    return os.path.exists(archive_record_path(client_name))
+
+def list_archived():
+    if not os.path.isdir(ARCHIVE_DIR):
+        return []
+    records = []
+    for filename in sorted(os.listdir(ARCHIVE_DIR)):
+        if not filename.endswith('.json'):
+            continue
+        try:
+            with open(os.path.join(ARCHIVE_DIR, filename), 'r') as f:
+                records.append(json.load(f))
+        except (OSError, json.JSONDecodeError) as e:
+            logger.error(f"Ошибка при чтении архивной записи {filename}: {e}")
+    return records
+
+def restore_peer(client_name):
+    try:
+        with open(archive_record_path(client_name), 'r') as f:
+            record = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Архивная запись пользователя {client_name} недоступна: {e}")
+        return None
+    node = nodes.get_node(record['node']) or nodes.get_default_node()
+    with peer_scripts_lock(node):
+        clients = get_client_list(node)
+        if client_name in clients:
+            logger.error(f"Пользователь {client_name} уже есть на узле {node.name}.")
+            return None
+        interface = nodes.get_interface(node, record['interface']) or pick_interface(node, clients)
+        if interface is None:
+            return None
+        try:
+            config = wgconf.parse(read_wg_config(node, interface))
+            used = config.used_addresses()
+            allowed_ips = record['allowed_ips']
+            addresses = [address.strip() for address in allowed_ips.split(',') if address.strip()]
+            # The address went back to the allocator; a new one means the
+            # client has to import the updated config.
+            address_changed = any(address in used for address in addresses) or not all(
+                address.startswith(f"{interface.subnet_prefix}.") for address in addresses
+            )
+            if address_changed:
+                allowed_ips = config.next_address(interface.subnet_prefix, used)
+                if allowed_ips is None:
+                    logger.error(f"Нет свободных адресов в {interface.name} узла {node.name} для {client_name}.")
+                    return None
+            patch = wgconf.ConfigPatch(config)
+            patch.add(client_name, record['public_key'], record['preshared_key'], allowed_ips, suspended=record.get('suspended', False))
+            write_wg_config(patch.apply(), node, interface)
+            if not record.get('suspended'):
+                add_live_peer(node, interface, record['public_key'], record['preshared_key'], allowed_ips)
+            clients_table = get_full_clients_table(node)
+            clients_table.append(record.get('clients_table_entry') or {
+                'clientId': record['public_key'],
+                'userData': {'clientName': client_name, 'creationDate': datetime.now().isoformat()}
+            })
+            write_clients_table(clients_table, node)
+        except (subprocess.CalledProcessError, OSError) as e:
+            logger.error(f"Ошибка при восстановлении {client_name} на узле {node.name}: {e}")
+            return None
+        user_dir = os.path.join('users', client_name)
+        archived_dir = os.path.join(ARCHIVE_DIR, client_name)
+        if os.path.isdir(archived_dir) and not os.path.exists(user_dir):
+            os.replace(archived_dir, user_dir)
+        conf_path = os.path.join(user_dir, f"{client_name}.conf")
+        if address_changed and os.path.exists(conf_path):
+            with open(conf_path, 'r') as f:
+                content = f.read()
+            with open(conf_path, 'w') as f:
+                f.write(re.sub(r'^Address = .*$', f"Address = {allowed_ips}", content, count=1, flags=re.MULTILINE))
+            vpn_path = os.path.join(user_dir, f"{client_name}.vpn")
+            if os.path.exists(vpn_path):
+                os.remove(vpn_path)
+        if record.get('expiration_time') or record.get('traffic_limit', "Неограниченно") != "Неограниченно":
+            expiration_time = datetime.fromisoformat(record['expiration_time']) if record.get('expiration_time') else None
+            set_user_expiration(client_name, expiration_time, record.get('traffic_limit', "Неограниченно"))
+        nodes.assign_client(client_name, node)
+        os.remove(archive_record_path(client_name))
+    record['node'] = node.name
+    record['allowed_ips'] = allowed_ips
+    record['address_changed'] = address_changed
+    logger.info(f"Пользователь {client_name} восстановлен из архива на {interface.name} узла {node.name}.")
+    return record
 
 def load_expirations():
     if not os.path.exists(EXPIRATIONS_FILE):
@@ -350,10 +1152,14 @@ def save_expirations(expirations):
             'expiration_time': info['expiration_time'].isoformat() if info['expiration_time'] else None,
             'traffic_limit': info.get('traffic_limit', "Неограниченно")
         }
+        if info.get('payments'):
+            data[user]['payments'] = info['payments']
     with open(EXPIRATIONS_FILE, 'w') as f:
         json.dump(data, f)
 
-def set_user_expiration(username: str, expiration: datetime, traffic_limit: str):
+APPLIED_PAYMENTS_KEPT = 20
+
+def set_user_expiration(username: str, expiration: datetime, traffic_limit: str, payment_id: str = None):
     expirations = load_expirations()
     if username not in expirations:
         expirations[username] = {}
@@ -364,8 +1170,17 @@ def set_user_expiration(username: str, expiration: datetime, traffic_limit: str)
     else:
         expirations[username]['expiration_time'] = None
     expirations[username]['traffic_limit'] = traffic_limit
+    # The payment that produced this expiry is stored in the same write, so a
+    # retry after a crash before the ledger update does not extend it again.
+    if payment_id:
+        applied = expirations[username].get('payments', [])
+        expirations[username]['payments'] = (applied + [payment_id])[-APPLIED_PAYMENTS_KEPT:]
     save_expirations(expirations)
 
+def is_payment_applied(username: str, payment_id: str):
+    expirations = load_expirations()
+    return payment_id in expirations.get(username, {}).get('payments', [])
+
 def remove_user_expiration(username: str):
     expirations = load_expirations()
     if username in expirations:
@@ -384,48 +1199,276 @@ def get_user_traffic_limit(username: str):
     expirations = load_expirations()
     return expirations.get(username, {}).get('traffic_limit', "Неограниченно")
 
-def load_payments():
-    if os.path.exists(PAYMENTS_FILE):
-        try:
-            with open(PAYMENTS_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return {}
-    return {}
+PAYMENTS_SCHEMA = """
+CREATE TABLE IF NOT EXISTS payment_events (
+    payment_id TEXT PRIMARY KEY,
+    event TEXT NOT NULL,
+    payload TEXT NOT NULL,
+    status TEXT NOT NULL DEFAULT 'queued',
+    attempts INTEGER NOT NULL DEFAULT 0,
+    next_attempt REAL NOT NULL,
+    last_error TEXT,
+    created_at REAL NOT NULL,
+    updated_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS payment_events_due ON payment_events (status, next_attempt);
+CREATE TABLE IF NOT EXISTS payments (
+    id INTEGER PRIMARY KEY AUTOINCREMENT,
+    payment_id TEXT NOT NULL UNIQUE,
+    user_id INTEGER NOT NULL,
+    amount REAL NOT NULL,
+    status TEXT NOT NULL,
+    created_at REAL NOT NULL,
+    completed_at REAL
+);
+CREATE INDEX IF NOT EXISTS payments_user_created ON payments (user_id, created_at);
+CREATE INDEX IF NOT EXISTS payments_created ON payments (created_at);
+CREATE TABLE IF NOT EXISTS revenue_daily (
+    day TEXT PRIMARY KEY,
+    amount REAL NOT NULL DEFAULT 0,
+    payments INTEGER NOT NULL DEFAULT 0
+);
+CREATE TABLE IF NOT EXISTS revenue_monthly (
+    month TEXT PRIMARY KEY,
+    amount REAL NOT NULL DEFAULT 0,
+    payments INTEGER NOT NULL DEFAULT 0
+);
+"""
+
+payments_db_lock = threading.Lock()
+payments_db_ready = set()
+
+def payments_db(path=None):
+    path = path or PAYMENTS_DB_FILE
+    if path not in payments_db_ready:
+        os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    conn = sqlite3.connect(path, timeout=30, isolation_level=None)
+    conn.row_factory = sqlite3.Row
+    if path not in payments_db_ready:
+        with payments_db_lock:
+            if path not in payments_db_ready:
+                conn.execute('PRAGMA journal_mode=WAL')
+                conn.executescript(PAYMENTS_SCHEMA)
+                if path == PAYMENTS_DB_FILE:
+                    migrate_payments_file(conn)
+                payments_db_ready.add(path)
+    return conn
+
+def migrate_payments_file(conn):
+    if not os.path.exists(PAYMENTS_FILE):
+        return
+    try:
+        with open(PAYMENTS_FILE, 'r') as f:
+            payments = json.load(f)
+    except (OSError, json.JSONDecodeError) as e:
+        logger.error(f"Ошибка при загрузке {PAYMENTS_FILE}: {e}")
+        return
+    conn.execute('BEGIN IMMEDIATE')
+    for user_payments in payments.values():
+        for payment in user_payments:
+            created_at = datetime.fromisoformat(payment['timestamp']).timestamp()
+            completed_at = created_at if payment['status'] == 'completed' else None
+            inserted = conn.execute(
+                "INSERT OR IGNORE INTO payments (payment_id, user_id, amount, status, created_at, completed_at) VALUES (?, ?, ?, ?, ?, ?)",
+                (payment['payment_id'], int(payment['user_id']), float(payment['amount']), payment['status'], created_at, completed_at)
+            ).rowcount
+            if inserted and completed_at is not None:
+                record_revenue(conn, float(payment['amount']), completed_at)
+    conn.execute('COMMIT')
+    os.replace(PAYMENTS_FILE, f"{PAYMENTS_FILE}.migrated")
+    logger.info(f"Платежи из {PAYMENTS_FILE} перенесены в {PAYMENTS_DB_FILE}.")
 
-def save_payments(payments):
-    os.makedirs(os.path.dirname(PAYMENTS_FILE), exist_ok=True)
-    with open(PAYMENTS_FILE, 'w') as f:
-        json.dump(payments, f, indent=4)
+def record_revenue(conn, amount: float, completed_at: float):
+    completed = datetime.fromtimestamp(completed_at, UTC)
+    for table, column, key in (('revenue_daily', 'day', completed.strftime('%Y-%m-%d')), ('revenue_monthly', 'month', completed.strftime('%Y-%m'))):
+        conn.execute(
+            f"INSERT INTO {table} ({column}, amount, payments) VALUES (?, ?, 1) "
+            f"ON CONFLICT({column}) DO UPDATE SET amount = amount + excluded.amount, payments = payments + 1",
+            (key, amount)
+        )
 
 def add_payment(user_id: int, payment_id: str, amount: float, status: str = 'pending'):
-    payments = load_payments()
-    payment_data = {
+    now = datetime.now(UTC)
+    conn = payments_db()
+    try:
+        conn.execute(
+            "INSERT INTO payments (payment_id, user_id, amount, status, created_at) VALUES (?, ?, ?, ?, ?)",
+            (payment_id, user_id, amount, status, now.timestamp())
+        )
+    finally:
+        conn.close()
+    return {
         'user_id': user_id,
         'payment_id': payment_id,
         'amount': amount,
         'status': status,
-        'timestamp': datetime.now(UTC).isoformat()
+        'timestamp': now.isoformat()
     }
-    if str(user_id) not in payments:
-        payments[str(user_id)] = []
-    payments[str(user_id)].append(payment_data)
-    save_payments(payments)
-    return payment_data
 
 def update_payment_status(payment_id: str, status: str):
-    payments = load_payments()
-    for user_payments in payments.values():
-        for payment in user_payments:
-            if payment['payment_id'] == payment_id:
-                payment['status'] = status
-                save_payments(payments)
-                return True
-    return False
+    now = datetime.now(UTC).timestamp()
+    conn = payments_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute("SELECT amount, status FROM payments WHERE payment_id = ?", (payment_id,)).fetchone()
+        if row is None:
+            conn.execute('ROLLBACK')
+            return False
+        if status == 'completed' and row['status'] != 'completed':
+            conn.execute("UPDATE payments SET status = ?, completed_at = ? WHERE payment_id = ?", (status, now, payment_id))
+            record_revenue(conn, row['amount'], now)
+        else:
+            conn.execute("UPDATE payments SET status = ? WHERE payment_id = ?", (status, payment_id))
+        conn.execute('COMMIT')
+        return True
+    except sqlite3.Error:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def payment_row(row):
+    payment = dict(row)
+    payment['timestamp'] = datetime.fromtimestamp(row['created_at'], UTC).isoformat()
+    return payment
+
+def get_payments_page(cursor=None, limit: int = 10, user_id: int = None):
+    clauses = []
+    params = []
+    if user_id is not None:
+        clauses.append("user_id = ?")
+        params.append(user_id)
+    if cursor:
+        created_at, row_id = cursor.split(':')
+        clauses.append("(created_at, id) < (?, ?)")
+        params.extend([float(created_at), int(row_id)])
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ''
+    conn = payments_db()
+    try:
+        rows = conn.execute(
+            f"SELECT * FROM payments {where} ORDER BY created_at DESC, id DESC LIMIT ?",
+            params + [limit + 1]
+        ).fetchall()
+    finally:
+        conn.close()
+    next_cursor = None
+    if len(rows) > limit:
+        last = rows[limit - 1]
+        next_cursor = f"{last['created_at']!r}:{last['id']}"
+        rows = rows[:limit]
+    return [payment_row(row) for row in rows], next_cursor
+
+def get_user_payments(user_id: int, limit: int = 50):
+    payments, _ = get_payments_page(limit=limit, user_id=user_id)
+    return payments
+
+def get_revenue(period: str = 'daily', limit: int = 7):
+    table, column = ('revenue_monthly', 'month') if period == 'monthly' else ('revenue_daily', 'day')
+    conn = payments_db()
+    try:
+        rows = conn.execute(
+            f"SELECT {column} AS period, amount, payments FROM {table} ORDER BY {column} DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def enqueue_payment_event(payment_id: str, event: str, payload: dict):
+    now = datetime.now(UTC).timestamp()
+    conn = payments_db()
+    try:
+        cursor = conn.execute(
+            "INSERT OR IGNORE INTO payment_events (payment_id, event, payload, next_attempt, created_at, updated_at) VALUES (?, ?, ?, ?, ?, ?)",
+            (payment_id, event, json.dumps(payload), now, now, now)
+        )
+        return cursor.rowcount == 1
+    finally:
+        conn.close()
+
+def claim_payment_event(now: float):
+    conn = payments_db()
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute(
+            "SELECT * FROM payment_events WHERE status = 'queued' AND next_attempt <= ? ORDER BY next_attempt LIMIT 1",
+            (now,)
+        ).fetchone()
+        if row is not None:
+            conn.execute(
+                "UPDATE payment_events SET status = 'processing', updated_at = ? WHERE payment_id = ?",
+                (now, row['payment_id'])
+            )
+        conn.execute('COMMIT')
+        return dict(row) if row is not None else None
+    except sqlite3.Error:
+        conn.execute('ROLLBACK')
+        raise
+    finally:
+        conn.close()
+
+def next_payment_event_time():
+    conn = payments_db()
+    try:
+        row = conn.execute("SELECT MIN(next_attempt) FROM payment_events WHERE status = 'queued'").fetchone()
+        return row[0]
+    finally:
+        conn.close()
 
-def get_user_payments(user_id: int):
-    payments = load_payments()
-    return payments.get(str(user_id), [])
+def complete_payment_event(payment_id: str):
+    conn = payments_db()
+    try:
+        conn.execute(
+            "UPDATE payment_events SET status = 'done', last_error = NULL, updated_at = ? WHERE payment_id = ?",
+            (datetime.now(UTC).timestamp(), payment_id)
+        )
+    finally:
+        conn.close()
+
+def fail_payment_event(payment_id: str, error: str, next_attempt: float, dead: bool):
+    conn = payments_db()
+    try:
+        conn.execute(
+            "UPDATE payment_events SET status = ?, attempts = attempts + 1, last_error = ?, next_attempt = ?, updated_at = ? WHERE payment_id = ?",
+            ('dead' if dead else 'queued', error, next_attempt, datetime.now(UTC).timestamp(), payment_id)
+        )
+    finally:
+        conn.close()
+
+def reset_processing_payment_events():
+    conn = payments_db()
+    try:
+        return conn.execute("UPDATE payment_events SET status = 'queued' WHERE status = 'processing'").rowcount
+    finally:
+        conn.close()
 
-def get_all_payments():
-    return load_payments()
+def get_dead_payment_events(limit: int = 20):
+    conn = payments_db()
+    try:
+        rows = conn.execute(
+            "SELECT * FROM payment_events WHERE status = 'dead' ORDER BY updated_at DESC LIMIT ?",
+            (limit,)
+        ).fetchall()
+        return [dict(row) for row in rows]
+    finally:
+        conn.close()
+
+def requeue_payment_event(payment_id: str):
+    now = datetime.now(UTC).timestamp()
+    conn = payments_db()
+    try:
+        cursor = conn.execute(
+            "UPDATE payment_events SET status = 'queued', attempts = 0, next_attempt = ?, updated_at = ? WHERE payment_id = ? AND status = 'dead'",
+            (now, now, payment_id)
+        )
+        return cursor.rowcount == 1
+    finally:
+        conn.close()
+
+def get_payment_status(payment_id: str):
+    conn = payments_db()
+    try:
+        row = conn.execute("SELECT status FROM payments WHERE payment_id = ?", (payment_id,)).fetchone()
+        return row['status'] if row else None
+    finally:
+        conn.close()
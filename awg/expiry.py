@@ -0,0 +1,149 @@
+import heapq
+import asyncio
+import logging
+import itertools
+import pytz
+from datetime import datetime
+
+logger = logging.getLogger(__name__)
+
+MAX_TIMER_DELAY = 3600
+REMOVED = None
+
+class ExpiryEngine:
+    def __init__(self, on_expire, batch_size=500):
+        self.on_expire = on_expire
+        self.batch_size = batch_size
+        self._heap = []
+        self._entries = {}
+        self._counter = itertools.count()
+        self._stale = 0
+        self._loop = None
+        self._timer = None
+        self._timer_deadline = None
+        self._tasks = set()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key):
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        return datetime.fromtimestamp(entry[0], tz=pytz.UTC)
+
+    def load(self, items):
+        self._heap = []
+        self._entries = {}
+        self._stale = 0
+        for key, expires_at in items:
+            entry = [expires_at.timestamp(), next(self._counter), key]
+            self._entries[key] = entry
+            self._heap.append(entry)
+        heapq.heapify(self._heap)
+        self._arm()
+
+    def schedule(self, key, expires_at: datetime):
+        self._discard(key)
+        entry = [expires_at.timestamp(), next(self._counter), key]
+        self._entries[key] = entry
+        heapq.heappush(self._heap, entry)
+        if self._heap[0] is entry:
+            self._arm()
+
+    def extend(self, key, delta):
+        current = self.get(key)
+        if current is None:
+            return False
+        self.schedule(key, current + delta)
+        return True
+
+    def cancel(self, key):
+        if not self._discard(key):
+            return False
+        if self._stale > 1024 and self._stale > len(self._heap) // 2:
+            self._heap = [entry for entry in self._heap if entry[2] is not REMOVED]
+            heapq.heapify(self._heap)
+            self._stale = 0
+        return True
+
+    def _discard(self, key):
+        entry = self._entries.pop(key, None)
+        if entry is None:
+            return False
+        entry[2] = REMOVED
+        self._stale += 1
+        return True
+
+    def _peek(self):
+        while self._heap and self._heap[0][2] is REMOVED:
+            heapq.heappop(self._heap)
+            self._stale -= 1
+        return self._heap[0] if self._heap else None
+
+    def pop_due(self, now: float):
+        due = []
+        while True:
+            entry = self._peek()
+            if entry is None or entry[0] > now:
+                break
+            heapq.heappop(self._heap)
+            del self._entries[entry[2]]
+            due.append(entry[2])
+        return due
+
+    def start(self, loop=None):
+        self._loop = loop or asyncio.get_event_loop()
+        self._arm()
+
+    def stop(self):
+        if self._timer:
+            self._timer.cancel()
+        self._timer = None
+        self._timer_deadline = None
+        self._loop = None
+
+    def _arm(self):
+        if self._loop is None:
+            return
+        entry = self._peek()
+        if entry is None:
+            if self._timer:
+                self._timer.cancel()
+            self._timer = None
+            self._timer_deadline = None
+            return
+        deadline = entry[0]
+        if self._timer and self._timer_deadline is not None and self._timer_deadline <= deadline:
+            return
+        if self._timer:
+            self._timer.cancel()
+        delay = max(deadline - datetime.now(pytz.UTC).timestamp(), 0)
+        if delay > MAX_TIMER_DELAY:
+            delay = MAX_TIMER_DELAY
+            self._timer_deadline = None
+        else:
+            self._timer_deadline = deadline
+        self._timer = self._loop.call_later(delay, self._fire)
+
+    def _fire(self):
+        self._timer = None
+        self._timer_deadline = None
+        due = self.pop_due(datetime.now(pytz.UTC).timestamp())
+        if due:
+            task = self._loop.create_task(self._dispatch(due))
+            self._tasks.add(task)
+            task.add_done_callback(self._tasks.discard)
+        self._arm()
+
+    async def _dispatch(self, keys):
+        for i in range(0, len(keys), self.batch_size):
+            batch = keys[i:i + self.batch_size]
+            try:
+                await self.on_expire(batch)
+            except Exception as e:
+                logger.error(f"Ошибка при обработке истёкших подписок ({len(batch)} шт.): {e}")
+            await asyncio.sleep(0)
@@ -0,0 +1,114 @@
+import uuid
+import asyncio
+import argparse
+import logging
+import aiohttp
+from aiohttp import web
+from datetime import datetime
+import pytz
+
+logger = logging.getLogger(__name__)
+
+def create_app(webhook_url=None, auto_succeed=None, latency=0.0, fail_rate=0):
+    app = web.Application()
+    app['payments'] = {}
+    app['idempotence'] = {}
+    app['requests'] = 0
+    app['webhook_url'] = webhook_url
+    app['auto_succeed'] = auto_succeed
+    app['latency'] = latency
+    app['fail_rate'] = fail_rate
+
+    async def maybe_fail(request):
+        request.app['requests'] += 1
+        if request.app['latency']:
+            await asyncio.sleep(request.app['latency'])
+        if request.app['fail_rate'] and request.app['requests'] % request.app['fail_rate'] == 0:
+            raise web.HTTPServiceUnavailable()
+
+    async def notify(payment):
+        if not app['webhook_url']:
+            return
+        notification = {'type': 'notification', 'event': f"payment.{payment['status']}", 'object': payment}
+        try:
+            async with aiohttp.ClientSession() as session:
+                async with session.post(app['webhook_url'], json=notification) as resp:
+                    logger.info(f"Уведомление о {payment['id']} отправлено: HTTP {resp.status}")
+        except aiohttp.ClientError as e:
+            logger.error(f"Не удалось отправить уведомление о {payment['id']}: {e}")
+
+    async def succeed_later(payment_id, delay):
+        await asyncio.sleep(delay)
+        await set_status(payment_id, 'succeeded')
+
+    async def set_status(payment_id, status):
+        payment = app['payments'][payment_id]
+        payment['status'] = status
+        payment['paid'] = status == 'succeeded'
+        await notify(payment)
+        return payment
+
+    async def create_payment(request):
+        await maybe_fail(request)
+        key = request.headers.get('Idempotence-Key')
+        if key and key in app['idempotence']:
+            return web.json_response(app['payments'][app['idempotence'][key]])
+        data = await request.json()
+        payment_id = str(uuid.uuid4())
+        payment = {
+            'id': payment_id,
+            'status': 'pending',
+            'paid': False,
+            'amount': data.get('amount'),
+            'description': data.get('description', ''),
+            'metadata': data.get('metadata', {}),
+            'created_at': datetime.now(pytz.UTC).isoformat(),
+            'confirmation': {
+                'type': 'redirect',
+                'confirmation_url': f"{request.scheme}://{request.host}/checkout/{payment_id}"
+            },
+            'test': True
+        }
+        app['payments'][payment_id] = payment
+        if key:
+            app['idempotence'][key] = payment_id
+        if app['auto_succeed'] is not None:
+            asyncio.create_task(succeed_later(payment_id, app['auto_succeed']))
+        return web.json_response(payment)
+
+    async def get_payment(request):
+        await maybe_fail(request)
+        payment = app['payments'].get(request.match_info['payment_id'])
+        if payment is None:
+            return web.json_response({'type': 'error', 'code': 'not_found'}, status=404)
+        return web.json_response(payment)
+
+    async def change_status(request):
+        payment_id = request.match_info['payment_id']
+        if payment_id not in app['payments']:
+            return web.json_response({'type': 'error', 'code': 'not_found'}, status=404)
+        status = 'succeeded' if request.match_info['action'] == 'succeed' else 'canceled'
+        return web.json_response(await set_status(payment_id, status))
+
+    app.router.add_post('/v3/payments', create_payment)
+    app.router.add_get('/v3/payments/{payment_id}', get_payment)
+    app.router.add_post('/checkout/{payment_id}/{action:succeed|cancel}', change_status)
+    app.router.add_get('/checkout/{payment_id}', get_payment)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the YooKassa payments API.')
+    parser.add_argument('--host', default='localhost', help='Address to listen on.')
+    parser.add_argument('-p', '--port', type=int, default=8090, help='Port to listen on.')
+    parser.add_argument('-w', '--webhook-url', help='Bot notification URL, e.g. http://localhost:8080/yookassa-webhook.')
+    parser.add_argument('-a', '--auto-succeed', type=float, help='Mark every payment as succeeded after this many seconds.')
+    parser.add_argument('-l', '--latency', type=float, default=0.0, help='Artificial latency of every API call in seconds.')
+    parser.add_argument('-f', '--fail-rate', type=int, default=0, help='Answer every N-th API call with HTTP 503.')
+
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    web.run_app(create_app(args.webhook_url, args.auto_succeed, args.latency, args.fail_rate), host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
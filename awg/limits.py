@@ -0,0 +1,70 @@
+MIN_CHECK_INTERVAL = 5
+MAX_CHECK_INTERVAL = 3600
+SAFETY_FACTOR = 0.5
+RATE_SMOOTHING = 0.3
+
+class PeerUsage:
+    __slots__ = ('total', 'sampled_at', 'rate')
+
+    def __init__(self, total, sampled_at):
+        self.total = total
+        self.sampled_at = sampled_at
+        self.rate = 0.0
+
+# A peer is checked again after safety_factor of the time it needs to reach its
+# limit at the estimated rate, and never later than it would take at peak_rate,
+# so a peer that is idle now cannot blow through a nearly exhausted limit
+# between two checks.
+class LimitPlanner:
+    def __init__(self, peak_rate=0, min_interval=MIN_CHECK_INTERVAL, max_interval=MAX_CHECK_INTERVAL,
+                 safety_factor=SAFETY_FACTOR, smoothing=RATE_SMOOTHING):
+        self.peak_rate = peak_rate
+        self.min_interval = min_interval
+        self.max_interval = max_interval
+        self.safety_factor = safety_factor
+        self.smoothing = smoothing
+        self._usage = {}
+
+    def __len__(self):
+        return len(self._usage)
+
+    def __contains__(self, key):
+        return key in self._usage
+
+    def rate(self, key):
+        usage = self._usage.get(key)
+        return usage.rate if usage else 0.0
+
+    def observe(self, key, total, now):
+        usage = self._usage.get(key)
+        if usage is None:
+            self._usage[key] = PeerUsage(total, now)
+            return 0.0
+        elapsed = now - usage.sampled_at
+        if elapsed <= 0:
+            return usage.rate
+        instant = max(total - usage.total, 0) / elapsed
+        smoothed = self.smoothing * instant + (1 - self.smoothing) * usage.rate
+        # A burst must shorten the next interval right away, while a quiet
+        # sample only lowers the estimate gradually.
+        usage.rate = max(instant, smoothed)
+        usage.total = total
+        usage.sampled_at = now
+        return usage.rate
+
+    def next_check(self, key, limit, now):
+        usage = self._usage.get(key)
+        total = usage.total if usage else 0
+        remaining = limit - total
+        if remaining <= 0:
+            return 0.0
+        delay = self.max_interval
+        rate = usage.rate if usage else 0.0
+        if rate > 0:
+            delay = min(delay, remaining / rate * self.safety_factor)
+        if self.peak_rate > 0:
+            delay = min(delay, remaining / self.peak_rate)
+        return max(delay, self.min_interval)
+
+    def forget(self, key):
+        self._usage.pop(key, None)
@@ -0,0 +1,206 @@
+import math
+import time
+import threading
+from contextlib import contextmanager
+
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+def escape_label(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+def format_labels(names, values, extra=()):
+    pairs = list(zip(names, values)) + list(extra)
+    if not pairs:
+        return ''
+    return '{' + ','.join(f'{name}="{escape_label(value)}"' for name, value in pairs) + '}'
+
+def format_value(value):
+    if value == math.inf:
+        return '+Inf'
+    if isinstance(value, float) and value.is_integer():
+        return str(int(value))
+    return repr(value) if isinstance(value, float) else str(value)
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self._values = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels):
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name}: ожидались метки {self.labelnames}, получены {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def remove(self, **labels):
+        with self._lock:
+            self._values.pop(self._key(labels), None)
+
+    def clear(self):
+        with self._lock:
+            self._values.clear()
+
+    def samples(self):
+        with self._lock:
+            return [(self.name, format_labels(self.labelnames, key), value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.documentation}", f"# TYPE {self.name} {self.kind}"]
+        for name, labels, value in self.samples():
+            lines.append(f"{name}{labels} {format_value(value)}")
+        return lines
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    def set(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def get(self, **labels):
+        return self._values.get(self._key(labels), 0)
+
+    def items(self):
+        with self._lock:
+            return list(self._values.items())
+
+class Gauge(Counter):
+    kind = 'gauge'
+
+    def dec(self, amount=1, **labels):
+        self.inc(-amount, **labels)
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets)) + (math.inf,)
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            state = self._values.get(key)
+            if state is None:
+                state = self._values[key] = [[0] * len(self.buckets), 0.0, 0]
+            for i, bound in enumerate(self.buckets):
+                if value <= bound:
+                    state[0][i] += 1
+                    break
+            state[1] += value
+            state[2] += 1
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        with self._lock:
+            items = [(key, list(state[0]), state[1], state[2]) for key, state in self._values.items()]
+        for key, counts, total, count in items:
+            cumulative = 0
+            for bound, bucket_count in zip(self.buckets, counts):
+                cumulative += bucket_count
+                samples.append((f"{self.name}_bucket", format_labels(self.labelnames, key, [('le', format_value(float(bound)))]), cumulative))
+            samples.append((f"{self.name}_sum", format_labels(self.labelnames, key), total))
+            samples.append((f"{self.name}_count", format_labels(self.labelnames, key), count))
+        return samples
+
+class Registry:
+    def __init__(self):
+        self._metrics = {}
+        self._collectors = []
+
+    def register(self, metric):
+        if metric.name in self._metrics:
+            raise ValueError(f"Метрика {metric.name} уже зарегистрирована")
+        self._metrics[metric.name] = metric
+        return metric
+
+    def counter(self, name, documentation, labelnames=()):
+        return self.register(Counter(name, documentation, labelnames))
+
+    def gauge(self, name, documentation, labelnames=()):
+        return self.register(Gauge(name, documentation, labelnames))
+
+    def histogram(self, name, documentation, labelnames=(), buckets=DEFAULT_BUCKETS):
+        return self.register(Histogram(name, documentation, labelnames, buckets))
+
+    def add_collector(self, collector):
+        self._collectors.append(collector)
+
+    def render(self):
+        for collector in self._collectors:
+            collector()
+        lines = []
+        for metric in self._metrics.values():
+            lines.extend(metric.render())
+        return '\n'.join(lines) + '\n'
+
+REGISTRY = Registry()
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+handler_latency = REGISTRY.histogram('awg_bot_handler_seconds', 'Время обработки обновлений Telegram.', ('kind', 'handler'))
+docker_commands = REGISTRY.counter('awg_docker_commands_total', 'Число вызовов docker.', ('node', 'command', 'result'))
+docker_duration = REGISTRY.histogram('awg_docker_command_seconds', 'Длительность вызовов docker.', ('node', 'command'))
+traffic_tick = REGISTRY.histogram('awg_traffic_update_seconds', 'Длительность цикла update_all_clients_traffic.')
+peers = REGISTRY.gauge('awg_peers', 'Число пиров в конфигурации интерфейса.', ('node', 'interface'))
+active_peers = REGISTRY.gauge('awg_active_peers', 'Число пиров с рукопожатием по данным wg show.', ('node',))
+peer_bytes = REGISTRY.counter('awg_peer_bytes_total', 'Накопленный трафик пира.', ('client', 'direction'))
+limit_checks = REGISTRY.counter('awg_traffic_limit_checks_total', 'Число проверок лимита трафика отдельных пиров.')
+container_circuit = REGISTRY.gauge('awg_container_circuit_state', 'Состояние предохранителя вызовов контейнера: 0 — закрыт, 1 — пробный вызов, 2 — открыт.', ('node',))
+container_events = REGISTRY.counter('awg_container_events_total', 'События контейнеров Docker.', ('node', 'action'))
+slot_pool = REGISTRY.gauge('awg_slot_pool', 'Число готовых резервных пиров.', ('node',))
+scheduler_jobs = REGISTRY.gauge('awg_scheduler_jobs', 'Число заданий планировщика.', ('scheduler',))
+cache_requests = REGISTRY.counter('awg_cache_requests_total', 'Обращения к кэшам.', ('cache', 'result'))
+cache_hit_ratio = REGISTRY.gauge('awg_cache_hit_ratio', 'Доля попаданий в кэш.', ('cache',))
+
+def cache_hit(cache):
+    cache_requests.inc(cache=cache, result='hit')
+
+def cache_miss(cache):
+    cache_requests.inc(cache=cache, result='miss')
+
+def cache_stale(cache):
+    cache_requests.inc(cache=cache, result='stale')
+
+def update_cache_ratios():
+    totals = {}
+    for (cache, result), value in cache_requests.items():
+        hits, total = totals.get(cache, (0, 0))
+        totals[cache] = (hits + (value if result == 'hit' else 0), total + value)
+    for cache, (hits, total) in totals.items():
+        cache_hit_ratio.set(hits / total if total else 0, cache=cache)
+
+REGISTRY.add_collector(update_cache_ratios)
+
+def forget_client(client):
+    for direction in ('rx', 'tx'):
+        peer_bytes.remove(client=client, direction=direction)
+
+def command_label(cmd):
+    parts = cmd.split() if isinstance(cmd, str) else list(cmd)
+    if not parts:
+        return 'unknown'
+    if parts[0] != 'docker':
+        return parts[0].rsplit('/', 1)[-1]
+    args = [part for part in parts[1:] if not part.startswith('-')]
+    if args and args[0] == 'exec' and len(args) >= 3:
+        return f"exec {args[2].rsplit('/', 1)[-1]}"
+    return args[0] if args else 'docker'
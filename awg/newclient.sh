@@ -26,6 +26,11 @@ CLIENT_NAME="$1"
 ENDPOINT="$2"
 WG_CONFIG_FILE="$3"
 DOCKER_CONTAINER="$4"
+SUBNET_PREFIX="${5:-10.8.1}"
+
+wgconf() {
+    "${PYTHON:-python3}" "$(dirname "$0")/wgconf.py" "$@"
+}
 
 if [[ ! "$CLIENT_NAME" =~ ^[a-zA-Z0-9_-]+$ ]]; then
     echo "Error: Invalid CLIENT_NAME. Only letters, numbers, underscores, and hyphens are allowed."
@@ -42,34 +47,21 @@ psk=$(docker exec -i $DOCKER_CONTAINER wg genpsk)
 SERVER_CONF_PATH="$pwd/files/server.conf"
 docker exec -i $DOCKER_CONTAINER cat $WG_CONFIG_FILE > "$SERVER_CONF_PATH"
 
-SERVER_PRIVATE_KEY=$(awk '/^PrivateKey\s*=/ {print $3}' "$SERVER_CONF_PATH")
+SERVER_PRIVATE_KEY=$(wgconf get "$SERVER_CONF_PATH" PrivateKey)
 SERVER_PUBLIC_KEY=$(echo "$SERVER_PRIVATE_KEY" | docker exec -i $DOCKER_CONTAINER wg pubkey)
-LISTEN_PORT=$(awk '/ListenPort\s*=/ {print $3}' "$SERVER_CONF_PATH")
-ADDITIONAL_PARAMS=$(awk '/^Jc\s*=|^Jmin\s*=|^Jmax\s*=|^S1\s*=|^S2\s*=|^H[1-4]\s*=/' "$SERVER_CONF_PATH")
-
-octet=2
-while grep -E "AllowedIPs\s*=\s*10\.8\.1\.$octet/32" "$SERVER_CONF_PATH" > /dev/null; do
-    (( octet++ ))
-done
+LISTEN_PORT=$(wgconf get "$SERVER_CONF_PATH" ListenPort)
+ADDITIONAL_PARAMS=$(wgconf params "$SERVER_CONF_PATH")
 
-if [ "$octet" -gt 254 ]; then
-    echo "Error: WireGuard internal subnet 10.8.1.0/24 is full"
+if ! CLIENT_IP=$(wgconf next-ip "$SERVER_CONF_PATH" "$SUBNET_PREFIX"); then
+    echo "Error: WireGuard internal subnet $SUBNET_PREFIX.0/24 is full"
     exit 1
 fi
 
-CLIENT_IP="10.8.1.$octet/32"
 ALLOWED_IPS="$CLIENT_IP"
 
 CLIENT_PUBLIC_KEY=$(echo "$key" | docker exec -i $DOCKER_CONTAINER wg pubkey)
 
-cat << EOF >> "$SERVER_CONF_PATH"
-[Peer]
-# $CLIENT_NAME
-PublicKey = $CLIENT_PUBLIC_KEY
-PresharedKey = $psk
-AllowedIPs = $ALLOWED_IPS
-
-EOF
+wgconf add "$SERVER_CONF_PATH" "$CLIENT_NAME" "$CLIENT_PUBLIC_KEY" "$psk" "$ALLOWED_IPS"
 
 docker cp "$SERVER_CONF_PATH" $DOCKER_CONTAINER:$WG_CONFIG_FILE
 
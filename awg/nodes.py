@@ -0,0 +1,214 @@
+import os
+import json
+import asyncio
+import logging
+import threading
+import functools
+import contextvars
+import configparser
+
+logger = logging.getLogger(__name__)
+
+SETTINGS_FILE = 'files/setting.ini'
+NODE_ASSIGNMENTS_FILE = 'files/node_assignments.json'
+INTERFACES_FILE = 'files/interfaces.json'
+DEFAULT_NODE_NAME = 'main'
+DEFAULT_SUBNET = '10.8.1.0/24'
+DEFAULT_DOCKER_TIMEOUT = 10.0
+DEFAULT_SCRIPT_TIMEOUT = 120.0
+DEFAULT_CIRCUIT_THRESHOLD = 5
+DEFAULT_CIRCUIT_RESET = 30.0
+
+class Interface:
+    def __init__(self, name, config_file, subnet, listen_port=None, host_path=''):
+        self.name = name
+        self.config_file = config_file
+        self.subnet = subnet
+        self.listen_port = listen_port
+        self.host_path = host_path
+
+    @property
+    def subnet_prefix(self):
+        return '.'.join(self.subnet.split('/')[0].split('.')[:3])
+
+    def to_dict(self):
+        return {'name': self.name, 'config_file': self.config_file, 'subnet': self.subnet, 'listen_port': self.listen_port}
+
+    def __repr__(self):
+        return f"Interface({self.name}, {self.subnet})"
+
+class Node:
+    def __init__(self, name, docker_container, wg_config_file, endpoint, docker_host='', wg_config_host_path='',
+                 subnet=DEFAULT_SUBNET, max_peers_per_interface=0, shard_ports=(), docker_timeout=DEFAULT_DOCKER_TIMEOUT,
+                 script_timeout=DEFAULT_SCRIPT_TIMEOUT, circuit_threshold=DEFAULT_CIRCUIT_THRESHOLD, circuit_reset=DEFAULT_CIRCUIT_RESET):
+        self.name = name
+        self.docker_container = docker_container
+        self.wg_config_file = wg_config_file
+        self.endpoint = endpoint
+        self.docker_host = docker_host
+        self.wg_config_host_path = wg_config_host_path
+        self.subnet = subnet
+        self.max_peers_per_interface = max_peers_per_interface
+        self.shard_ports = list(shard_ports)
+        self.docker_timeout = docker_timeout
+        self.script_timeout = script_timeout
+        self.circuit_threshold = circuit_threshold
+        self.circuit_reset = circuit_reset
+
+    def env(self):
+        env = os.environ.copy()
+        if self.docker_host:
+            env['DOCKER_HOST'] = self.docker_host
+        return env
+
+    def __repr__(self):
+        return f"Node({self.name}, {self.docker_container}@{self.docker_host or 'local'})"
+
+nodes_cache = {'mtime': None, 'nodes': []}
+# Peer changes on different nodes run concurrently and share these files.
+assignments_lock = threading.Lock()
+interfaces_lock = threading.Lock()
+interfaces_cache = {'mtime': None, 'extra': {}, 'interfaces': {}}
+
+def node_from_section(name, section):
+    shard_ports = [int(port) for port in section.get('shard_ports', '').split(',') if port.strip()]
+    return Node(
+        name,
+        section.get('docker_container'),
+        section.get('wg_config_file', '/opt/amnezia/awg/wg0.conf'),
+        section.get('endpoint'),
+        section.get('docker_host', ''),
+        section.get('wg_config_host_path', ''),
+        section.get('subnet', DEFAULT_SUBNET),
+        int(section.get('max_peers_per_interface', 0)),
+        shard_ports,
+        float(section.get('docker_timeout', DEFAULT_DOCKER_TIMEOUT)),
+        float(section.get('script_timeout', DEFAULT_SCRIPT_TIMEOUT)),
+        int(section.get('circuit_threshold', DEFAULT_CIRCUIT_THRESHOLD)),
+        float(section.get('circuit_reset', DEFAULT_CIRCUIT_RESET))
+    )
+
+def load_nodes(path=SETTINGS_FILE):
+    config = configparser.ConfigParser()
+    config.read(path)
+    nodes = []
+    if config.has_section('setting'):
+        main = config['setting']
+        nodes.append(node_from_section(main.get('node_name', DEFAULT_NODE_NAME), main))
+    for section in config.sections():
+        if section.startswith('node:'):
+            name = section.split(':', 1)[1].strip()
+            node = node_from_section(name, config[section])
+            if not node.docker_container or not node.endpoint:
+                logger.error(f"Для узла {name} не заданы docker_container или endpoint, узел пропущен.")
+                continue
+            nodes.append(node)
+    return nodes
+
+def get_nodes(path=SETTINGS_FILE):
+    mtime = os.path.getmtime(path) if os.path.exists(path) else None
+    if nodes_cache['mtime'] != mtime:
+        nodes_cache['nodes'] = load_nodes(path)
+        nodes_cache['mtime'] = mtime
+    return nodes_cache['nodes']
+
+def get_node(name):
+    return next((node for node in get_nodes() if node.name == name), None)
+
+def get_default_node():
+    return get_nodes()[0]
+
+def load_extra_interfaces():
+    if not os.path.exists(INTERFACES_FILE):
+        return {}
+    with open(INTERFACES_FILE, 'r') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            logger.error(f"Ошибка при загрузке {INTERFACES_FILE}.")
+            return {}
+
+def get_interfaces(node):
+    # Built lists are kept per node object, so a reload of the node
+    # settings rebuilds them as well.
+    mtime = os.path.getmtime(INTERFACES_FILE) if os.path.exists(INTERFACES_FILE) else None
+    if interfaces_cache['mtime'] != mtime:
+        interfaces_cache['extra'] = load_extra_interfaces()
+        interfaces_cache['interfaces'] = {}
+        interfaces_cache['mtime'] = mtime
+    cached = interfaces_cache['interfaces'].get(node.name)
+    if cached is None or cached[0] is not node:
+        cached = (node, build_interfaces(node, interfaces_cache['extra']))
+        interfaces_cache['interfaces'][node.name] = cached
+    return cached[1]
+
+def build_interfaces(node, extra):
+    primary_name = os.path.basename(node.wg_config_file).split('.')[0]
+    interfaces = [Interface(primary_name, node.wg_config_file, node.subnet, host_path=node.wg_config_host_path)]
+    for data in extra.get(node.name, []):
+        host_path = ''
+        if node.wg_config_host_path:
+            host_path = os.path.join(os.path.dirname(node.wg_config_host_path), os.path.basename(data['config_file']))
+        interfaces.append(Interface(data['name'], data['config_file'], data['subnet'], data.get('listen_port'), host_path))
+    return interfaces
+
+def get_interface(node, name):
+    return next((interface for interface in get_interfaces(node) if interface.name == name), None)
+
+def add_interface(node, interface):
+    with interfaces_lock:
+        extra = load_extra_interfaces()
+        extra.setdefault(node.name, []).append(interface.to_dict())
+        os.makedirs(os.path.dirname(INTERFACES_FILE), exist_ok=True)
+        with open(INTERFACES_FILE, 'w') as f:
+            json.dump(extra, f, indent=4)
+    # Two writes within the mtime resolution would look unchanged.
+    interfaces_cache['mtime'] = None
+
+def load_assignments():
+    if not os.path.exists(NODE_ASSIGNMENTS_FILE):
+        return {}
+    with open(NODE_ASSIGNMENTS_FILE, 'r') as f:
+        try:
+            return json.load(f)
+        except json.JSONDecodeError:
+            logger.error(f"Ошибка при загрузке {NODE_ASSIGNMENTS_FILE}.")
+            return {}
+
+def save_assignments(assignments):
+    os.makedirs(os.path.dirname(NODE_ASSIGNMENTS_FILE), exist_ok=True)
+    with open(NODE_ASSIGNMENTS_FILE, 'w') as f:
+        json.dump(assignments, f)
+
+def assign_client(client_name, node):
+    with assignments_lock:
+        assignments = load_assignments()
+        assignments[client_name] = node.name
+        save_assignments(assignments)
+
+def unassign_client(client_name):
+    with assignments_lock:
+        assignments = load_assignments()
+        if assignments.pop(client_name, None) is not None:
+            save_assignments(assignments)
+
+def get_client_node(client_name):
+    node_name = load_assignments().get(client_name)
+    if node_name:
+        return get_node(node_name)
+    return None
+
+async def fan_out(func, *args, nodes=None):
+    loop = asyncio.get_running_loop()
+    nodes = nodes if nodes is not None else get_nodes()
+    results = await asyncio.gather(
+        *(loop.run_in_executor(None, functools.partial(contextvars.copy_context().run, func, *args, node=node)) for node in nodes),
+        return_exceptions=True
+    )
+    out = {}
+    for node, result in zip(nodes, results):
+        if isinstance(result, Exception):
+            logger.error(f"Ошибка при опросе узла {node.name}: {result}")
+            continue
+        out[node.name] = result
+    return out
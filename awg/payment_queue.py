@@ -0,0 +1,101 @@
+import time
+import asyncio
+import logging
+import db
+
+logger = logging.getLogger(__name__)
+
+POLL_INTERVAL = 5.0
+
+class RetryLater(Exception):
+    pass
+
+class PaymentQueue:
+    def __init__(self, handler, workers=4, max_attempts=6, backoff=30.0, on_dead=None):
+        self.handler = handler
+        self.workers = workers
+        self.max_attempts = max_attempts
+        self.backoff = backoff
+        self.on_dead = on_dead
+        self._wakeup = None
+        self._tasks = []
+
+    async def start(self):
+        self._wakeup = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        restored = await loop.run_in_executor(None, db.reset_processing_payment_events)
+        if restored:
+            logger.info(f"Возвращено в очередь незавершённых платёжных событий: {restored}.")
+        self._tasks = [asyncio.create_task(self._worker(i)) for i in range(self.workers)]
+
+    async def stop(self):
+        for task in self._tasks:
+            task.cancel()
+        await asyncio.gather(*self._tasks, return_exceptions=True)
+        self._tasks = []
+
+    def notify(self):
+        if self._wakeup is not None:
+            self._wakeup.set()
+
+    async def enqueue(self, payment_id, event, payload):
+        loop = asyncio.get_running_loop()
+        added = await loop.run_in_executor(None, db.enqueue_payment_event, payment_id, event, payload)
+        if added:
+            self.notify()
+        return added
+
+    async def requeue(self, payment_id):
+        loop = asyncio.get_running_loop()
+        requeued = await loop.run_in_executor(None, db.requeue_payment_event, payment_id)
+        if requeued:
+            self.notify()
+        return requeued
+
+    async def _wait(self, loop):
+        next_attempt = await loop.run_in_executor(None, db.next_payment_event_time)
+        timeout = POLL_INTERVAL if next_attempt is None else min(max(next_attempt - time.time(), 0), POLL_INTERVAL)
+        try:
+            await asyncio.wait_for(self._wakeup.wait(), timeout)
+        except asyncio.TimeoutError:
+            pass
+        self._wakeup.clear()
+
+    async def _worker(self, number):
+        loop = asyncio.get_running_loop()
+        while True:
+            try:
+                event = await loop.run_in_executor(None, db.claim_payment_event, time.time())
+            except Exception as e:
+                logger.error(f"Ошибка при чтении очереди платёжных событий: {e}")
+                await asyncio.sleep(POLL_INTERVAL)
+                continue
+            if event is None:
+                await self._wait(loop)
+                continue
+            await self._process(loop, event)
+
+    async def _process(self, loop, event):
+        payment_id = event['payment_id']
+        try:
+            await self.handler(payment_id)
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            attempts = event['attempts'] + 1
+            dead = attempts >= self.max_attempts
+            next_attempt = time.time() + self.backoff * 2 ** (attempts - 1)
+            await loop.run_in_executor(None, db.fail_payment_event, payment_id, str(e), next_attempt, dead)
+            if dead:
+                logger.error(f"Платёж {payment_id} перемещён в список необработанных после {attempts} попыток: {e}")
+                if self.on_dead:
+                    try:
+                        await self.on_dead(payment_id, e)
+                    except Exception as notify_error:
+                        logger.error(f"Ошибка при уведомлении о необработанном платеже {payment_id}: {notify_error}")
+            elif isinstance(e, RetryLater):
+                logger.info(f"Платёж {payment_id} будет проверен повторно: {e}")
+            else:
+                logger.warning(f"Ошибка при обработке платежа {payment_id} (попытка {attempts}): {e}")
+        else:
+            await loop.run_in_executor(None, db.complete_payment_event, payment_id)
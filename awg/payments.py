@@ -0,0 +1,63 @@
+import uuid
+import asyncio
+import logging
+import aiohttp
+
+logger = logging.getLogger(__name__)
+
+DEFAULT_API_URL = 'https://api.yookassa.ru/v3'
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+class PaymentError(Exception):
+    def __init__(self, message, status=None, body=None):
+        super().__init__(message)
+        self.status = status
+        self.body = body
+
+class YooKassaClient:
+    def __init__(self, account_id, secret_key, api_url=DEFAULT_API_URL, timeout=10.0, retries=3, backoff=0.5):
+        self.auth = aiohttp.BasicAuth(account_id, secret_key)
+        self.api_url = api_url.rstrip('/')
+        self.timeout = aiohttp.ClientTimeout(total=timeout)
+        self.retries = retries
+        self.backoff = backoff
+        self._session = None
+
+    def get_session(self):
+        if self._session is None or self._session.closed:
+            self._session = aiohttp.ClientSession(auth=self.auth, timeout=self.timeout)
+        return self._session
+
+    async def close(self):
+        if self._session is not None and not self._session.closed:
+            await self._session.close()
+        self._session = None
+
+    async def request(self, method, path, payload=None, idempotence_key=None):
+        headers = {}
+        if idempotence_key:
+            headers['Idempotence-Key'] = idempotence_key
+        url = f"{self.api_url}{path}"
+        last_error = None
+        for attempt in range(self.retries + 1):
+            if attempt:
+                await asyncio.sleep(self.backoff * 2 ** (attempt - 1))
+            try:
+                async with self.get_session().request(method, url, json=payload, headers=headers) as resp:
+                    if resp.status in RETRY_STATUSES:
+                        last_error = PaymentError(f"YooKassa {method} {path}: HTTP {resp.status}", resp.status, await resp.text())
+                    else:
+                        body = await resp.json(content_type=None)
+                        if resp.status < 400:
+                            return body
+                        raise PaymentError(f"YooKassa {method} {path}: HTTP {resp.status}", resp.status, body)
+            except (aiohttp.ClientError, asyncio.TimeoutError, ValueError) as e:
+                last_error = PaymentError(f"YooKassa {method} {path}: {e!r}")
+            logger.warning(f"Попытка {attempt + 1} запроса к YooKassa не удалась: {last_error}")
+        raise last_error
+
+    async def create_payment(self, payload, idempotence_key=None):
+        return await self.request('POST', '/payments', payload, idempotence_key or str(uuid.uuid4()))
+
+    async def get_payment(self, payment_id):
+        return await self.request('GET', f"/payments/{payment_id}")
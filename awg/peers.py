@@ -0,0 +1,82 @@
+# Pre-provisioned peers waiting to be claimed; client names entered by the
+# admin or derived from Telegram IDs never contain a dot.
+SLOT_PREFIX = '.slot-'
+
+def is_slot_name(name):
+    return name.startswith(SLOT_PREFIX)
+
+class Peer:
+    __slots__ = ('name', 'public_key', 'allowed_ips', 'node', 'interface', 'suspended')
+
+    def __init__(self, name, public_key, allowed_ips, node, interface, suspended=False):
+        self.name = name
+        self.public_key = public_key
+        self.allowed_ips = allowed_ips
+        self.node = node
+        self.interface = interface
+        self.suspended = suspended
+
+    @property
+    def addresses(self):
+        return [address.strip() for address in self.allowed_ips.split(',') if address.strip()]
+
+    def __repr__(self):
+        return f"Peer({self.name}, {self.allowed_ips}, {self.node}/{self.interface})"
+
+class PeerStatus:
+    __slots__ = ('name', 'latest_handshake', 'transfer', 'endpoint')
+
+    def __init__(self, name, latest_handshake, transfer, endpoint):
+        self.name = name
+        self.latest_handshake = latest_handshake
+        self.transfer = transfer
+        self.endpoint = endpoint
+
+    def __repr__(self):
+        return f"PeerStatus({self.name}, {self.latest_handshake}, {self.endpoint})"
+
+def normalize_address(address):
+    address = address.strip()
+    return address if '/' in address else f"{address}/32"
+
+class PeerRegistry:
+    def __init__(self, peers=()):
+        self.peers = []
+        self.by_name = {}
+        self.by_key = {}
+        self.by_address = {}
+        for peer in peers:
+            self.add(peer)
+
+    @classmethod
+    def merged(cls, registries):
+        registries = list(registries)
+        if len(registries) == 1:
+            return registries[0]
+        return cls(peer for registry in registries for peer in registry)
+
+    def add(self, peer):
+        self.peers.append(peer)
+        self.by_name.setdefault(peer.name, peer)
+        if peer.public_key:
+            self.by_key[peer.public_key] = peer
+        for address in peer.addresses:
+            self.by_address[address] = peer
+
+    def get(self, name):
+        return self.by_name.get(name)
+
+    def find_by_key(self, public_key):
+        return self.by_key.get(public_key)
+
+    def find_by_address(self, address):
+        return self.by_address.get(normalize_address(address))
+
+    def __contains__(self, name):
+        return name in self.by_name
+
+    def __iter__(self):
+        return iter(self.peers)
+
+    def __len__(self):
+        return len(self.peers)
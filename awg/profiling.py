@@ -0,0 +1,164 @@
+import sys
+import time
+import asyncio
+import logging
+import functools
+import threading
+import traceback
+import contextvars
+
+logger = logging.getLogger(__name__)
+
+current_span = contextvars.ContextVar('current_span', default=None)
+call_depth = threading.local()
+
+class HandlerSpan:
+    def __init__(self, name):
+        self.name = name
+        self.started = time.perf_counter()
+        self.duration = None
+        self.calls = []
+        self.blocked = 0.0
+        self.stack = None
+
+    def finish(self):
+        self.duration = time.perf_counter() - self.started
+        return self.duration
+
+    def summary(self, limit=10):
+        totals = {}
+        for name, duration, depth in self.calls:
+            if depth == 0:
+                count, total = totals.get(name, (0, 0.0))
+                totals[name] = (count + 1, total + duration)
+        top = sorted(totals.items(), key=lambda item: item[1][1], reverse=True)[:limit]
+        return ', '.join(f"{name}×{count}={total * 1000:.0f}мс" for name, (count, total) in top)
+
+def run_in_executor(func, *args):
+    loop = asyncio.get_running_loop()
+    context = contextvars.copy_context()
+    return loop.run_in_executor(None, functools.partial(context.run, func, *args))
+
+def traced(name, func):
+    @functools.wraps(func)
+    def wrapper(*args, **kwargs):
+        span = current_span.get()
+        if span is None:
+            return func(*args, **kwargs)
+        depth = getattr(call_depth, 'value', 0)
+        call_depth.value = depth + 1
+        started = time.perf_counter()
+        try:
+            return func(*args, **kwargs)
+        finally:
+            call_depth.value = depth
+            span.calls.append((name, time.perf_counter() - started, depth))
+    wrapper.__wrapped__ = func
+    return wrapper
+
+def instrument_module(module, prefix=None):
+    prefix = prefix or module.__name__
+    for attr, value in list(vars(module).items()):
+        if attr.startswith('_') or not callable(value) or getattr(value, '__module__', None) != module.__name__:
+            continue
+        if isinstance(value, type) or hasattr(value, '__wrapped__'):
+            continue
+        setattr(module, attr, traced(f"{prefix}.{attr}", value))
+
+class HandlerStats:
+    def __init__(self):
+        self.count = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow = 0
+        self.blocked = 0.0
+        self.last_slow = ''
+
+class SlowHandlers:
+    def __init__(self, threshold=1.0):
+        self.threshold = threshold
+        self.stats = {}
+
+    def record(self, span):
+        stats = self.stats.setdefault(span.name, HandlerStats())
+        stats.count += 1
+        stats.total += span.duration
+        stats.max = max(stats.max, span.duration)
+        stats.blocked = max(stats.blocked, span.blocked)
+        if span.duration >= self.threshold or span.blocked:
+            stats.slow += 1
+            stats.last_slow = span.summary()
+            logger.warning(
+                f"Медленный обработчик {span.name}: {span.duration * 1000:.0f}мс"
+                + (f", цикл событий заблокирован на {span.blocked * 1000:.0f}мс" if span.blocked else '')
+                + (f"; вызовы: {stats.last_slow}" if stats.last_slow else '')
+            )
+
+    def top(self, limit=10):
+        return sorted(self.stats.items(), key=lambda item: item[1].max, reverse=True)[:limit]
+
+class LoopLagMonitor:
+    def __init__(self, threshold=0.25, interval=0.1):
+        self.threshold = threshold
+        self.interval = interval
+        self.task_spans = {}
+        self.max_lag = 0.0
+        self._loop = None
+        self._loop_thread = None
+        self._last_beat = None
+        self._heartbeat = None
+        self._thread = None
+        self._stop = threading.Event()
+
+    def start(self):
+        self._loop = asyncio.get_running_loop()
+        self._loop_thread = threading.get_ident()
+        self._last_beat = time.monotonic()
+        self._stop.clear()
+        self._heartbeat = self._loop.create_task(self._beat())
+        self._thread = threading.Thread(target=self._watch, name='loop-lag-monitor', daemon=True)
+        self._thread.start()
+
+    def stop(self):
+        self._stop.set()
+        if self._heartbeat:
+            self._heartbeat.cancel()
+        self._heartbeat = None
+
+    def track(self, span):
+        task = asyncio.current_task()
+        if task is not None:
+            self.task_spans[task] = span
+
+    def untrack(self):
+        self.task_spans.pop(asyncio.current_task(), None)
+
+    async def _beat(self):
+        while True:
+            self._last_beat = time.monotonic()
+            await asyncio.sleep(self.interval)
+
+    def _watch(self):
+        reported = None
+        while not self._stop.wait(self.interval):
+            beat = self._last_beat
+            lag = time.monotonic() - beat - self.interval
+            if lag < self.threshold:
+                reported = None
+                continue
+            self.max_lag = max(self.max_lag, lag)
+            task = asyncio.current_task(self._loop)
+            span = self.task_spans.get(task)
+            if span is not None:
+                span.blocked = max(span.blocked, lag)
+            if reported == beat:
+                continue
+            reported = beat
+            frame = sys._current_frames().get(self._loop_thread)
+            stack = ''.join(traceback.format_stack(frame)) if frame is not None else ''
+            if span is not None:
+                span.stack = stack
+            logger.warning(
+                f"Цикл событий заблокирован более {lag * 1000:.0f}мс"
+                f" (обработчик: {span.name if span else 'нет'}). Стек:\n{stack}"
+            )
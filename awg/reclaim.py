@@ -0,0 +1,133 @@
+import os
+import json
+import logging
+from datetime import datetime, timezone
+
+import peers
+import timeseries
+
+logger = logging.getLogger(__name__)
+
+# wg resets latest-handshake to 0 whenever the interface is recreated, so the
+# newest handshake ever seen is kept here, along with the moment a peer that
+# never connects is measured from: its creationDate in clientsTable, or when
+# find_idle first met it if the table has none.
+class HandshakeLog:
+    def __init__(self, path):
+        self.path = path
+        self.first_seen = {}
+        self.last_handshake = {}
+        self.dirty = False
+
+    def __len__(self):
+        return len(self.first_seen.keys() | self.last_handshake.keys())
+
+    def __contains__(self, name):
+        return name in self.first_seen
+
+    def seen(self, name, now):
+        if name not in self.first_seen:
+            self.first_seen[name] = now
+            self.dirty = True
+
+    def observe(self, names, handshakes, now):
+        last_handshake = self.last_handshake
+        for name, handshake in zip(names, handshakes):
+            if handshake > last_handshake.get(name, 0):
+                last_handshake[name] = handshake
+                self.dirty = True
+
+    def forget(self, name):
+        if self.first_seen.pop(name, None) is not None or self.last_handshake.pop(name, None) is not None:
+            self.dirty = True
+
+    def dump(self):
+        first_seen = dict(self.first_seen)
+        last_handshake = dict(self.last_handshake)
+        data = {
+            name: [first_seen.get(name, 0), last_handshake.get(name, 0)]
+            for name in first_seen.keys() | last_handshake.keys()
+        }
+        return json.dumps(data).encode('utf-8')
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        try:
+            with open(self.path, 'r') as f:
+                data = json.load(f)
+            self.first_seen = {name: entry[0] for name, entry in data.items() if entry[0]}
+            self.last_handshake = {name: entry[1] for name, entry in data.items() if entry[1]}
+        except (OSError, ValueError, IndexError, TypeError) as e:
+            logger.error(f"Ошибка при загрузке журнала рукопожатий {self.path}: {e}")
+            self.first_seen = {}
+            self.last_handshake = {}
+        self.dirty = False
+
+    def save(self):
+        self.dirty = False
+        try:
+            timeseries.write_atomic(self.path, self.dump())
+        except OSError:
+            self.dirty = True
+            raise
+
+class IdlePeer:
+    __slots__ = ('name', 'node', 'last_active', 'first_seen', 'suspended')
+
+    def __init__(self, name, node, last_active, first_seen, suspended):
+        self.name = name
+        self.node = node
+        self.last_active = last_active
+        self.first_seen = first_seen
+        self.suspended = suspended
+
+    @property
+    def reference(self):
+        return self.last_active if self.last_active is not None else self.first_seen
+
+def parse_creation_date(value):
+    # newclient.sh stores the output of `date`, the bot an isoformat() string.
+    if not isinstance(value, str):
+        return None
+    try:
+        return datetime.fromisoformat(value).timestamp()
+    except ValueError:
+        pass
+    parts = value.split()
+    if len(parts) != 6:
+        return None
+    try:
+        created = datetime.strptime(' '.join(parts[:4] + parts[5:]), '%a %b %d %H:%M:%S %Y')
+    except ValueError:
+        return None
+    if parts[4] in ('UTC', 'GMT'):
+        created = created.replace(tzinfo=timezone.utc)
+    return created.timestamp()
+
+def creation_dates(clients_table):
+    created = {}
+    for entry in clients_table:
+        user_data = entry.get('userData') or {}
+        timestamp = parse_creation_date(user_data.get('creationDate'))
+        if timestamp is not None and user_data.get('clientName'):
+            created[user_data['clientName']] = timestamp
+    return created
+
+def find_idle(clients, log, history, cutoff, now, created=None):
+    # Activity is the newer of the last handshake and the last traffic in the
+    # history, so peers keep their age across restarts of the bot and of wg.
+    created = created or {}
+    idle = []
+    for client in clients:
+        name = client.name
+        if peers.is_slot_name(name):
+            continue
+        log.seen(name, min(created.get(name, now), now))
+        candidates = [value for value in (log.last_handshake.get(name), history.last_active(name)) if value]
+        last_active = max(candidates) if candidates else None
+        peer = IdlePeer(name, client.node, last_active, log.first_seen[name], client.suspended)
+        if peer.reference < cutoff:
+            idle.append(peer)
+    idle.sort(key=lambda peer: peer.reference)
+    return idle
@@ -18,55 +18,7 @@ SERVER_CONF_PATH="$pwd/files/server.conf"
 
 docker exec -i "$DOCKER_CONTAINER" cat "$WG_CONFIG_FILE" > "$SERVER_CONF_PATH"
 
-awk -v pubkey="$CLIENT_PUBLIC_KEY" '
-BEGIN {in_peer=0; skip=0}
-/^\[Peer\]/ {
-    in_peer=1
-    peer_block = $0 "\n"
-    next
-}
-in_peer == 1 {
-    peer_block = peer_block $0 "\n"
-    if ($0 ~ /^PublicKey\s*=/) {
-        split($0, a, " = ")
-        if (a[2] == pubkey) {
-            skip=1
-        }
-    }
-    if ($0 ~ /^\[Peer\]/ || $0 ~ /^\[Interface\]/) {
-        if (skip == 1) {
-            skip=0
-            in_peer=0
-            next
-        } else {
-            print peer_block
-            in_peer=0
-        }
-    }
-    if ($0 == "") {
-        if (skip == 1) {
-            skip=0
-            in_peer=0
-            next
-        } else {
-            print peer_block
-            in_peer=0
-        }
-    }
-    next
-}
-{
-    print
-}
-END {
-    if (in_peer == 1 && skip == 1) {
-    } else if (in_peer ==1 ) {
-        print peer_block
-    }
-}
-' "$SERVER_CONF_PATH" > "$SERVER_CONF_PATH.tmp"
-
-mv "$SERVER_CONF_PATH.tmp" "$SERVER_CONF_PATH"
+"${PYTHON:-python3}" "$(dirname "$0")/wgconf.py" remove "$SERVER_CONF_PATH" "$CLIENT_PUBLIC_KEY"
 
 docker exec -i "$DOCKER_CONTAINER" wg-quick strip "$WG_CONFIG_FILE" > /dev/null
 
@@ -0,0 +1,66 @@
+import sys
+import json
+import time
+import asyncio
+import argparse
+import aiohttp
+
+def load_updates(path):
+    with open(path, 'r', encoding='utf-8') as f:
+        content = f.read().strip()
+    if not content:
+        return []
+    if content.startswith('['):
+        return json.loads(content)
+    if path.endswith('.jsonl'):
+        return [json.loads(line) for line in content.splitlines() if line.strip()]
+    return [json.loads(content)]
+
+async def replay(url, updates, secret=None, delay=0.0):
+    headers = {'Content-Type': 'application/json'}
+    if secret:
+        headers['X-Telegram-Bot-Api-Secret-Token'] = secret
+    results = []
+    async with aiohttp.ClientSession() as session:
+        for update in updates:
+            started = time.perf_counter()
+            async with session.post(url, data=json.dumps(update), headers=headers) as resp:
+                body = await resp.text()
+                elapsed = (time.perf_counter() - started) * 1000
+                results.append((update.get('update_id'), resp.status, elapsed, body))
+            if delay:
+                await asyncio.sleep(delay)
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='Replay recorded Telegram updates against the local webhook endpoint.')
+    parser.add_argument('files', nargs='+', help='JSON file with one update, a JSON array of updates or a .jsonl file.')
+    parser.add_argument('-u', '--url', default='http://localhost:8080/telegram-webhook', help='Webhook URL of the bot.')
+    parser.add_argument('-s', '--secret', help='Value of webhook_secret from setting.ini, if configured.')
+    parser.add_argument('-d', '--delay', type=float, default=0.0, help='Delay between updates in seconds.')
+
+    args = parser.parse_args()
+
+    updates = []
+    for path in args.files:
+        try:
+            updates.extend(load_updates(path))
+        except FileNotFoundError:
+            print(f'Error: File {path} not found.')
+            sys.exit(1)
+        except json.JSONDecodeError as e:
+            print(f'Error parsing {path}: {e}')
+            sys.exit(1)
+
+    results = asyncio.run(replay(args.url, updates, args.secret, args.delay))
+    failed = 0
+    for update_id, status, elapsed, body in results:
+        print(f'update_id={update_id} status={status} {elapsed:.1f}ms {body[:80]}')
+        if status != 200:
+            failed += 1
+    print(f'Sent {len(results)} updates, failed {failed}.')
+    if failed:
+        sys.exit(1)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,207 @@
+import heapq
+from collections import OrderedDict
+from datetime import datetime, timezone
+
+PROXIMITY_BUCKETS = 20
+
+class TopK:
+    # Counters within a period only grow, so every name outside the top set
+    # stays at or below the smallest member: a non-member only has to beat
+    # the current minimum to take its place. The heap keeps stale entries
+    # and is rebuilt from the members once it grows to a few times K.
+    def __init__(self, k):
+        self.k = k
+        self.values = {}
+        self.members = {}
+        self._heap = []
+
+    def __len__(self):
+        return len(self.values)
+
+    def reset(self):
+        self.values = {}
+        self.members = {}
+        self._heap = []
+
+    def add(self, name, amount):
+        value = self.values.get(name, 0) + amount
+        self.values[name] = value
+        if name in self.members:
+            self.members[name] = value
+            self._push(value, name)
+        elif len(self.members) < self.k:
+            self.members[name] = value
+            self._push(value, name)
+        else:
+            smallest = self._peek()
+            if smallest is not None and value > smallest[0]:
+                heapq.heappop(self._heap)
+                del self.members[smallest[1]]
+                self.members[name] = value
+                self._push(value, name)
+
+    def forget(self, name):
+        self.values.pop(name, None)
+        if self.members.pop(name, None) is None:
+            return
+        # The freed seat goes to the largest remaining value; a full pass is
+        # fine here because removals are rare compared to updates.
+        candidates = [(value, other) for other, value in self.values.items() if other not in self.members]
+        if candidates:
+            value, other = max(candidates)
+            self.members[other] = value
+            self._push(value, other)
+
+    def top(self):
+        return sorted(self.members.items(), key=lambda item: item[1], reverse=True)
+
+    def _push(self, value, name):
+        heapq.heappush(self._heap, (value, name))
+        if len(self._heap) > 4 * max(self.k, 16):
+            self._heap = [(value, name) for name, value in self.members.items()]
+            heapq.heapify(self._heap)
+
+    def _peek(self):
+        while self._heap:
+            value, name = self._heap[0]
+            if self.members.get(name) == value:
+                return self._heap[0]
+            heapq.heappop(self._heap)
+        return None
+
+class PeriodTopK(TopK):
+    def __init__(self, k, period):
+        super().__init__(k)
+        self.period = period
+        self.current = None
+
+    def add_at(self, name, amount, now):
+        key = self.period(now)
+        if key != self.current:
+            self.reset()
+            self.current = key
+        self.add(name, amount)
+
+    def top_at(self, now):
+        return self.top() if self.period(now) == self.current else []
+
+def day_key(now):
+    return int(now // 86400)
+
+def month_key(now):
+    moment = datetime.fromtimestamp(now, tz=timezone.utc)
+    return moment.year * 12 + moment.month - 1
+
+class ProximityIndex:
+    def __init__(self, buckets=PROXIMITY_BUCKETS):
+        self.buckets = buckets
+        self.entries = {}
+        self.sets = [set() for _ in range(buckets + 1)]
+
+    def __len__(self):
+        return len(self.entries)
+
+    def update(self, name, used, limit):
+        ratio = used / limit if limit else 0
+        bucket = min(int(ratio * self.buckets), self.buckets)
+        entry = self.entries.get(name)
+        if entry is not None and entry[0] != bucket:
+            self.sets[entry[0]].discard(name)
+        self.entries[name] = (bucket, used, limit)
+        self.sets[bucket].add(name)
+
+    def forget(self, name):
+        entry = self.entries.pop(name, None)
+        if entry is not None:
+            self.sets[entry[0]].discard(name)
+
+    def nearest(self, k, min_ratio=0.0):
+        result = []
+        lowest = int(min_ratio * self.buckets)
+        for bucket in range(self.buckets, lowest - 1, -1):
+            if not self.sets[bucket]:
+                continue
+            entries = sorted(
+                ((name,) + self.entries[name][1:] for name in self.sets[bucket]),
+                key=lambda entry: entry[1] / entry[2],
+                reverse=True
+            )
+            result.extend(entry for entry in entries if entry[1] >= min_ratio * entry[2])
+            if len(result) >= k:
+                break
+        return result[:k]
+
+class IdleIndex:
+    # Names in order of last activity, oldest first: touching a name moves it
+    # to the end, so the idle report only walks the front of the dict.
+    def __init__(self):
+        self.last_active = OrderedDict()
+
+    def __len__(self):
+        return len(self.last_active)
+
+    def __contains__(self, name):
+        return name in self.last_active
+
+    def touch(self, name, now):
+        self.last_active[name] = now
+        self.last_active.move_to_end(name)
+
+    def seed(self, name, last_active):
+        if name in self.last_active:
+            return
+        self.last_active[name] = last_active
+        self.last_active.move_to_end(name, last=False)
+
+    def forget(self, name):
+        self.last_active.pop(name, None)
+
+    def idle_since(self, cutoff, k):
+        result = []
+        for name, last_active in self.last_active.items():
+            if last_active >= cutoff or len(result) >= k:
+                break
+            result.append((name, last_active))
+        return result
+
+class UsageReports:
+    def __init__(self, k=20):
+        self.k = k
+        self.today = PeriodTopK(k, day_key)
+        self.month = PeriodTopK(k, month_key)
+        self.proximity = ProximityIndex()
+        self.idle = IdleIndex()
+
+    def record(self, name, amount, now):
+        if amount <= 0:
+            return
+        self.today.add_at(name, amount, now)
+        self.month.add_at(name, amount, now)
+        self.idle.touch(name, now)
+
+    def update_limit(self, name, used, limit):
+        self.proximity.update(name, used, limit)
+
+    def forget_limit(self, name):
+        self.proximity.forget(name)
+
+    def forget(self, name):
+        self.today.forget(name)
+        self.month.forget(name)
+        self.proximity.forget(name)
+        self.idle.forget(name)
+
+    def seed(self, history, now):
+        days_into_month = datetime.fromtimestamp(now, tz=timezone.utc).day
+        activity = []
+        for name in list(history.series):
+            days = history.usage(name, 'day', days_into_month, now)
+            if days[-1]:
+                self.today.add_at(name, days[-1], now)
+            if any(days):
+                self.month.add_at(name, sum(days), now)
+            last_active = history.last_active(name)
+            if last_active is not None:
+                activity.append((last_active, name))
+        for last_active, name in sorted(activity):
+            self.idle.touch(name, last_active)
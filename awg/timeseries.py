@@ -0,0 +1,373 @@
+import os
+import sys
+import struct
+import logging
+import tempfile
+import threading
+from array import array
+
+logger = logging.getLogger(__name__)
+
+# (name, bucket width in seconds, number of buckets kept)
+RESOLUTIONS = (
+    ('minute', 60, 1440),
+    ('hour', 3600, 720),
+    ('day', 86400, 365),
+)
+RESOLUTION_INDEX = {name: index for index, (name, _, _) in enumerate(RESOLUTIONS)}
+
+# Buckets hold KiB in unsigned 32-bit cells: 4 TiB per bucket is far above
+# what a single peer can move in a day, and it halves the footprint of 'Q'.
+UNIT = 1024
+CELL_MAX = 0xFFFFFFFF
+
+MAGIC = b'AWGTS1\n'
+JOURNAL_MAGIC = b'AWGTJ1\n'
+# The snapshot is rewritten once the journal outgrows it.
+JOURNAL_MIN_COMPACT = 1 << 20
+SPARK_BLOCKS = '▁▂▃▄▅▆▇█'
+
+class Ring:
+    __slots__ = ('size', 'head', 'values')
+
+    def __init__(self, size, head=-1, values=None):
+        self.size = size
+        self.head = head
+        self.values = values if values is not None else array('I', bytes(size * 4))
+
+    def advance(self, bucket):
+        if bucket > self.head:
+            if self.head < 0 or bucket - self.head >= self.size:
+                self.values[:] = array('I', bytes(self.size * 4))
+            else:
+                for stale in range(self.head + 1, bucket + 1):
+                    self.values[stale % self.size] = 0
+            self.head = bucket
+            return True
+        return bucket > self.head - self.size
+
+    def add(self, bucket, amount):
+        if self.advance(bucket):
+            slot = bucket % self.size
+            self.values[slot] = min(self.values[slot] + amount, CELL_MAX)
+
+    def set(self, bucket, value):
+        if self.advance(bucket):
+            self.values[bucket % self.size] = value
+
+    def get(self, bucket):
+        return self.values[bucket % self.size] if self.head - self.size < bucket <= self.head else 0
+
+    def window(self, end_bucket, count):
+        count = min(count, self.size)
+        oldest = self.head - self.size
+        return [
+            self.values[bucket % self.size] if oldest < bucket <= self.head else 0
+            for bucket in range(end_bucket - count + 1, end_bucket + 1)
+        ]
+
+class PeerSeries:
+    __slots__ = ('rings', 'carry')
+
+    def __init__(self):
+        self.rings = [None] * len(RESOLUTIONS)
+        self.carry = 0
+
+    def add(self, amount, now):
+        amount += self.carry
+        units, self.carry = divmod(amount, UNIT)
+        if not units:
+            return False
+        for index, (_, step, size) in enumerate(RESOLUTIONS):
+            ring = self.rings[index]
+            if ring is None:
+                ring = self.rings[index] = Ring(size)
+            ring.add(int(now // step), units)
+        return True
+
+    def set(self, index, bucket, value):
+        ring = self.rings[index]
+        if ring is None:
+            ring = self.rings[index] = Ring(RESOLUTIONS[index][2])
+        ring.set(bucket, value)
+
+# Saves append the buckets changed since the previous save to a journal next
+# to the snapshot instead of rewriting every ring. Journal records carry
+# absolute values, so replaying one over a snapshot that already has it is
+# harmless.
+class TrafficSeriesStore:
+    def __init__(self, path):
+        self.path = path
+        self.journal_path = path + '.log'
+        self.series = {}
+        self.dirty = False
+        self.changes = {}
+        self.removed = set()
+        self.changes_lock = threading.Lock()
+        self.snapshot_size = 0
+        self.journal_size = 0
+
+    def __len__(self):
+        return len(self.series)
+
+    def __contains__(self, name):
+        return name in self.series
+
+    def record(self, name, amount, now):
+        if amount <= 0:
+            return
+        series = self.series.get(name)
+        if series is None:
+            series = self.series[name] = PeerSeries()
+        added = series.add(int(amount), now)
+        with self.changes_lock:
+            buckets = self.changes.setdefault(name, set())
+            if added:
+                buckets.update((index, int(now // step)) for index, (_, step, _) in enumerate(RESOLUTIONS))
+            self.dirty = True
+
+    def usage(self, name, resolution, count, now):
+        index = RESOLUTION_INDEX[resolution]
+        step = RESOLUTIONS[index][1]
+        series = self.series.get(name)
+        ring = series.rings[index] if series else None
+        if ring is None:
+            return [0] * count
+        return [value * UNIT for value in ring.window(int(now // step), count)]
+
+    def last_active(self, name):
+        series = self.series.get(name)
+        if series is None:
+            return None
+        for index, (_, step, size) in enumerate(RESOLUTIONS):
+            ring = series.rings[index]
+            if ring is None:
+                continue
+            for bucket in range(ring.head, ring.head - size, -1):
+                if ring.values[bucket % size]:
+                    return bucket * step
+        return None
+
+    def forget(self, name):
+        if self.series.pop(name, None) is not None:
+            with self.changes_lock:
+                self.changes.pop(name, None)
+                self.removed.add(name)
+                self.dirty = True
+
+    def prune(self, now):
+        # Rings whose newest bucket has left the window hold only zeros; peers
+        # idle for a day give back their minute ring, idle for a year - all.
+        for name, series in list(self.series.items()):
+            for index, (_, step, size) in enumerate(RESOLUTIONS):
+                ring = series.rings[index]
+                if ring is not None and ring.head <= int(now // step) - size:
+                    series.rings[index] = None
+                    with self.changes_lock:
+                        self.changes.setdefault(name, set()).add((index, -1))
+                        self.dirty = True
+            if not any(series.rings):
+                del self.series[name]
+                with self.changes_lock:
+                    self.changes.pop(name, None)
+                    self.removed.add(name)
+
+    def dump(self):
+        # Snapshot the dict so dump can run in an executor while the traffic
+        # job keeps recording; a bucket written mid-dump lands in the next save.
+        items = list(self.series.items())
+        parts = [MAGIC, struct.pack('<I', len(items))]
+        for name, series in items:
+            encoded = name.encode('utf-8')
+            parts.append(struct.pack('<H', len(encoded)))
+            parts.append(encoded)
+            parts.append(struct.pack('<I', series.carry))
+            for ring in series.rings:
+                if ring is None:
+                    parts.append(struct.pack('<q', -1))
+                    continue
+                parts.append(struct.pack('<q', ring.head))
+                values = ring.values
+                if sys.byteorder != 'little':
+                    values = array('I', values)
+                    values.byteswap()
+                parts.append(values.tobytes())
+        return b''.join(parts)
+
+    def encode_changes(self, changes, removed):
+        parts = []
+        for name in removed:
+            parts.append(b'F' + encode_name(name))
+        for name, buckets in changes.items():
+            series = self.series.get(name)
+            if series is None:
+                continue
+            encoded = encode_name(name)
+            parts.append(b'C' + encoded + struct.pack('<I', series.carry))
+            # A dropped ring (bucket -1) sorts before the buckets recorded
+            # into its replacement.
+            for index, bucket in sorted(buckets):
+                ring = series.rings[index]
+                if bucket < 0:
+                    parts.append(b'R' + encoded + struct.pack('<B', index))
+                elif ring is not None:
+                    parts.append(b'S' + encoded + struct.pack('<BqI', index, bucket, ring.get(bucket)))
+        return b''.join(parts)
+
+    def load(self):
+        self.changes = {}
+        self.removed = set()
+        self.snapshot_size = 0
+        self.journal_size = 0
+        if os.path.exists(self.path):
+            try:
+                with open(self.path, 'rb') as f:
+                    data = f.read()
+                self.series = parse(data)
+                self.snapshot_size = len(data)
+            except (OSError, ValueError, struct.error) as e:
+                logger.error(f"Ошибка при загрузке истории трафика {self.path}: {e}")
+                self.series = {}
+        if os.path.exists(self.journal_path):
+            try:
+                with open(self.journal_path, 'rb') as f:
+                    data = f.read()
+                self.journal_size = replay(self.series, data)
+                # A record cut short by a crash would garble the next append.
+                if self.journal_size < len(data):
+                    os.truncate(self.journal_path, self.journal_size)
+            except (OSError, ValueError) as e:
+                logger.error(f"Ошибка при загрузке журнала истории трафика {self.journal_path}: {e}")
+                # The next save rewrites the snapshot and drops the journal.
+                self.snapshot_size = 0
+                self.journal_size = 0
+        self.dirty = False
+
+    def save(self):
+        with self.changes_lock:
+            changes, removed = self.changes, self.removed
+            self.changes, self.removed = {}, set()
+            self.dirty = False
+        try:
+            if not self.snapshot_size or self.journal_size > max(self.snapshot_size, JOURNAL_MIN_COMPACT):
+                self.compact()
+            else:
+                self.append(self.encode_changes(changes, removed))
+        except OSError:
+            with self.changes_lock:
+                for name, buckets in changes.items():
+                    self.changes.setdefault(name, set()).update(buckets)
+                self.removed |= removed
+                self.dirty = True
+            raise
+
+    def compact(self):
+        data = self.dump()
+        write_atomic(self.path, data)
+        self.snapshot_size = len(data)
+        if os.path.exists(self.journal_path):
+            os.remove(self.journal_path)
+        self.journal_size = 0
+
+    def append(self, records):
+        if not records:
+            return
+        if not self.journal_size:
+            records = JOURNAL_MAGIC + records
+        try:
+            with open(self.journal_path, 'ab') as f:
+                f.write(records)
+        except OSError:
+            if os.path.exists(self.journal_path):
+                os.truncate(self.journal_path, self.journal_size)
+            raise
+        self.journal_size += len(records)
+
+def encode_name(name):
+    encoded = name.encode('utf-8')
+    return struct.pack('<H', len(encoded)) + encoded
+
+def replay(series_map, data):
+    # Returns the length of the intact prefix: a trailing record cut short by
+    # a crash is dropped.
+    if not data.startswith(JOURNAL_MAGIC):
+        raise ValueError('неизвестный формат журнала')
+    offset = len(JOURNAL_MAGIC)
+    sizes = {b'F': 0, b'C': 4, b'R': 1, b'S': 13}
+    while offset < len(data):
+        kind = data[offset:offset + 1]
+        if kind not in sizes:
+            raise ValueError(f"неизвестная запись журнала по смещению {offset}")
+        if offset + 3 > len(data):
+            break
+        (name_length,) = struct.unpack_from('<H', data, offset + 1)
+        body = offset + 3 + name_length
+        end = body + sizes[kind]
+        if end > len(data):
+            break
+        name = data[offset + 3:body].decode('utf-8')
+        if kind == b'F':
+            series_map.pop(name, None)
+        elif kind == b'C':
+            series = series_map.setdefault(name, PeerSeries())
+            (series.carry,) = struct.unpack_from('<I', data, body)
+        elif kind == b'R':
+            series = series_map.get(name)
+            if series is not None:
+                series.rings[data[body]] = None
+        else:
+            index, bucket, value = struct.unpack_from('<BqI', data, body)
+            series_map.setdefault(name, PeerSeries()).set(index, bucket, value)
+        offset = end
+    return offset
+
+def parse(data):
+    if not data.startswith(MAGIC):
+        raise ValueError('неизвестный формат файла')
+    offset = len(MAGIC)
+    (count,) = struct.unpack_from('<I', data, offset)
+    offset += 4
+    series_map = {}
+    for _ in range(count):
+        (name_length,) = struct.unpack_from('<H', data, offset)
+        offset += 2
+        name = data[offset:offset + name_length].decode('utf-8')
+        offset += name_length
+        series = PeerSeries()
+        (series.carry,) = struct.unpack_from('<I', data, offset)
+        offset += 4
+        for index, (_, _, size) in enumerate(RESOLUTIONS):
+            (head,) = struct.unpack_from('<q', data, offset)
+            offset += 8
+            if head < 0:
+                continue
+            values = array('I')
+            values.frombytes(data[offset:offset + size * values.itemsize])
+            if len(values) != size:
+                raise ValueError(f"обрезанная запись {name}")
+            if sys.byteorder != 'little':
+                values.byteswap()
+            offset += size * values.itemsize
+            series.rings[index] = Ring(size, head, values)
+        series_map[name] = series
+    return series_map
+
+def write_atomic(path, data):
+    directory = os.path.dirname(os.path.abspath(path))
+    os.makedirs(directory, exist_ok=True)
+    with tempfile.NamedTemporaryFile(mode='wb', delete=False, dir=directory) as temp_file:
+        temp_file.write(data)
+    os.replace(temp_file.name, path)
+
+def sparkline(values):
+    peak = max(values) if values else 0
+    if not peak:
+        return SPARK_BLOCKS[0] * len(values)
+    scale = len(SPARK_BLOCKS) - 1
+    return ''.join(SPARK_BLOCKS[round(value / peak * scale)] for value in values)
+
+def downsample(values, width):
+    if len(values) <= width:
+        return list(values)
+    step = len(values) / width
+    return [sum(values[int(i * step):int((i + 1) * step)]) for i in range(width)]
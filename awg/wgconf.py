@@ -0,0 +1,298 @@
+import os
+import sys
+import argparse
+import tempfile
+
+OBFUSCATION_PARAMS = ('Jc', 'Jmin', 'Jmax', 'S1', 'S2', 'H1', 'H2', 'H3', 'H4')
+
+# A suspended peer stays in the file with every line commented out by this
+# marker: wg-quick skips it on restart, while parse() still sees its keys and
+# address, so the address is not handed out again and resume is a patch.
+SUSPENDED_PREFIX = '#~'
+
+def parse_name(comment):
+    return comment.split('[')[0].strip()
+
+class Section:
+    __slots__ = ('kind', 'start', 'header_end', 'end', 'fields', 'name', 'name_span', 'suspended')
+
+    def __init__(self, kind, start, header_end, suspended=False):
+        self.kind = kind
+        self.start = start
+        self.header_end = header_end
+        self.end = header_end
+        self.fields = {}
+        self.name = None
+        self.name_span = None
+        self.suspended = suspended
+
+    @property
+    def public_key(self):
+        return self.fields.get('PublicKey', '')
+
+    @property
+    def allowed_ips(self):
+        return self.fields.get('AllowedIPs', '')
+
+    def __repr__(self):
+        return f"Section({self.kind}, {self.name or self.public_key}, {self.start}:{self.end})"
+
+class WgConfig:
+    def __init__(self, text, sections):
+        self.text = text
+        self.sections = sections
+
+    @property
+    def interface(self):
+        return next((section for section in self.sections if section.kind == 'Interface'), None)
+
+    @property
+    def peers(self):
+        return [section for section in self.sections if section.kind == 'Peer']
+
+    def find_peer(self, public_key):
+        return next((peer for peer in self.peers if peer.public_key == public_key), None)
+
+    def unnamed_peers(self):
+        return [peer for peer in self.peers if peer.name_span is None]
+
+    def used_addresses(self):
+        return {
+            address.strip()
+            for peer in self.peers
+            for address in peer.allowed_ips.split(',')
+            if address.strip()
+        }
+
+    def next_address(self, prefix, used=None):
+        used = self.used_addresses() if used is None else used
+        for octet in range(2, 255):
+            address = f"{prefix}.{octet}/32"
+            if address not in used:
+                return address
+        return None
+
+def parse(text):
+    # Offsets are positions in text, so every section can be copied, cut or
+    # patched in place without re-serializing the rest of the file.
+    sections = []
+    section = None
+    fields = None
+    offset = 0
+    for line in text.splitlines(keepends=True):
+        end = offset + len(line)
+        stripped = line.strip()
+        suspended = stripped.startswith(SUSPENDED_PREFIX)
+        if suspended:
+            stripped = stripped[len(SUSPENDED_PREFIX):].strip()
+        if stripped:
+            first = stripped[0]
+            if first == '[':
+                if stripped[-1] == ']':
+                    if section is not None:
+                        section.end = offset
+                    section = Section(stripped[1:-1].strip(), offset, end, suspended)
+                    fields = section.fields
+                    sections.append(section)
+            elif section is not None:
+                if first == '#':
+                    if section.name_span is None:
+                        section.name = parse_name(stripped[1:])
+                        section.name_span = (offset, end)
+                else:
+                    key, sep, value = stripped.partition('=')
+                    if sep:
+                        fields[key.rstrip()] = value.lstrip()
+        offset = end
+    if section is not None:
+        section.end = offset
+    return WgConfig(text, sections)
+
+def format_peer(name, public_key, preshared_key, allowed_ips):
+    lines = ['[Peer]', f"# {name}", f"PublicKey = {public_key}"]
+    if preshared_key:
+        lines.append(f"PresharedKey = {preshared_key}")
+    lines.append(f"AllowedIPs = {allowed_ips}")
+    return '\n'.join(lines) + '\n\n'
+
+def format_client_config(address, private_key, params, server_public_key, preshared_key, endpoint):
+    # Same layout newclient.sh writes for users/<name>/<name>.conf.
+    lines = ['[Interface]', f"Address = {address}", 'DNS = 1.1.1.1, 1.0.0.1', f"PrivateKey = {private_key}"]
+    lines.extend(f"{key} = {value}" for key, value in params)
+    lines.extend([
+        '[Peer]',
+        f"PublicKey = {server_public_key}",
+        f"PresharedKey = {preshared_key}",
+        'AllowedIPs = 0.0.0.0/0',
+        f"Endpoint = {endpoint}",
+        'PersistentKeepalive = 25'
+    ])
+    return '\n'.join(lines) + '\n'
+
+def suspend_lines(text):
+    return ''.join(
+        SUSPENDED_PREFIX + line if line.strip() and not line.lstrip().startswith(SUSPENDED_PREFIX) else line
+        for line in text.splitlines(keepends=True)
+    )
+
+def resume_lines(text):
+    return ''.join(
+        line.lstrip()[len(SUSPENDED_PREFIX):] if line.lstrip().startswith(SUSPENDED_PREFIX) else line
+        for line in text.splitlines(keepends=True)
+    )
+
+class ConfigPatch:
+    def __init__(self, config):
+        self.config = config
+        self.edits = []
+        self.appended = []
+
+    def add(self, name, public_key, preshared_key, allowed_ips, suspended=False):
+        text = format_peer(name, public_key, preshared_key, allowed_ips)
+        self.appended.append(suspend_lines(text) if suspended else text)
+
+    def remove(self, peer):
+        self.edits.append((peer.start, peer.end, ''))
+
+    def suspend(self, peer):
+        self.edits.append((peer.start, peer.end, suspend_lines(self.config.text[peer.start:peer.end])))
+
+    def resume(self, peer, name=None):
+        block = self.config.text[peer.start:peer.end]
+        if name is not None:
+            # Renaming touches the same span, so it is folded into this edit.
+            if peer.name_span is not None:
+                start, end = peer.name_span
+                block = block[:start - peer.start] + f"# {name}\n" + block[end - peer.start:]
+            else:
+                offset = peer.header_end - peer.start
+                block = block[:offset] + f"# {name}\n" + block[offset:]
+        self.edits.append((peer.start, peer.end, resume_lines(block)))
+
+    def rename(self, peer, name):
+        prefix = SUSPENDED_PREFIX if peer.suspended else ''
+        if peer.name_span is not None:
+            start, end = peer.name_span
+            self.edits.append((start, end, f"{prefix}# {name}\n"))
+            return
+        text = self.config.text
+        newline = '' if text[peer.header_end - 1:peer.header_end] == '\n' else '\n'
+        self.edits.append((peer.header_end, peer.header_end, f"{newline}{prefix}# {name}\n"))
+
+    def apply(self):
+        text = self.config.text
+        parts = []
+        last = 0
+        for start, end, replacement in sorted(self.edits, key=lambda edit: (edit[0], edit[1])):
+            if start < last:
+                continue
+            parts.append(text[last:start])
+            parts.append(replacement)
+            last = end
+        parts.append(text[last:])
+        if self.appended:
+            if text and not text.endswith('\n'):
+                parts.append('\n')
+            parts.extend(self.appended)
+        return ''.join(parts)
+
+def read_file(path):
+    with open(path, 'r') as f:
+        return parse(f.read())
+
+def write_file(path, content):
+    directory = os.path.dirname(os.path.abspath(path))
+    with tempfile.NamedTemporaryFile(mode='w', delete=False, dir=directory) as temp_config:
+        temp_config.write(content)
+    if os.path.exists(path):
+        os.chmod(temp_config.name, os.stat(path).st_mode & 0o777)
+    os.replace(temp_config.name, path)
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description='Read and patch WireGuard configuration files.')
+    subparsers = parser.add_subparsers(dest='command', required=True)
+
+    get_parser = subparsers.add_parser('get', help='Print a value from the [Interface] section.')
+    get_parser.add_argument('file')
+    get_parser.add_argument('key')
+
+    params_parser = subparsers.add_parser('params', help='Print the AmneziaWG obfuscation parameters.')
+    params_parser.add_argument('file')
+
+    next_ip_parser = subparsers.add_parser('next-ip', help='Print the first free /32 address in a subnet.')
+    next_ip_parser.add_argument('file')
+    next_ip_parser.add_argument('prefix', help='First three octets, e.g. 10.8.1.')
+
+    list_parser = subparsers.add_parser('list', help='Print name, public key and allowed IPs of every peer.')
+    list_parser.add_argument('file')
+
+    add_parser = subparsers.add_parser('add', help='Append a peer.')
+    add_parser.add_argument('file')
+    add_parser.add_argument('name')
+    add_parser.add_argument('public_key')
+    add_parser.add_argument('preshared_key')
+    add_parser.add_argument('allowed_ips')
+
+    remove_parser = subparsers.add_parser('remove', help='Remove the peer with this public key.')
+    remove_parser.add_argument('file')
+    remove_parser.add_argument('public_key')
+
+    suspend_parser = subparsers.add_parser('suspend', help='Comment out the peer with this public key.')
+    suspend_parser.add_argument('file')
+    suspend_parser.add_argument('public_key')
+
+    resume_parser = subparsers.add_parser('resume', help='Restore a suspended peer with this public key.')
+    resume_parser.add_argument('file')
+    resume_parser.add_argument('public_key')
+
+    rename_parser = subparsers.add_parser('rename', help='Set the name comment of the peer with this public key.')
+    rename_parser.add_argument('file')
+    rename_parser.add_argument('public_key')
+    rename_parser.add_argument('name')
+
+    args = parser.parse_args(argv)
+    config = read_file(args.file)
+
+    if args.command == 'get':
+        interface = config.interface
+        value = interface.fields.get(args.key) if interface else None
+        if value is None:
+            print(f"Error: {args.key} not found in [Interface] of {args.file}", file=sys.stderr)
+            return 1
+        print(value)
+    elif args.command == 'params':
+        interface = config.interface
+        for key in OBFUSCATION_PARAMS:
+            if interface and key in interface.fields:
+                print(f"{key} = {interface.fields[key]}")
+    elif args.command == 'next-ip':
+        address = config.next_address(args.prefix)
+        if address is None:
+            print(f"Error: subnet {args.prefix}.0/24 is full", file=sys.stderr)
+            return 1
+        print(address)
+    elif args.command == 'list':
+        for peer in config.peers:
+            print(f"{peer.name or ''}\t{peer.public_key}\t{peer.allowed_ips}")
+    else:
+        patch = ConfigPatch(config)
+        if args.command == 'add':
+            patch.add(args.name, args.public_key, args.preshared_key, args.allowed_ips)
+        else:
+            peer = config.find_peer(args.public_key)
+            if peer is None:
+                print(f"Warning: peer {args.public_key} not found in {args.file}", file=sys.stderr)
+                return 0
+            if args.command == 'remove':
+                patch.remove(peer)
+            elif args.command == 'suspend':
+                patch.suspend(peer)
+            elif args.command == 'resume':
+                patch.resume(peer)
+            else:
+                patch.rename(peer, args.name)
+        write_file(args.file, patch.apply())
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
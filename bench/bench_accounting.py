@@ -0,0 +1,136 @@
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import statistics
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'awg'))
+sys.path.insert(0, BENCH_DIR)
+
+import fixtures
+import peers
+from accounting import AccountingEngine
+
+NOW = 1800000000
+LIMITS = (0, 5 * 10 ** 9, 10 ** 10, 3 * 10 ** 10, 10 ** 11)
+
+def make_registry(fixture_peers):
+    return peers.PeerRegistry(
+        peers.Peer(peer['name'], peer['public_key'], peer['address'], 'main', 'wg0')
+        for peer in fixture_peers
+    )
+
+def parse_dump(registry, output):
+    names, rx, tx = [], [], []
+    for line in output.splitlines():
+        fields = line.split('\t')
+        if len(fields) != 9:
+            continue
+        client = registry.find_by_key(fields[1])
+        if client is None:
+            continue
+        names.append(client.name)
+        rx.append(int(fields[6]))
+        tx.append(int(fields[7]))
+    return names, rx, tx
+
+def grow(fixture_peers, rng):
+    for peer in fixture_peers:
+        peer['rx'] += rng.randint(0, 50 * 1024 ** 2)
+        peer['tx'] += rng.randint(0, 5 * 1024 ** 2)
+
+def python_tick(state, names, rx, tx, now):
+    # The per-peer loop update_all_clients_traffic used to run, minus file I/O.
+    breached, expired = [], []
+    for name, incoming, outgoing in zip(names, rx, tx):
+        data = state[name]
+        delta_incoming = incoming - data['last_incoming']
+        delta_outgoing = outgoing - data['last_outgoing']
+        if delta_incoming < 0:
+            delta_incoming = incoming
+        if delta_outgoing < 0:
+            delta_outgoing = outgoing
+        data['total_incoming'] += delta_incoming
+        data['total_outgoing'] += delta_outgoing
+        data['last_incoming'] = incoming
+        data['last_outgoing'] = outgoing
+        if data['limit'] and data['total_incoming'] + data['total_outgoing'] >= data['limit']:
+            breached.append(name)
+        if data['expires_at'] <= now:
+            expired.append(name)
+    return breached, expired
+
+def timed(func, repeat):
+    timings = []
+    result = None
+    for _ in range(repeat):
+        started = time.perf_counter()
+        result = func()
+        timings.append(time.perf_counter() - started)
+    return statistics.median(timings), result
+
+def run(count, repeat, seed):
+    rng = random.Random(seed)
+    fixture_peers = fixtures.make_peers(count, seed=seed)
+    registry = make_registry(fixture_peers)
+    limits = {peer['name']: rng.choice(LIMITS) for peer in fixture_peers}
+    expirations = {peer['name']: NOW + rng.randint(-3600, 30 * 86400) for peer in fixture_peers}
+
+    engine = AccountingEngine()
+    state = {}
+    for peer in fixture_peers:
+        engine.add(peer['name'])
+        engine.set_subscription(peer['name'], limit=limits[peer['name']], expires_at=expirations[peer['name']])
+        state[peer['name']] = {
+            'total_incoming': 0, 'total_outgoing': 0, 'last_incoming': 0, 'last_outgoing': 0,
+            'limit': limits[peer['name']], 'expires_at': expirations[peer['name']]
+        }
+
+    grow(fixture_peers, rng)
+    dump = fixtures.make_wg_dump(fixture_peers, active_every=2, now=NOW)
+    parse_time, (names, rx, tx) = timed(lambda: parse_dump(registry, dump), repeat)
+    slots_time, slots = timed(lambda: engine.slots_of(names), repeat)
+    python_time, (python_breached, python_expired) = timed(lambda: python_tick(state, names, rx, tx, NOW), repeat)
+    engine_time, result = timed(lambda: engine.apply(slots, rx, tx, NOW), repeat)
+
+    # Every peer appears in the dump, so both paths must flag the same names.
+    assert set(engine.names_of(result.breached)) == set(python_breached)
+    assert set(engine.names_of(result.expired)) == set(python_expired)
+    return {
+        'peers': count,
+        'sampled': len(names),
+        'parse_dump_ms': parse_time * 1000,
+        'slots_of_ms': slots_time * 1000,
+        'python_loop_ms': python_time * 1000,
+        'engine_apply_ms': engine_time * 1000,
+        'speedup': python_time / engine_time if engine_time else float('nan'),
+        'breached': len(result.breached),
+        'expired': len(result.expired),
+        'python_breached': len(python_breached),
+        'python_expired': len(python_expired),
+        'engine_bytes_per_peer': sum(
+            getattr(engine, column).nbytes for column in ('last_rx', 'last_tx', 'total_rx', 'total_tx', 'limit', 'expires_at', 'used')
+        ) / engine.capacity,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Vectorized accounting engine against the per-peer Python loop.')
+    parser.add_argument('-n', '--count', type=int, default=100000, help='Number of peers.')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of measured repeats.')
+    parser.add_argument('--seed', type=int, default=0, help='Fixture seed.')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file.')
+
+    args = parser.parse_args()
+
+    result = run(args.count, args.repeat, args.seed)
+    for key, value in result.items():
+        print(f'{key}: {value:.2f}' if isinstance(value, float) else f'{key}: {value}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=4)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,85 @@
+import os
+import sys
+import json
+import time
+import random
+import asyncio
+import argparse
+import pytz
+from datetime import datetime, timedelta
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'awg'))
+
+from expiry import ExpiryEngine
+
+async def run_storm(count, spread, batch_size, ops):
+    expired = []
+    last_delivery = []
+
+    async def on_expire(keys):
+        expired.extend(keys)
+        last_delivery.append(datetime.now(pytz.UTC))
+
+    engine = ExpiryEngine(on_expire, batch_size=batch_size)
+    engine.start()
+    now = datetime.now(pytz.UTC)
+    deadline = now + timedelta(seconds=1)
+
+    started = time.perf_counter()
+    for i in range(count):
+        engine.schedule(f"client_{i}", deadline + timedelta(seconds=random.uniform(0, spread)))
+    schedule_time = time.perf_counter() - started
+
+    keys = [f"client_{i}" for i in range(count)]
+    started = time.perf_counter()
+    for _ in range(ops):
+        engine.extend(random.choice(keys), timedelta(seconds=random.uniform(0, spread)))
+    extend_time = time.perf_counter() - started
+
+    cancelled = random.sample(keys, min(ops, count) // 10)
+    started = time.perf_counter()
+    for key in cancelled:
+        engine.cancel(key)
+    cancel_time = time.perf_counter() - started
+
+    expected = count - len(cancelled)
+    last_deadline = max(engine.get(key) for key in keys if key in engine)
+    wait_started = time.perf_counter()
+    while len(expired) < expected:
+        await asyncio.sleep(0.01)
+        if time.perf_counter() - wait_started > spread * 2 + 30:
+            break
+    lag = (last_delivery[-1] - last_deadline).total_seconds() if last_delivery else float('nan')
+    engine.stop()
+
+    return {
+        'count': count,
+        'spread_seconds': spread,
+        'batch_size': batch_size,
+        'schedule_us_per_op': schedule_time / count * 1e6,
+        'extend_us_per_op': extend_time / max(ops, 1) * 1e6,
+        'cancel_us_per_op': cancel_time / max(len(cancelled), 1) * 1e6,
+        'expected': expected,
+        'expired': len(expired),
+        'lag_after_last_deadline_ms': lag * 1000,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Simulate an expiry storm against the ExpiryEngine.')
+    parser.add_argument('-n', '--count', type=int, default=10000, help='Number of subscriptions expiring.')
+    parser.add_argument('-s', '--spread', type=float, default=0.5, help='Seconds over which the deadlines are spread.')
+    parser.add_argument('-b', '--batch-size', type=int, default=500, help='Batch size passed to the expiry callback.')
+    parser.add_argument('--ops', type=int, default=10000, help='Number of extend operations before the storm.')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file.')
+
+    args = parser.parse_args()
+
+    result = asyncio.run(run_storm(args.count, args.spread, args.batch_size, args.ops))
+    for key, value in result.items():
+        print(f'{key}: {value:.2f}' if isinstance(value, float) else f'{key}: {value}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=4)
+
+if __name__ == '__main__':
+    main()
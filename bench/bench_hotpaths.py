@@ -0,0 +1,252 @@
+import os
+import sys
+import json
+import time
+import asyncio
+import logging
+import argparse
+import platform
+import tempfile
+import statistics
+import subprocess
+import importlib.util
+from datetime import datetime
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+AWG_DIR = os.path.join(BENCH_DIR, '..', 'awg')
+sys.path.insert(0, AWG_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fixtures
+
+SETTINGS = """[setting]
+bot_token = 123456:BENCHMARKBENCHMARKBENCHMARKBENCHMARK
+admin_id = 1
+docker_container = amnezia-awg
+wg_config_file = /opt/amnezia/awg/wg0.conf
+endpoint = 203.0.113.1
+"""
+
+class FixtureDocker:
+    def __init__(self):
+        self.files = {}
+        self.wg_show = ''
+
+    def output(self, cmd, node=None):
+        if ' wg show' in cmd:
+            return self.wg_show.encode('utf-8')
+        if ' cat ' in cmd:
+            return self.files[cmd.rsplit(' ', 1)[1]].encode('utf-8')
+        if ' stat ' in cmd:
+            return b'0:0:0'
+        raise subprocess.CalledProcessError(1, cmd)
+
+    def call(self, cmd, node=None):
+        return 0
+
+def load_modules(workdir):
+    os.chdir(workdir)
+    os.makedirs('files', exist_ok=True)
+    with open(os.path.join('files', 'setting.ini'), 'w') as f:
+        f.write(SETTINGS)
+    logging.disable(logging.CRITICAL)
+    import db
+    import wgconf
+    import bot_manager
+    spec = importlib.util.spec_from_file_location('awg_decode', os.path.join(AWG_DIR, 'awg-decode.py'))
+    awg_decode = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(awg_decode)
+    docker = FixtureDocker()
+    db.docker_output = docker.output
+    db.docker_call = docker.call
+    return db, wgconf, bot_manager, awg_decode, docker
+
+def measure(func, repeat, min_time):
+    started = time.perf_counter()
+    func()
+    first = time.perf_counter() - started
+    loops = max(1, int(min_time / max(first, 1e-9)))
+    timings = []
+    for _ in range(repeat):
+        started = time.perf_counter()
+        for _ in range(loops):
+            func()
+        timings.append((time.perf_counter() - started) / loops)
+    return loops, timings
+
+def build_cases(db, wgconf, bot_manager, awg_decode, docker, size, workdir):
+    peers = fixtures.make_peers(size)
+    config = fixtures.make_wg_config(peers)
+    unnamed_config = fixtures.make_wg_config(peers, unnamed_every=10)
+    clients_table = fixtures.make_clients_table(peers)
+    wg_show = fixtures.make_wg_show(peers, active_every=2)
+    transfers = fixtures.make_transfers(peers)
+    relative_times = fixtures.make_relative_times(peers)
+    client_config = fixtures.make_client_config(peers[0])
+    encoded = awg_decode.encode(client_config)
+    node = db.nodes.get_default_node()
+
+    def use_fixtures():
+        docker.files[node.wg_config_file] = config
+        docker.files[db.CLIENTS_TABLE_PATH] = clients_table
+        docker.wg_show = wg_show
+
+    def get_client_list():
+        use_fixtures()
+        db.invalidate_peer_registry(node)
+        db.get_client_list(node)
+
+    def get_cached_client_list():
+        use_fixtures()
+        db.get_client_list(node)
+
+    def get_active_list():
+        use_fixtures()
+        db.get_active_list(node)
+
+    def ensure_peer_names():
+        use_fixtures()
+        db.ensure_peer_names(unnamed_config, node)
+
+    def parse_config():
+        wgconf.parse(config)
+
+    parsed_config = wgconf.parse(unnamed_config)
+
+    def patch_config():
+        patch = wgconf.ConfigPatch(parsed_config)
+        for peer in parsed_config.unnamed_peers():
+            patch.rename(peer, f"client_{peer.public_key[:6]}")
+        patch.remove(parsed_config.peers[len(parsed_config.peers) // 2])
+        patch.add('bench_peer', peers[0]['public_key'], peers[0]['preshared_key'], '10.9.0.2/32')
+        patch.apply()
+
+    def parse_transfer():
+        for transfer in transfers:
+            bot_manager.parse_transfer(transfer)
+
+    def parse_relative_time():
+        for relative_time in relative_times:
+            bot_manager.parse_relative_time(relative_time)
+
+    loop = asyncio.new_event_loop()
+
+    async def update_all():
+        for peer in peers:
+            await bot_manager.update_traffic(peer['name'], peer['rx'], peer['tx'])
+
+    def update_traffic():
+        loop.run_until_complete(update_all())
+
+    def encode():
+        for _ in range(size):
+            awg_decode.encode(client_config)
+
+    def decode():
+        for _ in range(size):
+            awg_decode.decode(encoded)
+
+    users_dir = os.path.join(workdir, 'users')
+    for peer in peers:
+        os.makedirs(os.path.join(users_dir, peer['name']), exist_ok=True)
+        with open(os.path.join(users_dir, peer['name'], f"{peer['name']}.conf"), 'w') as f:
+            f.write(fixtures.make_client_config(peer))
+    backup_path = os.path.join(tempfile.gettempdir(), f"bench_backup_{os.getpid()}.zip")
+
+    def create_zip():
+        bot_manager.create_zip(backup_path)
+
+    cases = [
+        ('db.get_client_list', get_client_list),
+        ('db.get_client_list.cached', get_cached_client_list),
+        ('db.get_active_list', get_active_list),
+        ('db.ensure_peer_names', ensure_peer_names),
+        ('wgconf.parse', parse_config),
+        ('wgconf.patch', patch_config),
+        ('parse_transfer', parse_transfer),
+        ('parse_relative_time', parse_relative_time),
+        ('update_traffic', update_traffic),
+        ('awg-decode.encode', encode),
+        ('awg-decode.decode', decode),
+        ('create_zip', create_zip),
+    ]
+
+    def cleanup():
+        loop.close()
+        if os.path.exists(backup_path):
+            os.remove(backup_path)
+        for name in ('users', 'files/connections'):
+            path = os.path.join(workdir, name)
+            if os.path.isdir(path):
+                subprocess.call(['rm', '-rf', path])
+
+    return cases, cleanup
+
+def git_revision():
+    try:
+        return subprocess.check_output(['git', 'rev-parse', '--short', 'HEAD'], cwd=BENCH_DIR, stderr=subprocess.DEVNULL).decode().strip()
+    except (subprocess.CalledProcessError, OSError):
+        return None
+
+def compare(results, baseline_path):
+    with open(baseline_path, 'r') as f:
+        baseline = {(r['name'], r['peers']): r for r in json.load(f)['results']}
+    print(f"\nСравнение с {baseline_path}:")
+    for result in results:
+        old = baseline.get((result['name'], result['peers']))
+        if old:
+            ratio = result['median_s'] / old['median_s'] if old['median_s'] else float('nan')
+            print(f"{result['name']:<24} {result['peers']:>6}  {old['median_s'] * 1000:10.3f}мс -> {result['median_s'] * 1000:10.3f}мс  x{ratio:.2f}")
+
+def main():
+    parser = argparse.ArgumentParser(description='Microbenchmarks for parsing and accounting hot paths.')
+    parser.add_argument('--sizes', default=','.join(map(str, fixtures.SIZES)), help='Comma-separated peer counts.')
+    parser.add_argument('-k', '--filter', default='', help='Only run benchmarks whose name contains this substring.')
+    parser.add_argument('-r', '--repeat', type=int, default=5, help='Number of measured repeats per benchmark.')
+    parser.add_argument('-t', '--min-time', type=float, default=0.2, help='Target duration of one repeat in seconds.')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file.')
+    parser.add_argument('-c', '--compare', help='Compare against a previous JSON result file.')
+
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+    baseline = os.path.abspath(args.compare) if args.compare else None
+
+    results = []
+    with tempfile.TemporaryDirectory(prefix='awg-bench-') as workdir:
+        db, wgconf, bot_manager, awg_decode, docker = load_modules(workdir)
+        for size in [int(size) for size in args.sizes.split(',')]:
+            cases, cleanup = build_cases(db, wgconf, bot_manager, awg_decode, docker, size, workdir)
+            try:
+                for name, func in cases:
+                    if args.filter not in name:
+                        continue
+                    loops, timings = measure(func, args.repeat, args.min_time)
+                    result = {
+                        'name': name,
+                        'peers': size,
+                        'loops': loops,
+                        'repeat': args.repeat,
+                        'best_s': min(timings),
+                        'median_s': statistics.median(timings),
+                        'mean_s': statistics.mean(timings),
+                        'per_peer_us': statistics.median(timings) / size * 1e6,
+                    }
+                    results.append(result)
+                    print(f"{name:<24} {size:>6}  {result['median_s'] * 1000:10.3f}мс  {result['per_peer_us']:8.2f}мкс/пир  (loops={loops})")
+            finally:
+                cleanup()
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'timestamp': datetime.now().isoformat(),
+                'results': results
+            }, f, indent=4)
+    if baseline:
+        compare(results, baseline)
+
+if __name__ == '__main__':
+    main()
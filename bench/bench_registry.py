@@ -0,0 +1,102 @@
+import os
+import sys
+import gc
+import json
+import time
+import random
+import argparse
+import tracemalloc
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, os.path.join(BENCH_DIR, '..', 'awg'))
+sys.path.insert(0, BENCH_DIR)
+
+import fixtures
+import wgconf
+import peers
+
+def build_lists(config_text):
+    config = wgconf.parse(config_text)
+    return [[peer.name or 'Unknown', peer.public_key, peer.allowed_ips, 'main', 'wg0'] for peer in config.peers]
+
+def build_records(config_text):
+    config = wgconf.parse(config_text)
+    return [peers.Peer(peer.name or 'Unknown', peer.public_key, peer.allowed_ips, 'main', 'wg0') for peer in config.peers]
+
+def build_registry(config_text):
+    config = wgconf.parse(config_text)
+    return peers.PeerRegistry(
+        peers.Peer(peer.name or 'Unknown', peer.public_key, peer.allowed_ips, 'main', 'wg0')
+        for peer in config.peers
+    )
+
+def measure_memory(build, config_text):
+    gc.collect()
+    tracemalloc.start()
+    try:
+        structure = build(config_text)
+        gc.collect()
+        size = tracemalloc.get_traced_memory()[0]
+    finally:
+        tracemalloc.stop()
+    return size
+
+def measure_build(build, config_text):
+    started = time.perf_counter()
+    structure = build(config_text)
+    return structure, time.perf_counter() - started
+
+def measure_lookups(lookup, keys):
+    started = time.perf_counter()
+    for key in keys:
+        lookup(key)
+    return (time.perf_counter() - started) / len(keys)
+
+def run(count, lookups, seed):
+    fixture_peers = fixtures.make_peers(count, seed=seed)
+    config_text = fixtures.make_wg_config(fixture_peers)
+
+    lists_bytes = measure_memory(build_lists, config_text)
+    records_bytes = measure_memory(build_records, config_text)
+    registry_bytes = measure_memory(build_registry, config_text)
+    lists, lists_build = measure_build(build_lists, config_text)
+    registry, registry_build = measure_build(build_registry, config_text)
+
+    rng = random.Random(seed)
+    sample = [rng.choice(fixture_peers) for _ in range(lookups)]
+    names = [peer['name'] for peer in sample]
+    keys = [peer['public_key'] for peer in sample]
+    addresses = [peer['address'].split('/')[0] for peer in sample]
+
+    return {
+        'peers': count,
+        'lists_bytes_per_peer': lists_bytes / count,
+        'records_bytes_per_peer': records_bytes / count,
+        'registry_bytes_per_peer': registry_bytes / count,
+        'lists_build_ms': lists_build * 1000,
+        'registry_build_ms': registry_build * 1000,
+        'scan_by_name_us': measure_lookups(lambda name: next((c for c in lists if c[0] == name), None), names) * 1e6,
+        'scan_by_key_us': measure_lookups(lambda key: next((c for c in lists if c[1] == key), None), keys) * 1e6,
+        'registry_by_name_us': measure_lookups(registry.get, names) * 1e6,
+        'registry_by_key_us': measure_lookups(registry.find_by_key, keys) * 1e6,
+        'registry_by_address_us': measure_lookups(registry.find_by_address, addresses) * 1e6,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description='Memory and lookup cost of the peer registry against plain lists.')
+    parser.add_argument('-n', '--count', type=int, default=50000, help='Number of peers.')
+    parser.add_argument('-l', '--lookups', type=int, default=200, help='Number of random lookups per method.')
+    parser.add_argument('--seed', type=int, default=0, help='Fixture seed.')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file.')
+
+    args = parser.parse_args()
+
+    result = run(args.count, args.lookups, args.seed)
+    for key, value in result.items():
+        print(f'{key}: {value:.2f}' if isinstance(value, float) else f'{key}: {value}')
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(result, f, indent=4)
+
+if __name__ == '__main__':
+    main()
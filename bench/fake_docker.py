@@ -0,0 +1,438 @@
+#!/usr/bin/env python3
+import os
+import re
+import sys
+import time
+import base64
+import json
+import shlex
+import shutil
+import contextlib
+import hashlib
+
+import fixtures
+
+ROOT = os.environ.get('FAKE_DOCKER_ROOT', os.path.join(os.getcwd(), 'fake-docker'))
+EPOCH = float(os.environ.get('FAKE_DOCKER_EPOCH', 0))
+CONTAINERS = os.environ.get('FAKE_DOCKER_CONTAINERS', 'amnezia-awg').split(',')
+INTERFACE_DIR = '/opt/amnezia/awg'
+
+REDIRECT_RE = re.compile(r'\s*(?:\d?>&\d|\d?>\s*\S+)')
+
+def fail(message, code=1):
+    sys.stderr.write(message + '\n')
+    return code
+
+def container_path(container, path):
+    return os.path.join(ROOT, container, path.lstrip('/'))
+
+def write_atomic(path, data):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    temp_path = f"{path}.{os.getpid()}.tmp"
+    with open(temp_path, 'wb') as f:
+        f.write(data)
+    os.replace(temp_path, path)
+
+def up_marker(container, interface):
+    return container_path(container, f"/run/wireguard/{interface}.up")
+
+def removed_marker(container, interface):
+    return container_path(container, f"/run/wireguard/{interface}.removed")
+
+def events_log(container):
+    return os.path.join(ROOT, f"{container}.events")
+
+def frozen_marker(container):
+    return os.path.join(ROOT, f"{container}.frozen")
+
+def started_marker(container):
+    return container_path(container, '/run/started')
+
+def counter_epoch(container):
+    # Counters restart with the container.
+    try:
+        with open(started_marker(container), 'r') as f:
+            return max(float(f.read()), EPOCH)
+    except (OSError, ValueError):
+        return EPOCH
+
+def interface_name(path):
+    return os.path.basename(path).split('.')[0]
+
+def peer_hash(public_key):
+    return int.from_bytes(hashlib.sha256(public_key.encode('utf-8')).digest()[:8], 'big')
+
+def parse_peers(config):
+    peers = []
+    peer = None
+    for line in config.splitlines():
+        line = line.strip()
+        if line == '[Peer]':
+            peer = {}
+            peers.append(peer)
+        elif line.startswith('[') and line.endswith(']'):
+            peer = None
+        elif peer is not None and '=' in line and not line.startswith('#'):
+            key, value = line.split('=', 1)
+            peer[key.strip()] = value.strip()
+    return peers
+
+def live_peers(container, config_file, config):
+    # Peers removed with `wg set ... remove` stay out of the running interface
+    # until it is brought up again from the file.
+    try:
+        with open(removed_marker(container, interface_name(config_file)), 'r') as f:
+            removed = set(f.read().split())
+    except OSError:
+        removed = set()
+    return [peer for peer in parse_peers(config) if peer.get('PublicKey', '') not in removed]
+
+def set_peer(container, args):
+    if len(args) < 3 or args[1] != 'peer':
+        return fail('Usage: wg set <interface> peer <public key> [remove | allowed-ips <ips>] [peer ...]')
+    interface = args[0]
+    if not os.path.exists(up_marker(container, interface)):
+        return fail("Unable to modify interface: No such device")
+    marker = removed_marker(container, interface)
+    try:
+        with open(marker, 'r') as f:
+            removed = set(f.read().split())
+    except OSError:
+        removed = set()
+    clauses = []
+    for arg in args[1:]:
+        if arg == 'peer':
+            clauses.append([])
+        else:
+            clauses[-1].append(arg)
+    for clause in clauses:
+        if not clause:
+            return fail('Usage: wg set <interface> peer <public key> [remove | allowed-ips <ips>] [peer ...]')
+        public_key = clause[0]
+        if 'remove' in clause[1:]:
+            removed.add(public_key)
+        else:
+            if 'preshared-key' in clause[1:]:
+                sys.stdin.read()
+            removed.discard(public_key)
+    write_atomic(marker, '\n'.join(sorted(removed)).encode('utf-8'))
+    return 0
+
+def render_interface(container, config_file):
+    with open(container_path(container, config_file), 'r') as f:
+        config = f.read()
+    port = re.search(r'^ListenPort\s*=\s*(\d+)', config, re.MULTILINE)
+    lines = [
+        f"interface: {interface_name(config_file)}",
+        f"  public key: {base64.b64encode(hashlib.sha256(config_file.encode('utf-8')).digest()).decode('ascii')}",
+        '  private key: (hidden)',
+        f"  listening port: {port.group(1) if port else 51820}",
+        ''
+    ]
+    epoch = counter_epoch(container)
+    for peer in live_peers(container, config_file, config):
+        public_key = peer.get('PublicKey', '')
+        h = peer_hash(public_key)
+        lines.append(f"peer: {public_key}")
+        lines.append('  preshared key: (hidden)')
+        transfer = peer_transfer(public_key, epoch)
+        if transfer:
+            lines.append(f"  endpoint: 198.51.100.{h % 254 + 1}:{1024 + h % 60000}")
+        lines.append(f"  allowed ips: {peer.get('AllowedIPs', '(none)')}")
+        if transfer:
+            lines.append(f"  latest handshake: {fixtures.format_ago(h % 170 + 1)}")
+            lines.append(f"  transfer: {fixtures.format_size(transfer[0])} received, {fixtures.format_size(transfer[1])} sent")
+        lines.append('')
+    return '\n'.join(lines) + '\n'
+
+def peer_transfer(public_key, epoch=EPOCH):
+    h = peer_hash(public_key)
+    if h % 3 == 0:
+        return None
+    elapsed = max(time.time() - epoch, 1) if epoch else 60
+    rate = h % 4096 + 1
+    return int(rate * 1024 * elapsed), int(rate * 256 * elapsed)
+
+def render_dump(container, config_file, prefix):
+    with open(container_path(container, config_file), 'r') as f:
+        config = f.read()
+    port = re.search(r'^ListenPort\s*=\s*(\d+)', config, re.MULTILINE)
+    public_key = base64.b64encode(hashlib.sha256(config_file.encode('utf-8')).digest()).decode('ascii')
+    lines = [f"{prefix}(hidden)\t{public_key}\t{port.group(1) if port else 51820}\toff\n"]
+    now = int(time.time())
+    epoch = counter_epoch(container)
+    for peer in live_peers(container, config_file, config):
+        public_key = peer.get('PublicKey', '')
+        h = peer_hash(public_key)
+        transfer = peer_transfer(public_key, epoch)
+        if transfer:
+            endpoint = f"198.51.100.{h % 254 + 1}:{1024 + h % 60000}"
+            handshake = now - (h % 170 + 1)
+            rx, tx = transfer
+        else:
+            endpoint, handshake, rx, tx = '(none)', 0, 0, 0
+        lines.append(f"{prefix}{public_key}\t(hidden)\t{endpoint}\t{peer.get('AllowedIPs', '(none)')}\t{handshake}\t{rx}\t{tx}\toff\n")
+    return ''.join(lines)
+
+def render_transfer(container, config_file, prefix):
+    with open(container_path(container, config_file), 'r') as f:
+        config = f.read()
+    lines = []
+    epoch = counter_epoch(container)
+    for peer in live_peers(container, config_file, config):
+        public_key = peer.get('PublicKey', '')
+        rx, tx = peer_transfer(public_key, epoch) or (0, 0)
+        lines.append(f"{prefix}{public_key}\t{rx}\t{tx}\n")
+    return ''.join(lines)
+
+def up_interfaces(container):
+    directory = container_path(container, INTERFACE_DIR)
+    if not os.path.isdir(directory):
+        return []
+    return sorted(
+        os.path.join(INTERFACE_DIR, name) for name in os.listdir(directory)
+        if name.endswith('.conf') and os.path.exists(up_marker(container, interface_name(name)))
+    )
+
+def wg(container, args):
+    if not args:
+        args = ['show']
+    if args[0] in ('genkey', 'genpsk'):
+        sys.stdout.write(base64.b64encode(os.urandom(32)).decode('ascii') + '\n')
+        return 0
+    if args[0] == 'pubkey':
+        private_key = sys.stdin.read().strip()
+        sys.stdout.write(base64.b64encode(hashlib.sha256(private_key.encode('utf-8')).digest()).decode('ascii') + '\n')
+        return 0
+    if args[0] == 'show':
+        config_files = up_interfaces(container)
+        if len(args) > 1 and args[1] != 'all':
+            config_files = [path for path in config_files if interface_name(path) == args[1]]
+            if not config_files:
+                return fail("Unable to access interface: No such device")
+        if len(args) > 2 and args[2] in ('transfer', 'dump'):
+            render = render_transfer if args[2] == 'transfer' else render_dump
+            for path in config_files:
+                prefix = f"{interface_name(path)}\t" if args[1] == 'all' else ''
+                sys.stdout.write(render(container, path, prefix))
+            return 0
+        sys.stdout.write('\n'.join(render_interface(container, path) for path in config_files))
+        return 0
+    if args[0] == 'set':
+        return set_peer(container, args[1:])
+    return fail(f"Invalid subcommand: `{args[0]}'")
+
+def wg_quick(container, args):
+    if len(args) < 2:
+        return fail('Usage: wg-quick [ up | down | strip ] [ CONFIG_FILE | INTERFACE ]')
+    action, target = args[0], args[1]
+    config_file = target if '/' in target else os.path.join(INTERFACE_DIR, f"{target}.conf")
+    path = container_path(container, config_file)
+    if not os.path.exists(path):
+        return fail(f"wg-quick: `{config_file}' does not exist")
+    marker = up_marker(container, interface_name(config_file))
+    removed = removed_marker(container, interface_name(config_file))
+    if action in ('up', 'down') and os.path.exists(removed):
+        os.remove(removed)
+    if action == 'up':
+        write_atomic(marker, b'')
+    elif action == 'down':
+        if os.path.exists(marker):
+            os.remove(marker)
+    elif action == 'strip':
+        with open(path, 'r') as f:
+            for line in f:
+                line = line.split('#', 1)[0].strip()
+                if line and not re.match(r'^(PostUp|PostDown|PreUp|PreDown|Address|DNS|MTU|Table|SaveConfig)\s*=', line):
+                    sys.stdout.write(line + '\n')
+    else:
+        return fail(f"wg-quick: unknown action {action}")
+    return 0
+
+def run_shell(container, script):
+    status = 0
+    previous = None
+    for part in re.split(r'(&&|\|\||;)', script):
+        part = part.strip()
+        if part in ('&&', '||', ';'):
+            previous = part
+            continue
+        if not part or (previous == '&&' and status != 0) or (previous == '||' and status == 0):
+            continue
+        quiet = bool(REDIRECT_RE.search(part))
+        args = shlex.split(REDIRECT_RE.sub('', part))
+        if quiet:
+            with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+                status = run(container, args)
+        else:
+            status = run(container, args)
+    return status
+
+def run(container, args):
+    if not args:
+        return 0
+    command, args = os.path.basename(args[0]), args[1:]
+    if command == 'cat':
+        try:
+            with open(container_path(container, args[0]), 'rb') as f:
+                sys.stdout.flush()
+                sys.stdout.buffer.write(f.read())
+            return 0
+        except (IndexError, OSError):
+            return fail(f"cat: {args[0] if args else ''}: No such file or directory")
+    if command == 'test':
+        return 0 if len(args) == 2 and args[0] == '-f' and os.path.isfile(container_path(container, args[1])) else 1
+    if command == 'stat':
+        status = 0
+        for name in [arg for arg in args if not arg.startswith('-') and '%' not in arg]:
+            path = container_path(container, name)
+            if not os.path.exists(path):
+                status = fail(f"stat: cannot stat '{name}': No such file or directory")
+                continue
+            st = os.stat(path)
+            sys.stdout.write(f"{int(st.st_mtime)}:{st.st_size}:{st.st_ino}\n")
+        return status
+    if command == 'find':
+        name = args[args.index('-name') + 1] if '-name' in args else None
+        base = container_path(container, '/')
+        for directory, _, files in os.walk(base):
+            for filename in files:
+                if name is None or filename == name:
+                    sys.stdout.write('/' + os.path.relpath(os.path.join(directory, filename), base) + '\n')
+        return 0
+    if command == 'wg':
+        return wg(container, args)
+    if command == 'wg-quick':
+        return wg_quick(container, args)
+    if command == 'sh' and args[:1] == ['-c']:
+        return run_shell(container, args[1])
+    return fail(f"sh: {command}: not found", 127)
+
+def split_container_path(value):
+    if ':' in value and value.split(':', 1)[0] in CONTAINERS:
+        return value.split(':', 1)
+    return None, value
+
+def copy(args):
+    source_container, source = split_container_path(args[0])
+    target_container, target = split_container_path(args[1])
+    source_path = container_path(source_container, source) if source_container else source
+    target_path = container_path(target_container, target) if target_container else target
+    if not os.path.exists(source_path):
+        return fail(f"Error: No such container:path: {args[0]}")
+    if target_container:
+        with open(source_path, 'rb') as f:
+            write_atomic(target_path, f.read())
+    else:
+        shutil.copyfile(source_path, target_path)
+    return 0
+
+def append_event(container, action):
+    now = time.time_ns()
+    event = {
+        'status': action, 'id': container, 'from': 'amneziavpn/amnezia-wg', 'Type': 'container', 'Action': action,
+        'Actor': {'ID': container, 'Attributes': {'name': container}},
+        'scope': 'local', 'time': now // 10 ** 9, 'timeNano': now
+    }
+    with open(events_log(container), 'a') as f:
+        f.write(json.dumps(event) + '\n')
+
+def restart(container):
+    # The interfaces go down with the container; its entrypoint brings wg0
+    # back from the config, extra interfaces stay down.
+    append_event(container, 'die')
+    run_dir = container_path(container, '/run/wireguard')
+    if os.path.isdir(run_dir):
+        for name in os.listdir(run_dir):
+            os.remove(os.path.join(run_dir, name))
+    write_atomic(started_marker(container), str(time.time()).encode('ascii'))
+    if os.path.exists(container_path(container, os.path.join(INTERFACE_DIR, 'wg0.conf'))):
+        write_atomic(up_marker(container, 'wg0'), b'')
+    append_event(container, 'start')
+    append_event(container, 'restart')
+    sys.stdout.write(container + '\n')
+    return 0
+
+def parse_since(value):
+    if '.' in value:
+        seconds, fraction = value.split('.', 1)
+        return int(seconds) * 10 ** 9 + int(fraction.ljust(9, '0')[:9])
+    return int(value) * 10 ** 9
+
+def events(args):
+    since = time.time_ns()
+    filters = {}
+    i = 0
+    while i < len(args):
+        if args[i] == '--since':
+            since = parse_since(args[i + 1])
+            i += 1
+        elif args[i] == '--filter':
+            key, value = args[i + 1].split('=', 1)
+            filters.setdefault(key, set()).add(value)
+            i += 1
+        i += 1
+    containers = [container for container in CONTAINERS if container in filters.get('container', CONTAINERS)]
+    offsets = dict.fromkeys(containers, 0)
+    # Follows the events logs of `docker restart` until killed.
+    while True:
+        for container in containers:
+            try:
+                with open(events_log(container), 'rb') as f:
+                    f.seek(offsets[container])
+                    data = f.read()
+            except OSError:
+                continue
+            data = data[:data.rfind(b'\n') + 1]
+            offsets[container] += len(data)
+            for line in data.decode('utf-8').splitlines(keepends=True):
+                event = json.loads(line)
+                if event['timeNano'] < since or ('event' in filters and event['Action'] not in filters['event']):
+                    continue
+                sys.stdout.write(line)
+            sys.stdout.flush()
+        time.sleep(0.1)
+
+def main(argv):
+    if not argv:
+        return fail('Usage: docker [ps|exec|cp] ...')
+    command, args = argv[0], argv[1:]
+    if command == 'ps':
+        sys.stdout.write('\n'.join(CONTAINERS) + '\n')
+        return 0
+    if command == 'events':
+        try:
+            return events(args)
+        except (BrokenPipeError, KeyboardInterrupt):
+            return 0
+    if command == 'restart':
+        if not args or args[-1] not in CONTAINERS:
+            return fail(f"Error response from daemon: No such container: {args[-1] if args else ''}")
+        return restart(args[-1])
+    if command == 'cp':
+        for container in CONTAINERS:
+            while os.path.exists(frozen_marker(container)):
+                time.sleep(0.1)
+        return copy([arg for arg in args if not arg.startswith('-')])
+    if command in ('freeze', 'thaw'):
+        # Not docker commands: a frozen container accepts exec and cp but
+        # never answers, like a wedged daemon or container.
+        if not args or args[-1] not in CONTAINERS:
+            return fail(f"Error response from daemon: No such container: {args[-1] if args else ''}")
+        if command == 'freeze':
+            write_atomic(frozen_marker(args[-1]), b'')
+        elif os.path.exists(frozen_marker(args[-1])):
+            os.remove(frozen_marker(args[-1]))
+        return 0
+    if command == 'exec':
+        while args and args[0].startswith('-'):
+            args = args[1:]
+        if not args or args[0] not in CONTAINERS:
+            return fail(f"Error response from daemon: No such container: {args[0] if args else ''}")
+        while os.path.exists(frozen_marker(args[0])):
+            time.sleep(0.1)
+        return run(args[0], args[1:])
+    return fail(f"docker: '{command}' is not supported by the fake docker")
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,88 @@
+import time
+import asyncio
+import argparse
+import itertools
+from aiohttp import web
+
+BOT_USER = {'id': 123456, 'is_bot': True, 'first_name': 'AWG load test', 'username': 'awg_load_bot'}
+
+MESSAGE_METHODS = ('sendMessage', 'editMessageText', 'editMessageReplyMarkup', 'sendDocument', 'sendPhoto')
+
+class Recorder:
+    def __init__(self):
+        self.calls = []
+        self.counts = {}
+        self._waiters = []
+
+    def record(self, method, params):
+        call = (time.perf_counter(), method, params)
+        self.calls.append(call)
+        self.counts[method] = self.counts.get(method, 0) + 1
+        for waiter in list(self._waiters):
+            predicate, future = waiter
+            if not future.done() and predicate(method, params):
+                future.set_result(call)
+                self._waiters.remove(waiter)
+
+    def wait_for(self, predicate):
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append((predicate, future))
+        return future
+
+def create_app(recorder=None, latency=0.0):
+    app = web.Application()
+    app['recorder'] = recorder or Recorder()
+    app['latency'] = latency
+    message_ids = itertools.count(1000)
+
+    def make_message(method, params):
+        chat_id = int(params.get('chat_id', 0))
+        message = {
+            'message_id': int(params['message_id']) if 'message_id' in params else next(message_ids),
+            'date': int(time.time()),
+            'chat': {'id': chat_id, 'type': 'private'},
+            'from': BOT_USER
+        }
+        if method == 'sendDocument':
+            document = params.get('document')
+            message['document'] = {
+                'file_id': f"doc{message['message_id']}",
+                'file_unique_id': f"doc{message['message_id']}",
+                'file_name': getattr(document, 'filename', None) or 'document'
+            }
+            if 'caption' in params:
+                message['caption'] = params['caption']
+        elif 'text' in params:
+            message['text'] = params['text']
+        return message
+
+    async def handle_method(request):
+        if request.app['latency']:
+            await asyncio.sleep(request.app['latency'])
+        method = request.match_info['method']
+        params = dict(await request.post()) if request.can_read_body else {}
+        params.update(request.query)
+        request.app['recorder'].record(method, params)
+        if method == 'getMe':
+            result = BOT_USER
+        elif method in MESSAGE_METHODS:
+            result = make_message(method, params)
+        else:
+            result = True
+        return web.json_response({'ok': True, 'result': result})
+
+    app.router.add_route('*', '/bot{token}/{method}', handle_method)
+    return app
+
+def main():
+    parser = argparse.ArgumentParser(description='Local stand-in for the Telegram Bot API.')
+    parser.add_argument('--host', default='localhost', help='Address to listen on.')
+    parser.add_argument('-p', '--port', type=int, default=8081, help='Port to listen on.')
+    parser.add_argument('-l', '--latency', type=float, default=0.0, help='Artificial latency of every API call in seconds.')
+
+    args = parser.parse_args()
+
+    web.run_app(create_app(latency=args.latency), host=args.host, port=args.port)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,152 @@
+import os
+import json
+import base64
+import random
+import argparse
+
+SIZES = (100, 1000, 10000)
+
+SERVER_INTERFACE = """[Interface]
+PrivateKey = {private_key}
+Address = 10.8.1.0/24
+ListenPort = 51820
+Jc = 4
+Jmin = 40
+Jmax = 70
+S1 = 52
+S2 = 88
+H1 = 1387348208
+H2 = 1583561364
+H3 = 1049213521
+H4 = 2104523412
+
+"""
+
+def make_key(rng):
+    return base64.b64encode(rng.randbytes(32)).decode('ascii')
+
+def make_peers(count, seed=0):
+    rng = random.Random(seed)
+    peers = []
+    for i in range(count):
+        peers.append({
+            'name': f"client_{i}",
+            'public_key': make_key(rng),
+            'preshared_key': make_key(rng),
+            'address': f"10.{8 + (i + 2) // 65536}.{(i + 2) // 256 % 256}.{(i + 2) % 256}/32",
+            'endpoint': f"{rng.randint(1, 223)}.{rng.randint(0, 255)}.{rng.randint(0, 255)}.{rng.randint(1, 254)}:{rng.randint(1024, 65535)}",
+            'rx': rng.randint(0, 50 * 1024 ** 3),
+            'tx': rng.randint(0, 5 * 1024 ** 3),
+            'handshake': rng.randint(1, 3600)
+        })
+    return peers
+
+def make_wg_config(peers, unnamed_every=0, seed=0):
+    rng = random.Random(seed)
+    parts = [SERVER_INTERFACE.format(private_key=make_key(rng))]
+    for i, peer in enumerate(peers):
+        parts.append('[Peer]\n')
+        if not unnamed_every or i % unnamed_every:
+            parts.append(f"# {peer['name']}\n")
+        parts.append(f"PublicKey = {peer['public_key']}\n")
+        parts.append(f"PresharedKey = {peer['preshared_key']}\n")
+        parts.append(f"AllowedIPs = {peer['address']}\n\n")
+    return ''.join(parts)
+
+def make_clients_table(peers):
+    return json.dumps([
+        {'clientId': peer['public_key'], 'userData': {'clientName': peer['name'], 'creationDate': 'Mon Oct 19 12:00:00 UTC 2026'}}
+        for peer in peers
+    ])
+
+def format_size(value):
+    for unit, scale in (('GiB', 1024 ** 3), ('MiB', 1024 ** 2), ('KiB', 1024)):
+        if value >= scale:
+            return f"{value / scale:.2f} {unit}"
+    return f"{value} B"
+
+def format_ago(seconds):
+    minutes, seconds = divmod(seconds, 60)
+    hours, minutes = divmod(minutes, 60)
+    parts = []
+    for value, unit in ((hours, 'hour'), (minutes, 'minute'), (seconds, 'second')):
+        if value:
+            parts.append(f"{value} {unit}{'s' if value != 1 else ''}")
+    return ', '.join(parts or ['1 second']) + ' ago'
+
+def make_wg_show(peers, active_every=1, seed=0):
+    rng = random.Random(seed)
+    lines = [
+        'interface: wg0',
+        f"  public key: {make_key(rng)}",
+        '  private key: (hidden)',
+        '  listening port: 51820',
+        ''
+    ]
+    for i, peer in enumerate(peers):
+        lines.append(f"peer: {peer['public_key']}")
+        lines.append('  preshared key: (hidden)')
+        if i % active_every == 0:
+            lines.append(f"  endpoint: {peer['endpoint']}")
+        lines.append(f"  allowed ips: {peer['address']}")
+        if i % active_every == 0:
+            lines.append(f"  latest handshake: {format_ago(peer['handshake'])}")
+            lines.append(f"  transfer: {format_size(peer['rx'])} received, {format_size(peer['tx'])} sent")
+        lines.append('')
+    return '\n'.join(lines)
+
+def make_wg_dump(peers, active_every=1, now=1800000000, seed=0, interface='wg0'):
+    rng = random.Random(seed)
+    lines = [f"{interface}\t{make_key(rng)}\t{make_key(rng)}\t51820\toff"]
+    for i, peer in enumerate(peers):
+        if i % active_every == 0:
+            lines.append(f"{interface}\t{peer['public_key']}\t{peer['preshared_key']}\t{peer['endpoint']}\t{peer['address']}\t{now - peer['handshake']}\t{peer['rx']}\t{peer['tx']}\toff")
+        else:
+            lines.append(f"{interface}\t{peer['public_key']}\t{peer['preshared_key']}\t(none)\t{peer['address']}\t0\t0\t0\toff")
+    return '\n'.join(lines) + '\n'
+
+def make_transfers(peers):
+    return [f"{format_size(peer['rx'])} received, {format_size(peer['tx'])} sent" for peer in peers]
+
+def make_relative_times(peers):
+    return [format_ago(peer['handshake']) for peer in peers]
+
+def make_client_config(peer, server_public_key='c2VydmVyLXB1YmxpYy1rZXktZm9yLWJlbmNobWFya3M='):
+    return (
+        "[Interface]\n"
+        f"Address = {peer['address']}\n"
+        "DNS = 1.1.1.1, 1.0.0.1\n"
+        f"PrivateKey = {peer['preshared_key']}\n"
+        "Jc = 4\nJmin = 40\nJmax = 70\nS1 = 52\nS2 = 88\n"
+        "H1 = 1387348208\nH2 = 1583561364\nH3 = 1049213521\nH4 = 2104523412\n"
+        "[Peer]\n"
+        f"PublicKey = {server_public_key}\n"
+        f"PresharedKey = {peer['preshared_key']}\n"
+        "AllowedIPs = 0.0.0.0/0\n"
+        "Endpoint = 203.0.113.1:51820\n"
+        "PersistentKeepalive = 25\n"
+    )
+
+def write_fixtures(directory, sizes=SIZES, seed=0):
+    os.makedirs(directory, exist_ok=True)
+    for size in sizes:
+        peers = make_peers(size, seed)
+        with open(os.path.join(directory, f"wg0_{size}.conf"), 'w') as f:
+            f.write(make_wg_config(peers, seed=seed))
+        with open(os.path.join(directory, f"clientsTable_{size}.json"), 'w') as f:
+            f.write(make_clients_table(peers))
+        with open(os.path.join(directory, f"wg_show_{size}.txt"), 'w') as f:
+            f.write(make_wg_show(peers, seed=seed))
+
+def main():
+    parser = argparse.ArgumentParser(description='Generate wg0.conf, clientsTable and wg show fixtures.')
+    parser.add_argument('directory', help='Directory to write the fixtures to.')
+    parser.add_argument('--sizes', default=','.join(map(str, SIZES)), help='Comma-separated peer counts.')
+    parser.add_argument('--seed', type=int, default=0, help='Random seed.')
+
+    args = parser.parse_args()
+
+    write_fixtures(args.directory, [int(size) for size in args.sizes.split(',')], args.seed)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,488 @@
+import os
+import sys
+import json
+import time
+import random
+import shutil
+import socket
+import asyncio
+import argparse
+import platform
+import tempfile
+import itertools
+import statistics
+import subprocess
+from datetime import datetime, timedelta, timezone
+
+import aiohttp
+from aiohttp import web
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+AWG_DIR = os.path.abspath(os.path.join(BENCH_DIR, '..', 'awg'))
+sys.path.insert(0, AWG_DIR)
+sys.path.insert(0, BENCH_DIR)
+
+import fixtures
+import fake_telegram
+import fake_yookassa
+from bench_hotpaths import git_revision
+
+ADMIN_ID = 1
+CONTAINER = 'amnezia-awg'
+WG_CONFIG_FILE = '/opt/amnezia/awg/wg0.conf'
+CLIENTS_TABLE_PATH = '/opt/amnezia/awg/clientsTable'
+SCENARIOS = ('expiry', 'adds', 'browse', 'payments', 'restart', 'outage')
+
+SETTINGS = """[setting]
+bot_token = 123456:LOADTESTLOADTESTLOADTESTLOADTESTLOAD
+admin_id = {admin_id}
+docker_container = {container}
+wg_config_file = {wg_config_file}
+endpoint = 203.0.113.1
+shard_ports = {shard_ports}
+update_mode = webhook
+webapp_host = 127.0.0.1
+webapp_port = {bot_port}
+telegram_api_server = http://127.0.0.1:{telegram_port}
+yookassa_account_id = load
+yookassa_secret_key = load
+yookassa_api_url = http://127.0.0.1:{yookassa_port}/v3
+slot_pool_size = {slot_pool}
+docker_timeout = {docker_timeout}
+circuit_reset = {circuit_reset}
+"""
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+def percentile(values, q):
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, max(0, int(round(q / 100 * len(ordered))) - 1))]
+
+def summarize(name, latencies, wall, errors=0):
+    result = {'scenario': name, 'count': len(latencies), 'errors': errors, 'wall_s': wall}
+    result['throughput_per_s'] = len(latencies) / wall if wall else 0.0
+    if latencies:
+        result.update({
+            'p50_ms': percentile(latencies, 50) * 1000,
+            'p90_ms': percentile(latencies, 90) * 1000,
+            'p99_ms': percentile(latencies, 99) * 1000,
+            'max_ms': max(latencies) * 1000,
+            'mean_ms': statistics.mean(latencies) * 1000
+        })
+    print(
+        f"{name:<22} n={len(latencies):<6} err={errors:<4} "
+        + (f"p50={result['p50_ms']:8.1f}мс p90={result['p90_ms']:8.1f}мс p99={result['p99_ms']:8.1f}мс max={result['max_ms']:8.1f}мс " if latencies else '')
+        + f"{result['throughput_per_s']:7.2f}/с за {wall:.1f}с"
+    )
+    return result
+
+class Harness:
+    def __init__(self, workdir, telegram_latency=0.0, yookassa_latency=0.0, auto_succeed=0.1, slot_pool=0, docker_timeout=5.0, circuit_reset=5.0):
+        self.workdir = workdir
+        self.slot_pool = slot_pool
+        self.docker_timeout = docker_timeout
+        self.circuit_reset = circuit_reset
+        self.state_dir = os.path.join(workdir, 'docker')
+        self.bot_port = free_port()
+        self.telegram_port = free_port()
+        self.yookassa_port = free_port()
+        self.recorder = fake_telegram.Recorder()
+        self.telegram_latency = telegram_latency
+        self.yookassa_latency = yookassa_latency
+        self.auto_succeed = auto_succeed
+        self.update_ids = itertools.count(1)
+        self.epoch = time.time()
+        self.process = None
+        self.runners = []
+        self.session = None
+
+    @property
+    def bot_url(self):
+        return f"http://127.0.0.1:{self.bot_port}"
+
+    def container_file(self, path):
+        return os.path.join(self.state_dir, CONTAINER, path.lstrip('/'))
+
+    def prepare(self, expiring_peers, expire_at):
+        os.makedirs(os.path.join(self.workdir, 'files'), exist_ok=True)
+        for name in ('newclient.sh', 'removeclient.sh', 'wgconf.py', 'awg-decode.py'):
+            shutil.copy(os.path.join(AWG_DIR, name), self.workdir)
+        with open(os.path.join(self.workdir, 'files', 'setting.ini'), 'w') as f:
+            f.write(SETTINGS.format(
+                admin_id=ADMIN_ID,
+                container=CONTAINER,
+                wg_config_file=WG_CONFIG_FILE,
+                shard_ports=','.join(str(port) for port in range(51821, 51861)),
+                bot_port=self.bot_port,
+                telegram_port=self.telegram_port,
+                yookassa_port=self.yookassa_port,
+                slot_pool=self.slot_pool,
+                docker_timeout=self.docker_timeout,
+                circuit_reset=self.circuit_reset
+            ))
+
+        bin_dir = os.path.join(self.workdir, 'bin')
+        os.makedirs(bin_dir, exist_ok=True)
+        docker = os.path.join(bin_dir, 'docker')
+        with open(docker, 'w') as f:
+            f.write(f'#!/bin/sh\nexec "{sys.executable}" "{os.path.join(BENCH_DIR, "fake_docker.py")}" "$@"\n')
+        os.chmod(docker, 0o755)
+        os.symlink(sys.executable, os.path.join(bin_dir, 'python3.11'))
+
+        peers = fixtures.make_peers(len(expiring_peers))
+        for peer, name in zip(peers, expiring_peers):
+            peer['name'] = name
+        os.makedirs(os.path.dirname(self.container_file(WG_CONFIG_FILE)), exist_ok=True)
+        with open(self.container_file(WG_CONFIG_FILE), 'w') as f:
+            f.write(fixtures.make_wg_config(peers))
+        with open(self.container_file(CLIENTS_TABLE_PATH), 'w') as f:
+            f.write(fixtures.make_clients_table(peers))
+        os.makedirs(self.container_file('/run/wireguard'), exist_ok=True)
+        open(self.container_file('/run/wireguard/wg0.up'), 'w').close()
+        with open(os.path.join(self.workdir, 'files', 'expirations.json'), 'w') as f:
+            json.dump({
+                name: {'expiration_time': expire_at.isoformat(), 'traffic_limit': 'Неограниченно'}
+                for name in expiring_peers
+            }, f)
+
+    async def start_fakes(self):
+        telegram = fake_telegram.create_app(self.recorder, self.telegram_latency)
+        yookassa = fake_yookassa.create_app(f"{self.bot_url}/yookassa-webhook", self.auto_succeed, self.yookassa_latency)
+        for app, port in ((telegram, self.telegram_port), (yookassa, self.yookassa_port)):
+            runner = web.AppRunner(app, access_log=None)
+            await runner.setup()
+            await web.TCPSite(runner, '127.0.0.1', port).start()
+            self.runners.append(runner)
+        self.session = aiohttp.ClientSession(timeout=aiohttp.ClientTimeout(total=None))
+
+    def env(self):
+        env = os.environ.copy()
+        env['PATH'] = os.path.join(self.workdir, 'bin') + os.pathsep + env.get('PATH', '')
+        env['PYTHON'] = sys.executable
+        env['FAKE_DOCKER_ROOT'] = self.state_dir
+        env['FAKE_DOCKER_EPOCH'] = str(self.epoch)
+        env['FAKE_DOCKER_CONTAINERS'] = CONTAINER
+        return env
+
+    async def start_bot(self, timeout=60):
+        self.epoch = time.time()
+        self.log = open(os.path.join(self.workdir, 'bot.log'), 'ab')
+        self.process = subprocess.Popen(
+            [sys.executable, os.path.join(AWG_DIR, 'bot_manager.py')],
+            cwd=self.workdir, env=self.env(), stdout=self.log, stderr=subprocess.STDOUT
+        )
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"bot_manager завершился с кодом {self.process.returncode}, см. {self.log.name}")
+            try:
+                async with self.session.get(f"{self.bot_url}/metrics") as resp:
+                    if resp.status == 200:
+                        return
+            except aiohttp.ClientError:
+                pass
+            await asyncio.sleep(0.1)
+        raise RuntimeError(f"bot_manager не ответил за {timeout}с, см. {self.log.name}")
+
+    async def stop(self):
+        if self.process and self.process.poll() is None:
+            self.process.terminate()
+            try:
+                await asyncio.get_running_loop().run_in_executor(None, self.process.wait, 10)
+            except subprocess.TimeoutExpired:
+                self.process.kill()
+        if self.session:
+            await self.session.close()
+        for runner in self.runners:
+            await runner.cleanup()
+
+    async def metrics(self):
+        async with self.session.get(f"{self.bot_url}/metrics") as resp:
+            return await resp.text()
+
+    def peer_names(self):
+        with open(self.container_file(WG_CONFIG_FILE), 'r') as f:
+            names = [line[2:].strip() for line in f if line.startswith('# ')]
+        for path in os.listdir(os.path.dirname(self.container_file(WG_CONFIG_FILE))):
+            if path.endswith('.conf') and path != os.path.basename(WG_CONFIG_FILE):
+                with open(os.path.join(os.path.dirname(self.container_file(WG_CONFIG_FILE)), path), 'r') as f:
+                    names.extend(line[2:].strip() for line in f if line.startswith('# '))
+        return names
+
+    def user(self, user_id):
+        return {'id': user_id, 'is_bot': False, 'first_name': f"user{user_id}"}
+
+    def message(self, user_id, text):
+        update_id = next(self.update_ids)
+        message = {
+            'message_id': update_id,
+            'date': int(time.time()),
+            'chat': {'id': user_id, 'type': 'private'},
+            'from': self.user(user_id),
+            'text': text
+        }
+        if text.startswith('/'):
+            message['entities'] = [{'type': 'bot_command', 'offset': 0, 'length': len(text.split()[0])}]
+        return {'update_id': update_id, 'message': message}
+
+    def callback(self, user_id, data):
+        update_id = next(self.update_ids)
+        return {
+            'update_id': update_id,
+            'callback_query': {
+                'id': str(update_id),
+                'from': self.user(user_id),
+                'chat_instance': str(user_id),
+                'data': data,
+                'message': {
+                    'message_id': 1,
+                    'date': int(time.time()),
+                    'chat': {'id': user_id, 'type': 'private'},
+                    'from': fake_telegram.BOT_USER,
+                    'text': 'Выберите действие:'
+                }
+            }
+        }
+
+    async def post(self, update):
+        started = time.perf_counter()
+        async with self.session.post(f"{self.bot_url}/telegram-webhook", json=update) as resp:
+            await resp.read()
+            return time.perf_counter() - started, resp.status
+
+    async def run_expiry(self, names, expire_at, timeout):
+        pending = set(names)
+        latencies = []
+        deadline = time.monotonic() + timeout
+        while pending and time.monotonic() < deadline:
+            removed = pending - set(self.peer_names())
+            now = datetime.now(timezone.utc)
+            for name in removed:
+                latencies.append(max((now - expire_at).total_seconds(), 0.0))
+            pending -= removed
+            await asyncio.sleep(0.2)
+        wall = max((datetime.now(timezone.utc) - expire_at).total_seconds(), 0.0)
+        return [summarize('expiry', latencies, wall, errors=len(pending))]
+
+    async def run_adds(self, count):
+        await self.post(self.message(ADMIN_ID, '/start'))
+        totals, provision = [], []
+        errors = 0
+        started = time.perf_counter()
+        for i in range(count):
+            name = f"load_{i}"
+            steps = [
+                self.callback(ADMIN_ID, 'add_user'),
+                self.message(ADMIN_ID, name),
+                self.callback(ADMIN_ID, f"duration_1m_{name}_noipv6"),
+                self.callback(ADMIN_ID, f"traffic_limit_{'5 GB' if i % 2 else 'Неограниченно'}_{name}")
+            ]
+            document = self.recorder.wait_for(lambda method, params: method == 'sendDocument' and params.get('chat_id') == str(ADMIN_ID))
+            total = 0.0
+            for update in steps:
+                elapsed, status = await self.post(update)
+                total += elapsed
+                errors += status != 200
+            provision.append(elapsed)
+            totals.append(total)
+            if not document.done():
+                document.cancel()
+                errors += 1
+        wall = time.perf_counter() - started
+        return [summarize('adds', totals, wall, errors), summarize('adds:traffic_limit', provision, wall)]
+
+    async def run_browse(self, count, concurrency, seed=0, label='browse'):
+        names = self.peer_names()
+        if not names:
+            print(f"{label}: нет пользователей для просмотра, сценарий пропущен")
+            return []
+        rng = random.Random(seed)
+        updates = []
+        for i in range(count):
+            data = 'list_users' if i % 2 == 0 else f"client_{rng.choice(names)}"
+            updates.append(self.callback(ADMIN_ID, data))
+        queue = asyncio.Queue()
+        for update in updates:
+            queue.put_nowait(update)
+        latencies = {'list_users': [], 'client': []}
+        errors = 0
+
+        async def worker():
+            nonlocal errors
+            while not queue.empty():
+                update = queue.get_nowait()
+                elapsed, status = await self.post(update)
+                key = 'list_users' if update['callback_query']['data'] == 'list_users' else 'client'
+                latencies[key].append(elapsed)
+                errors += status != 200
+
+        started = time.perf_counter()
+        await asyncio.gather(*(worker() for _ in range(concurrency)))
+        wall = time.perf_counter() - started
+        return [
+            summarize(label, latencies['list_users'] + latencies['client'], wall, errors),
+            summarize(f"{label}:list_users", latencies['list_users'], wall),
+            summarize(f"{label}:client", latencies['client'], wall)
+        ]
+
+    async def run_payments(self, count, timeout, first_user=100000):
+        callbacks, end_to_end = [], []
+        errors = 0
+
+        async def pay(user_id):
+            nonlocal errors
+            document = self.recorder.wait_for(lambda method, params: method == 'sendDocument' and params.get('chat_id') == str(user_id))
+            started = time.perf_counter()
+            elapsed, status = await self.post(self.callback(user_id, 'buy_1'))
+            callbacks.append(elapsed)
+            if status != 200:
+                errors += 1
+                document.cancel()
+                return
+            try:
+                sent_at, _, _ = await asyncio.wait_for(document, timeout)
+                end_to_end.append(sent_at - started)
+            except asyncio.TimeoutError:
+                errors += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(pay(first_user + i) for i in range(count)))
+        wall = time.perf_counter() - started
+        return [summarize('payments', end_to_end, wall, errors), summarize('payments:buy', callbacks, wall)]
+
+    async def run_restarts(self, count, timeout):
+        latencies = []
+        errors = 0
+        started = time.perf_counter()
+        for _ in range(count):
+            notified = self.recorder.wait_for(
+                lambda method, params: method == 'sendMessage' and params.get('chat_id') == str(ADMIN_ID) and 'перезапущен' in params.get('text', '')
+            )
+            restarted = time.perf_counter()
+            process = await asyncio.create_subprocess_exec(
+                os.path.join(self.workdir, 'bin', 'docker'), 'restart', CONTAINER,
+                stdout=subprocess.DEVNULL, env=self.env()
+            )
+            await process.wait()
+            try:
+                sent_at, _, _ = await asyncio.wait_for(notified, timeout)
+                latencies.append(sent_at - restarted)
+            except asyncio.TimeoutError:
+                errors += 1
+        wall = time.perf_counter() - started
+        return [summarize('restart', latencies, wall, errors)]
+
+    async def docker(self, *args):
+        process = await asyncio.create_subprocess_exec(
+            os.path.join(self.workdir, 'bin', 'docker'), *args,
+            stdout=subprocess.DEVNULL, env=self.env()
+        )
+        await process.wait()
+
+    async def run_outage(self, count, concurrency, timeout):
+        # Browsing against a container that stopped answering, then the time
+        # until the bot serves fresh data again once it answers.
+        await self.docker('freeze', CONTAINER)
+        stale_before = sum(1 for _, _, params in self.recorder.calls if '⚠️ Контейнер' in params.get('text', ''))
+        try:
+            results = await self.run_browse(count, concurrency, seed=1, label='outage')
+        finally:
+            await self.docker('thaw', CONTAINER)
+        stale = sum(1 for _, _, params in self.recorder.calls if '⚠️ Контейнер' in params.get('text', '')) - stale_before
+        print(f"outage: ответов с пометкой об устаревших данных: {stale}")
+        started = time.perf_counter()
+        deadline = time.monotonic() + timeout
+        recovered = []
+        while time.monotonic() < deadline:
+            fresh = self.recorder.wait_for(
+                lambda method, params: method in ('editMessageText', 'sendMessage') and params.get('text') == 'Выберите пользователя:'
+            )
+            await self.post(self.callback(ADMIN_ID, 'list_users'))
+            await asyncio.sleep(0.5)
+            if fresh.done():
+                recovered.append(time.perf_counter() - started)
+                break
+            fresh.cancel()
+        return results + [summarize('outage:recovery', recovered, time.perf_counter() - started, errors=0 if recovered else 1)]
+
+async def run(args, workdir):
+    scenarios = [name for name in args.scenarios.split(',') if name]
+    expiring = [f"expire_{i}" for i in range(args.expire)] if 'expiry' in scenarios else []
+    expire_at = datetime.now(timezone.utc) + timedelta(seconds=args.expire_delay)
+    harness = Harness(workdir, args.telegram_latency, args.yookassa_latency, args.auto_succeed, args.slot_pool, args.docker_timeout, args.circuit_reset)
+    harness.prepare(expiring, expire_at)
+    results = []
+    try:
+        await harness.start_fakes()
+        started = time.perf_counter()
+        await harness.start_bot()
+        print(f"bot_manager готов за {time.perf_counter() - started:.2f}с, рабочий каталог {workdir}")
+        for scenario in scenarios:
+            if scenario == 'expiry' and expiring:
+                results += await harness.run_expiry(expiring, expire_at, args.timeout)
+            elif scenario == 'adds' and args.adds:
+                results += await harness.run_adds(args.adds)
+            elif scenario == 'browse' and args.browse:
+                results += await harness.run_browse(args.browse, args.concurrency)
+            elif scenario == 'payments' and args.payments:
+                results += await harness.run_payments(args.payments, args.timeout)
+            elif scenario == 'restart' and args.restarts:
+                results += await harness.run_restarts(args.restarts, args.timeout)
+            elif scenario == 'outage' and args.outage:
+                results += await harness.run_outage(args.outage, args.concurrency, args.timeout)
+        with open(os.path.join(workdir, 'metrics.txt'), 'w') as f:
+            f.write(await harness.metrics())
+        print(f"Запросы к фейковому Bot API: {json.dumps(harness.recorder.counts, ensure_ascii=False)}")
+        print(f"Пиров в конфигурации после прогона: {len(harness.peer_names())}")
+    finally:
+        await harness.stop()
+    return results
+
+def main():
+    parser = argparse.ArgumentParser(description='End-to-end load harness: bot_manager against fake Telegram, docker/WireGuard and YooKassa.')
+    parser.add_argument('-s', '--scenarios', default=','.join(SCENARIOS), help=f"Comma-separated scenarios to run in order ({', '.join(SCENARIOS)}).")
+    parser.add_argument('--adds', type=int, default=1000, help='Number of users added through the admin flow.')
+    parser.add_argument('--expire', type=int, default=200, help='Number of pre-seeded users that expire right after startup.')
+    parser.add_argument('--expire-delay', type=float, default=5.0, help='Seconds after launch at which the seeded users expire.')
+    parser.add_argument('--browse', type=int, default=200, help='Number of list_users/client_ callbacks.')
+    parser.add_argument('-c', '--concurrency', type=int, default=4, help='Concurrent admin callbacks in the browse scenario.')
+    parser.add_argument('--payments', type=int, default=50, help='Number of simultaneous purchases in the payment burst.')
+    parser.add_argument('--restarts', type=int, default=3, help='Number of container restarts the bot has to notice and resync after.')
+    parser.add_argument('--outage', type=int, default=40, help='Number of list_users/client_ callbacks while the container does not answer.')
+    parser.add_argument('--docker-timeout', type=float, default=5.0, help='docker_timeout of the bot in seconds.')
+    parser.add_argument('--circuit-reset', type=float, default=5.0, help='circuit_reset of the bot in seconds.')
+    parser.add_argument('--slot-pool', type=int, default=0, help='slot_pool_size of the bot: pre-provisioned peers claimed by adds and payments.')
+    parser.add_argument('--auto-succeed', type=float, default=0.1, help='Delay before the fake YooKassa marks a payment as succeeded.')
+    parser.add_argument('--telegram-latency', type=float, default=0.0, help='Artificial latency of every fake Bot API call in seconds.')
+    parser.add_argument('--yookassa-latency', type=float, default=0.0, help='Artificial latency of every fake YooKassa call in seconds.')
+    parser.add_argument('-t', '--timeout', type=float, default=600.0, help='Timeout of the expiry and payment scenarios in seconds.')
+    parser.add_argument('-o', '--output', help='Write results as JSON to this file.')
+    parser.add_argument('-k', '--keep', action='store_true', help='Keep the working directory with bot.log, metrics.txt and the fake container state.')
+
+    args = parser.parse_args()
+    output = os.path.abspath(args.output) if args.output else None
+
+    base = '/dev/shm' if os.path.isdir('/dev/shm') and os.access('/dev/shm', os.W_OK) else None
+    workdir = tempfile.mkdtemp(prefix='awg-load-', dir=base)
+    try:
+        results = asyncio.run(run(args, workdir))
+    finally:
+        if not args.keep:
+            shutil.rmtree(workdir, ignore_errors=True)
+
+    if output:
+        with open(output, 'w') as f:
+            json.dump({
+                'revision': git_revision(),
+                'python': platform.python_version(),
+                'platform': platform.platform(),
+                'timestamp': datetime.now().isoformat(),
+                'arguments': vars(args),
+                'results': results
+            }, f, indent=4)
+
+if __name__ == '__main__':
+    main()
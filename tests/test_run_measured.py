@@ -0,0 +1,48 @@
+import os
+import sys
+import unittest
+import subprocess
+from unittest import mock
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..', 'awg'))
+
+import db
+import nodes
+import circuit
+
+class HalfOpenProbeTest(unittest.TestCase):
+    def half_open_node(self, name):
+        node = nodes.Node(name, 'amnezia-awg', '/opt/amnezia/awg/wg0.conf', '127.0.0.1', circuit_threshold=1, circuit_reset=0.0)
+        db.get_breaker(node).trip()
+        return node
+
+    def test_spawn_error_settles_probe(self):
+        node = self.half_open_node('probe-oserror')
+        with mock.patch.object(db, 'run_process_group', side_effect=OSError("fork failed")):
+            with self.assertRaises(OSError):
+                db.run_measured(subprocess.check_output, 'docker exec -i amnezia-awg wg show', node, shell=True)
+        breaker = db.get_breaker(node)
+        self.assertEqual(breaker.state, circuit.OPEN)
+        # The next probe is let through and closes the circuit.
+        with mock.patch.object(db, 'run_process_group', return_value=(0, b'wg0', b'')):
+            self.assertEqual(db.run_measured(subprocess.check_output, 'docker exec -i amnezia-awg wg show', node, shell=True), b'wg0')
+        self.assertEqual(breaker.state, circuit.CLOSED)
+
+    def test_env_error_settles_probe(self):
+        node = self.half_open_node('probe-env')
+        with mock.patch.object(node, 'env', side_effect=KeyError('DOCKER_HOST')):
+            with self.assertRaises(KeyError):
+                db.run_measured(subprocess.call, 'docker ps', node, shell=True)
+        with mock.patch.object(db, 'run_process_group', return_value=(0, b'', b'')):
+            self.assertEqual(db.run_measured(subprocess.call, 'docker ps', node, shell=True), 0)
+        self.assertEqual(db.get_breaker(node).state, circuit.CLOSED)
+
+    def test_application_error_closes_circuit(self):
+        node = self.half_open_node('probe-app-error')
+        with mock.patch.object(db, 'run_process_group', return_value=(1, b'', b'no such peer')):
+            with self.assertRaises(subprocess.CalledProcessError):
+                db.run_measured(subprocess.check_call, 'docker exec -i amnezia-awg wg set wg0', node, shell=True)
+        self.assertEqual(db.get_breaker(node).state, circuit.CLOSED)
+
+if __name__ == '__main__':
+    unittest.main()